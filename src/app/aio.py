@@ -0,0 +1,33 @@
+"""
+Helpers for the async views.
+
+Views written `async def` run on the event loop when the site is served
+through app.asgi (uvicorn, daphne), so a request waiting on Stripe or S3 holds
+no thread. That needs every middleware to be async-capable, which is why the
+app's own middleware supports both modes. Under gunicorn's WSGI workers Django
+runs the same views through async_to_sync, one request per thread as before.
+
+The database layer, sessions included, is synchronous. `db` runs a function
+with sync_to_async in the request's thread-sensitive executor, so a request
+keeps to one connection as a sync view does. `blocking` runs other blocking
+work (boto3 uploads, Pillow, multipart parsing) in the loop's thread pool.
+"""
+from asgiref.sync import sync_to_async
+
+
+async def db(fn, *args, **kwargs):
+    return await sync_to_async(fn)(*args, **kwargs)
+
+
+async def blocking(fn, *args, **kwargs):
+    return await sync_to_async(fn, thread_sensitive=False)(*args, **kwargs)
+
+
+async def session_get(request, key, default=None):
+    # The session loads from the database on first access
+    return await db(request.session.get, key, default)
+
+
+async def form(request):
+    """(request.POST, request.FILES), parsed off the event loop."""
+    return await blocking(lambda: (request.POST, request.FILES))
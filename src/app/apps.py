@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class WallifyConfig(AppConfig):
+    name = 'app'
+    default_auto_field = 'django.db.models.BigAutoField'
+
+    def ready(self):
+        # Registers the ThreadMessage receivers that keep the thread totals current
+        from . import support  # noqa: F401
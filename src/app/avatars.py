@@ -0,0 +1,203 @@
+"""
+Profile picture storage and HTTP caching.
+
+Uploads are decoded, stripped of metadata and re-encoded into the renditions
+in AVATAR_SIZES (user_avatars); wallify_users.pfp keeps the largest one.
+Each rendition carries a content hash (etag), content type and change time.
+Those small columns are cached per user, so a conditional GET is answered
+with a 304 without reading the blob. A new upload drops the entries, which
+reaches other workers only through a shared cache (CACHE_SHARED); without
+one they expire after LOCAL_CACHE_TIMEOUT seconds instead. Avatars uploaded before renditions
+existed are served from wallify_users.pfp until `manage.py rebuild_avatars`.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .imaging import sniff_image_type, square_derivatives
+
+# `size` is the user_avatars rendition, or None for the original wallify_users.pfp
+AvatarMeta = namedtuple('AvatarMeta', ['etag', 'content_type', 'updated_at', 'size'])
+
+# Columns an avatar can be looked up by; interpolated into SQL, so keep this closed
+LOOKUP_FIELDS = ('username', 'id')
+MISSING = 'missing'
+
+
+def avatar_fields(data):
+    """(etag, content_type) for a stored avatar blob."""
+    content_type, _ = sniff_image_type(data, default=('image/png', 'png'))
+    return hashlib.sha256(data).hexdigest(), content_type
+
+
+def _meta_key(field, value, size):
+    return f'avatar:meta:{field}:{value}:{size or "original"}'
+
+
+def invalidate(username, user_id=None):
+    sizes = [None, *settings.AVATAR_SIZES]
+    keys = [_meta_key('username', username, size) for size in sizes]
+    if user_id is not None:
+        keys += [_meta_key('id', user_id, size) for size in sizes]
+    cache.delete_many(keys)
+
+
+def get_avatar_meta(field, value, size=None):
+    key = _meta_key(field, value, size)
+    meta = cache.get(key)
+    if meta is None:
+        meta = _load_meta(field, value, size)
+        cache.set(key, meta, settings.AVATAR_META_CACHE_TIMEOUT)
+    return None if meta == MISSING else meta
+
+
+def _load_meta(field, value, size):
+    assert field in LOOKUP_FIELDS
+    if size:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT a.etag, a.content_type, a.updated_at
+                FROM user_avatars a JOIN wallify_users u ON u.username = a.username
+                WHERE u.{field} = %s AND a.size = %s
+                """,
+                [value, size]
+            )
+            row = cursor.fetchone()
+        if row:
+            return AvatarMeta(*row, size)
+        # No rendition yet (legacy upload): fall through to the original
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT username, pfp_etag, pfp_content_type, pfp_updated_at, pfp IS NOT NULL
+            FROM wallify_users WHERE {field} = %s
+            """,
+            [value]
+        )
+        row = cursor.fetchone()
+    if not row or not row[4]:
+        return MISSING
+
+    username, etag, content_type, updated_at, _ = row
+    if etag is None:
+        # Avatar stored before the metadata columns existed: hash it once and keep the result
+        blob = get_avatar_blob('username', username)
+        etag, content_type = avatar_fields(bytes(blob))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE wallify_users SET pfp_etag = %s, pfp_content_type = %s WHERE username = %s",
+                [etag, content_type, username]
+            )
+    return AvatarMeta(etag, content_type, updated_at, None)
+
+
+def get_avatar_blob(field, value, size=None):
+    assert field in LOOKUP_FIELDS
+    with connection.cursor() as cursor:
+        if size:
+            cursor.execute(
+                f"""
+                SELECT a.data FROM user_avatars a JOIN wallify_users u ON u.username = a.username
+                WHERE u.{field} = %s AND a.size = %s
+                """,
+                [value, size]
+            )
+        else:
+            cursor.execute(f"SELECT pfp FROM wallify_users WHERE {field} = %s", [value])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def render_avatar(source):
+    """Normalize an uploaded avatar into {size: (bytes, content_type)}. Raises InvalidImage."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    return square_derivatives(source, settings.AVATAR_SIZES)
+
+
+@lru_cache(maxsize=1)
+def default_renditions():
+    # Every new account starts with the same picture; render it once per process
+    path = os.path.join(settings.BASE_DIR, 'app', 'static', 'images', 'dpfp.png')
+    with open(path, 'rb') as f:
+        return render_avatar(f)
+
+
+def save_avatar(username, source):
+    """Normalize and store an uploaded avatar. Raises InvalidImage."""
+    store_renditions(username, render_avatar(source))
+
+
+def store_renditions(username, renditions):
+    """Store avatar renditions; the largest also becomes wallify_users.pfp."""
+    now = timezone.now()
+    largest = max(settings.AVATAR_SIZES, key=settings.AVATAR_SIZES.get)
+    data, content_type = renditions[largest]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE wallify_users
+            SET pfp = %s, pfp_etag = %s, pfp_content_type = %s, pfp_updated_at = %s
+            WHERE username = %s
+            RETURNING id
+            """,
+            [data, hashlib.sha256(data).hexdigest(), content_type, now, username]
+        )
+        row = cursor.fetchone()
+        cursor.executemany(
+            """
+            INSERT INTO user_avatars (username, size, data, content_type, etag, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (username, size) DO UPDATE SET
+                data = EXCLUDED.data, content_type = EXCLUDED.content_type,
+                etag = EXCLUDED.etag, updated_at = EXCLUDED.updated_at
+            """,
+            [
+                [username, size, blob, blob_type, hashlib.sha256(blob).hexdigest(), now]
+                for size, (blob, blob_type) in renditions.items()
+            ]
+        )
+    invalidate(username, row[0] if row else None)
+
+
+def avatar_response(request, field, value):
+    """Serve an avatar with ETag/Last-Modified validators, answering 304s from metadata alone."""
+    size = request.GET.get('size')
+    if size not in settings.AVATAR_SIZES:
+        size = None
+    meta = get_avatar_meta(field, value, size)
+    if meta is None:
+        return HttpResponse(status=404)
+
+    etag = quote_etag(meta.etag)
+    last_modified = int(meta.updated_at.timestamp()) if meta.updated_at else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        blob = get_avatar_blob(field, value, meta.size)
+        if blob is None:
+            return HttpResponse(status=404)
+        response = HttpResponse(bytes(blob), content_type=meta.content_type)
+
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=settings.AVATAR_CACHE_MAX_AGE,
+        stale_while_revalidate=settings.AVATAR_CACHE_STALE_WHILE_REVALIDATE,
+    )
+    return response
@@ -0,0 +1,178 @@
+"""
+Stripe webhook ingest and processing.
+
+The webhook view only verifies the signature and calls `record_event`,
+which stores the raw event in stripe_events keyed by Stripe's event id
+(ON CONFLICT DO NOTHING, so redeliveries and replays are ignored), then
+answers 200. Events are applied afterwards by `process_pending`, from a
+per-process background thread or `manage.py process_stripe_events`. A
+handler that raises is retried with backoff until STRIPE_EVENT_MAX_ATTEMPTS
+and then left 'failed' for inspection. Handlers must be idempotent.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import entitlements
+
+logger = logging.getLogger(__name__)
+
+PENDING, PROCESSED, FAILED = 'pending', 'processed', 'failed'
+
+
+def record_event(payload, event_id, event_type):
+    """Store a verified event. Returns False if this event id was already recorded."""
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO stripe_events (id, type, payload, status, received_at, available_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO NOTHING
+            """,
+            [event_id, event_type, payload, PENDING, now, now]
+        )
+        created = cursor.rowcount > 0
+    if created:
+        transaction.on_commit(worker.notify)
+    return created
+
+
+def _checkout_username(session):
+    md = session.get('metadata') or {}
+    username = None
+    if isinstance(md, dict):
+        username = md.get('username')
+    if not username:
+        username = session.get('client_reference_id')
+    return username
+
+
+def handle_checkout_completed(event):
+    session = event['data']['object']
+    # Subscription checkouts are paid at completion; async payment methods
+    # report checkout.session.async_payment_succeeded later instead
+    if session.get('payment_status') not in ('paid', 'no_payment_required') \
+            and event['type'] == 'checkout.session.completed':
+        return
+    username = _checkout_username(session)
+    if not username:
+        logger.warning("Stripe event %s has no username", event['id'])
+        return
+    if not entitlements.set_premium(username, True):
+        logger.warning("Stripe event %s refers to unknown user %s", event['id'], username)
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+    'checkout.session.async_payment_succeeded': handle_checkout_completed,
+}
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+
+def process_next():
+    """Apply the oldest due event. Returns False when none are due."""
+    lock = 'FOR UPDATE SKIP LOCKED' if connection.vendor == 'postgresql' else ''
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id, type, payload, attempts FROM stripe_events
+                WHERE status = %s AND available_at <= %s
+                ORDER BY received_at
+                LIMIT 1
+                {lock}
+                """,
+                [PENDING, timezone.now()]
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        event_id, event_type, payload, attempts = row
+        attempts += 1
+
+        handler = HANDLERS.get(event_type)
+        error = None
+        if handler is not None:
+            try:
+                # Savepoint: a failing handler's writes are undone, the status update below is kept
+                with transaction.atomic():
+                    handler(json.loads(payload))
+            except Exception as e:
+                logger.exception("Stripe event %s (%s) failed", event_id, event_type)
+                error = str(e)
+
+        now = timezone.now()
+        if error is None:
+            status, available_at = PROCESSED, now
+        elif attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+            status, available_at = FAILED, now
+        else:
+            status, available_at = PENDING, now + _backoff(attempts)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE stripe_events
+                SET status = %s, attempts = %s, error = %s, available_at = %s, processed_at = %s
+                WHERE id = %s
+                """,
+                [status, attempts, error, available_at, now if status == PROCESSED else None, event_id]
+            )
+    return True
+
+
+def process_pending(limit=None):
+    """Apply due events until none are left (or `limit` were handled). Returns the number handled."""
+    done = 0
+    while (limit is None or done < limit) and process_next():
+        done += 1
+    return done
+
+
+class EventWorker:
+    """Per-process background thread applying events shortly after they are recorded."""
+
+    def __init__(self, enabled, poll_interval):
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def notify(self):
+        if not self.enabled:
+            return  # events are applied by `manage.py process_stripe_events`
+        self._ensure_started()
+        self._wake.set()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='stripe-events', daemon=True).start()
+
+    def _run(self):
+        while True:
+            close_old_connections()
+            try:
+                process_pending()
+            except Exception:
+                logger.exception("Stripe event worker error")
+            # Also wakes periodically to pick up retries that have come due
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+worker = EventWorker(settings.STRIPE_EVENT_WORKER, settings.STRIPE_EVENT_POLL_INTERVAL)
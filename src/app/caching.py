@@ -0,0 +1,161 @@
+"""
+In-process request coalescing and result caching.
+
+`SingleFlight` lets concurrent callers with the same key share one execution
+of an expensive call: the first caller runs it, the rest wait for its result
+(or exception). `AsyncSingleFlight` does the same for coroutines on one event
+loop. `TTLCache` is a small thread-safe LRU whose entries also
+expire after `ttl` seconds. Both keep counters for `stats()`.
+
+Everything here is per process; callers in other gunicorn workers or
+`manage.py` processes do not share flights or cache entries.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (fn(), leader) where `leader` is False if the result came from another caller's call."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, True
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._flights)}
+
+
+class AsyncSingleFlight:
+
+    def __init__(self):
+        self._flights = {}  # key -> future of the leader's result
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """Return (await fn(), leader), as SingleFlight.do."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            # Shielded so a cancelled follower does not cancel the leader's result
+            return await asyncio.shield(flight), False
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            flight.exception()  # retrieved here, so an unawaited flight is not logged
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            del self._flights[key]
+        return result, True
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._flights)}
+
+
+class TTLCache:
+
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
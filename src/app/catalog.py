@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import gallery_cache, profiles, search
+from .thumbnails import NO_DERIVATIVES, image_sources
+
+
+def insert_image(image_key, description, username, derivatives=NO_DERIVATIVES):
+    """Insert an images_table row and make it searchable. Returns the new row id."""
+    return insert_images([(image_key, description, username, derivatives)])[0]
+
+
+def insert_images(rows):
+    """
+    Insert (image_key, description, username, derivatives) rows with one multi-row
+    INSERT, count them in their owners' upload totals and make them searchable,
+    dropping the cached gallery pages they belong in.
+    Keys must be distinct. Returns the new ids in input order.
+    """
+    if not rows:
+        return []
+    params = []
+    for image_key, description, username, derivatives in rows:
+        thumb_widths = ','.join(str(w) for w in derivatives.widths) or None
+        params += [image_key, description, username, thumb_widths, derivatives.placeholder,
+                   derivatives.width, derivatives.height]
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+    uploads = {}
+    for row in rows:
+        uploads[row[2]] = uploads.get(row[2], 0) + 1
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO images_table (image_key, description, "user", thumb_widths, placeholder, width, height)
+                VALUES {values}
+                RETURNING id, image_key
+                """,
+                params
+            )
+            # RETURNING order is not guaranteed, so match the ids back up by key
+            ids_by_key = {image_key: image_id for image_id, image_key in cursor.fetchall()}
+        for username, count in uploads.items():
+            profiles.adjust_counts(username, uploads=count)
+    ids = [ids_by_key[row[0]] for row in rows]
+
+    for image_id, (image_key, description, username, derivatives) in zip(ids, rows):
+        thumb_widths = ','.join(str(w) for w in derivatives.widths) or None
+        search.index_image(image_id, image_key, description, username,
+                           thumb_widths, derivatives.placeholder, derivatives.width, derivatives.height)
+    # Cached gallery pages these descriptions could appear in, once the rows are visible
+    descriptions = [row[1] for row in rows]
+    transaction.on_commit(lambda: gallery_cache.invalidate(descriptions))
+    return ids
+
+
+def image_url(image_key):
+    return f'https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/images/{image_key}'
+
+
+def image_entry(image_key, username=None, thumb_widths=None, placeholder=None, width=None, height=None):
+    """Everything a grid tile needs: original URL for downloads, thumbnails for display."""
+    return {
+        'url': image_url(image_key),
+        'key': image_key,
+        'username': username,
+        'placeholder': placeholder,
+        'width': width,
+        'height': height,
+        **image_sources(image_key, thumb_widths),
+    }
+
+
+def serialize_hits(hits):
+    return [
+        image_entry(hit.image_key, hit.username, hit.thumb_widths, hit.placeholder, hit.width, hit.height)
+        for hit in hits
+    ]
@@ -0,0 +1,52 @@
+"""
+Premium entitlement lookups.
+
+`is_premium` answers from the Django cache, storing negative results too, so
+a free user costs one wallify_users read per ENTITLEMENT_CACHE_TIMEOUT rather
+than one per request. Every change to wallify_users.premium goes through
+`set_premium`, which writes the row and then the cache. With Redis behind the
+cache (CACHE_SHARED) every worker sees the new flag at once, including changes
+applied by `manage.py process_stripe_events`. Without it each process caches
+its own copy, so the timeout drops to LOCAL_CACHE_TIMEOUT seconds and other
+processes catch up within that. The session is no longer consulted; a flag
+there could not be invalidated from a webhook.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+def _key(username):
+    return f'entitlement:premium:{username}'
+
+
+def is_premium(username):
+    if not username:
+        return False
+    value = cache.get(_key(username))
+    if value is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT premium FROM wallify_users WHERE username = %s", [username])
+            row = cursor.fetchone()
+        # Cached as 0/1 so a negative result is not mistaken for a miss. add(), not
+        # set(): a concurrent set_premium must win over this possibly older read.
+        value = 1 if row and row[0] else 0
+        cache.add(_key(username), value, settings.ENTITLEMENT_CACHE_TIMEOUT)
+    return bool(value)
+
+
+def set_premium(username, premium=True):
+    """Persist a user's premium flag and update the cached copy. Returns False for unknown users."""
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE wallify_users SET premium = %s WHERE username = %s",
+                       [1 if premium else 0, username])
+        updated = cursor.rowcount > 0
+    if updated:
+        cache.set(_key(username), 1 if premium else 0, settings.ENTITLEMENT_CACHE_TIMEOUT)
+    else:
+        invalidate(username)
+    return updated
+
+
+def invalidate(username):
+    cache.delete(_key(username))
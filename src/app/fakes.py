@@ -0,0 +1,108 @@
+"""
+Local stand-ins for the external services, for benchmarks and local runs.
+
+Install them in place of the real clients with `install()`, which returns a
+function that puts the originals back. Replicate needs no fake here: the
+'stub' generation backend already produces images without the network.
+"""
+import threading
+import uuid
+from types import SimpleNamespace
+
+from . import services
+
+
+class FakeS3:
+    """
+    Accepts the S3 calls the app makes and records object sizes. Bodies are
+    read and dropped, so memory measured around it is the app's own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.objects = {}
+        self._uploads = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self._lock:
+            self.objects[(Bucket, Key)] = _size(Body)
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = _size(Body)
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._lock:
+            parts = self._uploads.pop(UploadId)
+            self.objects[(Bucket, Key)] = sum(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def stored_bytes(self):
+        with self._lock:
+            return sum(self.objects.values())
+
+
+def _size(body):
+    return len(body if isinstance(body, (bytes, bytearray, memoryview)) else body.read())
+
+
+class _FakeCheckoutSession:
+
+    @staticmethod
+    def create(**kwargs):
+        session_id = f'cs_test_{uuid.uuid4().hex}'
+        return {'id': session_id, 'url': f'https://checkout.stripe.test/pay/{session_id}', **kwargs}
+
+
+class _FakeCheckoutSessions:
+
+    @staticmethod
+    async def create_async(params=None, options=None):
+        return _FakeCheckoutSession.create(**(params or {}))
+
+
+class FakeStripeClient:
+    """The slice of stripe.StripeClient the async views use."""
+
+    checkout = SimpleNamespace(sessions=_FakeCheckoutSessions)
+
+
+class FakeStripe:
+    """The slice of the stripe module the app uses; webhooks still verify signatures for real."""
+
+    checkout = SimpleNamespace(Session=_FakeCheckoutSession)
+
+    def __init__(self):
+        import stripe
+        self.Webhook = stripe.Webhook
+
+
+def install(s3=None, stripe=None):
+    """Swap the shared S3 and Stripe clients for fakes. Returns a function that restores them."""
+    replaced = {'s3': s3 or FakeS3(), 'stripe': stripe or FakeStripe(), 'stripe_async': FakeStripeClient()}
+    with services._lock:
+        previous = {name: services._clients.get(name) for name in replaced}
+        services._clients.update(replaced)
+
+    def restore():
+        with services._lock:
+            for name, client in previous.items():
+                if client is None:
+                    services._clients.pop(name, None)
+                else:
+                    services._clients[name] = client
+
+    return restore
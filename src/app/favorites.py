@@ -0,0 +1,94 @@
+"""
+A user's favorites: a set of image keys, unique per (username, image_key).
+
+`add` and `remove` take any number of keys and are idempotent: keys already
+saved (or already gone) are skipped by the database, and only the rows that
+actually changed are counted in user_stats.
+
+`saved_keys` is the user's whole set, kept in the Django cache and dropped
+whenever it changes, so marking a gallery page is one cache read and a
+membership test per tile rather than a query per image. Dropping it reaches
+every worker only when the cache is shared (CACHE_SHARED); otherwise the
+entry lives for LOCAL_CACHE_TIMEOUT seconds, which bounds how long other
+workers show a stale "saved" state.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from . import profiles
+
+
+def _key(username):
+    return f'favorites:saved:{username}'
+
+
+def _distinct(image_keys):
+    return list(dict.fromkeys(key for key in image_keys if key))
+
+
+def add(username, image_keys):
+    """Save the keys for the user. Returns the keys that were not already saved."""
+    image_keys = _distinct(image_keys)
+    if not image_keys:
+        return []
+    values = ', '.join(['(%s, %s)'] * len(image_keys))
+    params = [value for key in image_keys for value in (username, key)]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO favorites (username, image_key) VALUES {values}
+                ON CONFLICT (username, image_key) DO NOTHING
+                RETURNING image_key
+                """,
+                params
+            )
+            added = [row[0] for row in cursor.fetchall()]
+        profiles.adjust_counts(username, favorites=len(added))
+        if added:
+            transaction.on_commit(lambda: invalidate(username))
+    return added
+
+
+def remove(username, image_keys):
+    """Unsave the keys for the user. Returns the keys that were saved."""
+    image_keys = _distinct(image_keys)
+    if not image_keys:
+        return []
+    placeholders = ', '.join(['%s'] * len(image_keys))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM favorites WHERE username = %s AND image_key IN ({placeholders}) RETURNING image_key",
+                [username, *image_keys]
+            )
+            removed = [row[0] for row in cursor.fetchall()]
+        profiles.adjust_counts(username, favorites=-len(removed))
+        if removed:
+            transaction.on_commit(lambda: invalidate(username))
+    return removed
+
+
+def saved_keys(username):
+    if not username:
+        return frozenset()
+    keys = cache.get(_key(username))
+    if keys is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT image_key FROM favorites WHERE username = %s", [username])
+            keys = frozenset(row[0] for row in cursor.fetchall())
+        cache.set(_key(username), keys, settings.FAVORITES_CACHE_TIMEOUT)
+    return keys
+
+
+def mark_saved(images, username):
+    """Set 'saved' on each image entry (catalog.image_entry dicts) from the user's set."""
+    saved = saved_keys(username)
+    for image in images:
+        image['saved'] = image['key'] in saved
+    return images
+
+
+def invalidate(username):
+    cache.delete(_key(username))
@@ -0,0 +1,165 @@
+"""
+Cached gallery search results.
+
+Most gallery traffic repeats a handful of queries, so pages of hits are cached
+by (normalized query, page size, cursor). Entries live in a pluggable store,
+chosen with GALLERY_CACHE_BACKEND:
+
+* 'local' keeps them in a per-process TTLCache (LRU with a TTL),
+* 'shared' keeps them in the Django cache (Redis when REDIS_URL is set).
+
+Invalidation is by version stamps kept in the Django cache. With Redis
+behind it (CACHE_SHARED) an upload in one worker is seen by all of them,
+whichever store holds the entries. Without Redis the stamps are per process
+too: only the worker that inserted the image drops its pages, the others
+serve theirs until GALLERY_CACHE_TTL, which defaults to a few seconds in
+that setup for this reason. A query
+depends on one stamp per word, keyed on the word's first PREFIX_LENGTH
+characters; an inserted image replaces the stamps for every prefix (up to
+that length) of every word in its description, plus a catch-all stamp for
+queries with no words. Search matches words by prefix (and by stem on
+PostgreSQL), which the short keys cover at the cost of some extra misses.
+Each entry records the stamps read before its search ran, so a row committed
+while the search was running still invalidates it.
+
+Trigram fallbacks on PostgreSQL can match descriptions that share no prefix
+with the query; those pages are only as fresh as GALLERY_CACHE_TTL.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .caching import TTLCache
+from .search import search_images, tokenize
+
+PREFIX_LENGTH = 3
+ALL_TERMS = '*'
+
+lookups = metrics.Counter(
+    'wallify_gallery_cache_lookups_total',
+    'Gallery result cache lookups by outcome (stale: cached but invalidated since).',
+    labels=('result',),
+)
+entry_age = metrics.Histogram(
+    'wallify_gallery_cache_hit_age_seconds',
+    'Age of the gallery results served from cache.',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+invalidations = metrics.Counter(
+    'wallify_gallery_cache_invalidations_total',
+    'Gallery cache version stamps replaced by new images.',
+)
+
+
+def normalize(query):
+    return ' '.join(tokenize(query))
+
+
+def query_terms(normalized):
+    return sorted({token[:PREFIX_LENGTH] for token in normalized.split()}) or [ALL_TERMS]
+
+
+def description_terms(description):
+    terms = {ALL_TERMS}
+    for token in tokenize(description):
+        terms.update(token[:length] for length in range(1, min(len(token), PREFIX_LENGTH) + 1))
+    return terms
+
+
+def _version_key(term):
+    return f'gallery:version:{term}'
+
+
+def _versions(terms):
+    keys = [_version_key(term) for term in terms]
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        # A stamp evicted from the cache comes back as a new value, never an old one
+        for key, stamp in missing.items():
+            if not cache.add(key, stamp, None):
+                stamp = cache.get(key, stamp)
+            found[key] = stamp
+    return tuple(found[key] for key in keys)
+
+
+def invalidate(descriptions):
+    """Replace the version stamps the given image descriptions could match."""
+    terms = set()
+    for description in descriptions:
+        terms |= description_terms(description)
+    cache.set_many({_version_key(term): uuid.uuid4().hex for term in terms}, None)
+    invalidations.inc(amount=len(terms))
+
+
+class LocalResultStore:
+    name = 'local'
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=settings.GALLERY_CACHE_SIZE, ttl=settings.GALLERY_CACHE_TTL)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, entry):
+        self._cache.set(key, entry)
+
+
+class SharedResultStore:
+    name = 'shared'
+
+    def get(self, key):
+        return cache.get(f'gallery:page:{key}')
+
+    def set(self, key, entry):
+        cache.set(f'gallery:page:{key}', entry, settings.GALLERY_CACHE_TTL)
+
+
+BACKENDS = {
+    'local': LocalResultStore,
+    'shared': SharedResultStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BACKENDS[settings.GALLERY_CACHE_BACKEND]()
+    return _store
+
+
+def _entry_key(normalized, limit, after):
+    raw = json.dumps([normalized, limit, list(after) if after else None], separators=(',', ':'))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def search(query, limit=None, after=None):
+    """search_images through the result cache; same arguments, same SearchPage."""
+    normalized = normalize(query)
+    if not settings.GALLERY_CACHE:
+        return search_images(normalized, limit=limit, after=after)
+
+    versions = _versions(query_terms(normalized))
+    store = get_store()
+    key = _entry_key(normalized, limit, after)
+    entry = store.get(key)
+    if entry is not None and entry[0] == versions:
+        lookups.inc('hit')
+        entry_age.observe(time.time() - entry[1])
+        return entry[2]
+
+    lookups.inc('stale' if entry is not None else 'miss')
+    page = search_images(normalized, limit=limit, after=after)
+    store.set(key, (versions, time.time(), page))
+    return page
@@ -0,0 +1,397 @@
+"""
+AI image generation: model backends and the pipeline a generation job runs.
+
+A backend turns (prompt, aspect_ratio) into a source image URL and streams
+its bytes into S3 one multipart part (5 MiB) at a time; an image smaller than
+that, which is most of them, goes up in one put_object once it has fully
+downloaded. 'replicate' calls the hosted model; 'stub' renders a flat image
+locally so the job queue can be exercised without network access or API
+credits. `run_batch` generates one or more variations concurrently, mirrors
+them into S3 and records them in ai_generations and images_table.
+
+`run_batch_async` is the same pipeline for the async worker: the model call
+is awaited on the event loop, so one process can wait on hundreds of them,
+while the download and S3 mirror, which move bytes through boto3, run in the
+loop's thread pool.
+"""
+import asyncio
+import logging
+import time
+import uuid
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from PIL import Image
+
+from . import metrics
+from .caching import AsyncSingleFlight, SingleFlight, TTLCache
+from .catalog import image_url as s3_image_url, insert_images
+from .imaging import sniff_image_type
+from .services import get_http, get_replicate, get_replicate_async, get_s3
+from .thumbnails import generate_derivatives
+from .uploads import MIN_PART_SIZE, StreamReader, stream_to_s3
+
+logger = logging.getLogger(__name__)
+
+# image_url is what the page shows: the S3 mirror when it succeeded, else the model's URL.
+# error is set when generation or mirroring failed; a failed generation has no source_url.
+# shared is True when the image came from another request (coalesced or cached).
+GenerationResult = namedtuple('GenerationResult', ['image_url', 'image_key', 'source_url', 'error', 'shared'])
+_Output = namedtuple('_Output', ['source_url', 'image_key', 'derivatives', 'error', 'shared'])
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Ratios the model accepts
+ASPECT_RATIOS = ('1:1', '3:4', '4:3', '2:3', '3:2', '9:16', '16:9', '21:9')
+
+
+class GenerationError(Exception):
+    pass
+
+
+def extract_image_url(o: Any) -> Optional[str]:
+    """Normalize various output shapes from Replicate into a single image URL."""
+    try:
+        # Case 1: direct string URL
+        if isinstance(o, str):
+            return o
+        # Case 2: list/tuple of URLs or dicts
+        if isinstance(o, (list, tuple)) and len(o) > 0:
+            first = o[0]
+            if isinstance(first, str):
+                return first
+            if isinstance(first, dict):
+                # common keys
+                for key in ("url", "image", "src"):
+                    if key in first and isinstance(first[key], str):
+                        return first[key]
+                # nested
+                if "images" in first and isinstance(first["images"], list) and first["images"]:
+                    img0 = first["images"][0]
+                    if isinstance(img0, str):
+                        return img0
+                    if isinstance(img0, dict):
+                        for key in ("url", "image", "src"):
+                            if key in img0 and isinstance(img0[key], str):
+                                return img0[key]
+        # Case 3: dict output
+        if isinstance(o, dict):
+            # direct keys
+            for key in ("url", "image", "output"):
+                val = o.get(key)
+                if isinstance(val, str):
+                    return val
+                if isinstance(val, (list, tuple)) and val:
+                    if isinstance(val[0], str):
+                        return val[0]
+                    if isinstance(val[0], dict):
+                        for k in ("url", "image", "src"):
+                            if k in val[0] and isinstance(val[0][k], str):
+                                return val[0][k]
+            # nested images
+            images = o.get("images")
+            if isinstance(images, (list, tuple)) and images:
+                if isinstance(images[0], str):
+                    return images[0]
+                if isinstance(images[0], dict):
+                    for k in ("url", "image", "src"):
+                        if k in images[0] and isinstance(images[0][k], str):
+                            return images[0][k]
+    except Exception:
+        return None
+    return None
+
+
+class ReplicateBackend:
+
+    model = "bytedance/seedream-3"
+
+    @staticmethod
+    def _input(prompt, aspect_ratio):
+        return {
+            "size": "regular",
+            "width": 2048,
+            "height": 2048,
+            "prompt": prompt,
+            "aspect_ratio": aspect_ratio,
+            "guidance_scale": 2.5
+        }
+
+    def generate(self, prompt, aspect_ratio):
+        output = get_replicate().run(self.model, input=self._input(prompt, aspect_ratio))
+        return self._image_url(output)
+
+    async def agenerate(self, prompt, aspect_ratio):
+        output = await get_replicate_async().async_run(self.model, input=self._input(prompt, aspect_ratio))
+        return self._image_url(output)
+
+    @staticmethod
+    def _image_url(output):
+        image_url = extract_image_url(output)
+        if not image_url:
+            logger.error("Unexpected Replicate output shape: %s %r", type(output), output)
+            raise GenerationError('Failed to parse image URL from model output')
+        return image_url
+
+    @contextmanager
+    def stream(self, image_url):
+        """Yield (chunks, declared content type, content length or None) for a generated image."""
+        with get_http().get(image_url, stream=True, timeout=30) as r:
+            if not r.ok:
+                raise GenerationError(f"Failed to download generated image: status {r.status_code}")
+            length = r.headers.get('Content-Length')
+            yield (r.iter_content(chunk_size=STREAM_CHUNK_SIZE), r.headers.get('Content-Type'),
+                   int(length) if length and length.isdigit() else None)
+
+
+class StubBackend:
+    """Local stand-in for the model; sleeps GENERATION_STUB_DELAY to mimic latency."""
+
+    model = 'stub'
+
+    def generate(self, prompt, aspect_ratio):
+        if settings.GENERATION_STUB_DELAY:
+            time.sleep(settings.GENERATION_STUB_DELAY)
+        return self._image_url(prompt, aspect_ratio)
+
+    async def agenerate(self, prompt, aspect_ratio):
+        if settings.GENERATION_STUB_DELAY:
+            await asyncio.sleep(settings.GENERATION_STUB_DELAY)
+        return self._image_url(prompt, aspect_ratio)
+
+    @staticmethod
+    def _image_url(prompt, aspect_ratio):
+        if 'fail' in (prompt or '').lower():
+            raise GenerationError('Stub backend failure requested by prompt')
+        return f'stub://{aspect_ratio}/{uuid.uuid4().hex}'
+
+    @contextmanager
+    def stream(self, image_url):
+        w, h = (int(n) for n in image_url[len('stub://'):].split('/')[0].split(':'))
+        side = 512
+        size = (side, round(side * h / w)) if w >= h else (round(side * w / h), side)
+        out = BytesIO()
+        Image.new('RGB', size, (40, 90, 160)).save(out, 'JPEG', quality=80)
+        data = out.getvalue()
+        # Deliberately mislabelled: the mirror must trust the bytes, not the header
+        chunks = (data[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(data), STREAM_CHUNK_SIZE))
+        yield chunks, 'application/octet-stream', len(data)
+
+
+BACKENDS = {
+    'replicate': ReplicateBackend,
+    'stub': StubBackend,
+}
+
+_backend = None
+
+# Identical in-flight generations share one call; mirrored results are reused
+# for GENERATION_RESULT_CACHE_TTL seconds when GENERATION_RESULT_CACHE is on.
+# async_flights does the coalescing for the async worker's event loop.
+flights = SingleFlight()
+async_flights = AsyncSingleFlight()
+result_cache = TTLCache(maxsize=settings.GENERATION_RESULT_CACHE_SIZE, ttl=settings.GENERATION_RESULT_CACHE_TTL)
+
+
+def cache_stats():
+    sync, asynchronous = flights.stats(), async_flights.stats()
+    return {
+        'flights': {name: sync[name] + asynchronous[name] for name in sync},
+        'results': result_cache.stats(),
+    }
+
+
+@metrics.register_collector
+def _cache_metrics():
+    stats = cache_stats()
+    flight, results = stats['flights'], stats['results']
+    return [
+        ('wallify_generation_model_calls_total', 'counter', 'Model calls made by this process.',
+         [({}, flight['calls'])]),
+        ('wallify_generation_coalesced_total', 'counter', 'Generations that shared an in-flight call.',
+         [({}, flight['coalesced'])]),
+        ('wallify_generation_result_cache_total', 'counter', 'Result cache lookups by outcome.',
+         [({'result': 'hit'}, results['hits']), ({'result': 'miss'}, results['misses'])]),
+    ]
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[settings.GENERATION_BACKEND]()
+    return _backend
+
+
+def mirror_stream(username, chunks, declared_type=None, length=None, progress=None):
+    """
+    Copy a generated image into S3 under images/ai/<username>/, then render
+    its thumbnails. Large images are uploaded in minimum-size (5 MiB) parts
+    while the rest downloads; smaller ones are buffered and sent whole. The type comes from the leading
+    bytes, not the header. A copy is spooled (to disk past
+    GENERATION_SPOOL_MAX_MEMORY) for the thumbnails, so memory stays flat.
+    Returns (key, derivatives).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=settings.GENERATION_SPOOL_MAX_MEMORY) as spool:
+        reader = StreamReader(chunks, copy=spool, progress=progress, total=length)
+        content_type, ext = sniff_image_type(reader.peek(32), default=(None, None))
+        if content_type is None:
+            raise GenerationError(f"Generated file is not a recognised image (declared {declared_type})")
+
+        ts = timezone.now().strftime('%Y%m%d_%H%M%S')
+        key_relative = f"ai/{username}/{ts}_{uuid.uuid4().hex[:8]}.{ext}"
+        s3 = get_s3()
+        stream_to_s3(s3, reader, f"images/{key_relative}", content_type, part_size=MIN_PART_SIZE)
+
+        spool.seek(0)
+        return key_relative, generate_derivatives(s3, key_relative, spool)
+
+
+def normalize_prompt(prompt):
+    return ' '.join((prompt or '').lower().split())
+
+
+def _produce(backend, username, prompt, aspect_ratio, variant=0, progress=None):
+    """
+    One image, shared where possible: a recent mirrored result for the same
+    (model, normalized prompt, aspect ratio, variant) is reused when the result
+    cache is on, and identical requests running at once share one model call.
+    `variant` keeps the variations within a batch distinct.
+    """
+    key = (backend.model, normalize_prompt(prompt), aspect_ratio, variant)
+    if settings.GENERATION_RESULT_CACHE:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached._replace(shared=True)
+
+    out, leader = flights.do(key, lambda: _produce_uncached(backend, username, prompt, aspect_ratio, progress))
+    if settings.GENERATION_RESULT_CACHE and leader and out.image_key:
+        result_cache.set(key, out)
+    return out if leader else out._replace(shared=True)
+
+
+def _produce_uncached(backend, username, prompt, aspect_ratio, progress=None):
+    """Model call, download and S3 upload for one image; no database access, so safe in a pool thread."""
+    try:
+        source_url = backend.generate(prompt, aspect_ratio)
+    except Exception as e:
+        logger.exception("Generation failed for %s (%s)", username, aspect_ratio)
+        return _Output(None, None, None, str(e), False)
+    return _mirror(backend, username, source_url, progress)
+
+
+async def _produce_async(backend, username, prompt, aspect_ratio, variant=0, progress=None):
+    """_produce for the event loop."""
+    key = (backend.model, normalize_prompt(prompt), aspect_ratio, variant)
+    if settings.GENERATION_RESULT_CACHE:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached._replace(shared=True)
+
+    out, leader = await async_flights.do(
+        key, lambda: _produce_uncached_async(backend, username, prompt, aspect_ratio, progress))
+    if settings.GENERATION_RESULT_CACHE and leader and out.image_key:
+        result_cache.set(key, out)
+    return out if leader else out._replace(shared=True)
+
+
+async def _produce_uncached_async(backend, username, prompt, aspect_ratio, progress=None):
+    try:
+        source_url = await backend.agenerate(prompt, aspect_ratio)
+    except Exception as e:
+        logger.exception("Generation failed for %s (%s)", username, aspect_ratio)
+        return _Output(None, None, None, str(e), False)
+    return await asyncio.to_thread(_mirror, backend, username, source_url, progress)
+
+
+def _mirror(backend, username, source_url, progress=None):
+    # If mirroring fails the model's URL is still returned so the user sees the image
+    try:
+        with backend.stream(source_url) as (chunks, declared_type, length):
+            image_key, derivatives = mirror_stream(username, chunks, declared_type, length, progress)
+    except Exception as e:
+        logger.exception("S3 mirror failed for %s", source_url)
+        return _Output(source_url, None, None, str(e), False)
+    return _Output(source_url, image_key, derivatives, None, False)
+
+
+def run_batch(username, prompt, aspect_ratios, backend=None, progress=None):
+    """
+    Generate one image per aspect ratio, concurrently (at most
+    GENERATION_BATCH_CONCURRENCY at a time), then record them with one
+    ai_generations INSERT and one images_table INSERT. Returns a
+    GenerationResult per requested image, in order; failed ones have no source_url.
+
+    Every delivered image gets its own ai_generations row, shared or not, so
+    the daily limit counts it. A shared image is already in the gallery and
+    is not added again. `progress(index, bytes_mirrored, total_or_None)` is
+    called from the pool threads as each image downloads into S3.
+    """
+    backend = backend or get_backend()
+    variants = [aspect_ratios[:i].count(ratio) for i, ratio in enumerate(aspect_ratios)]
+    workers = max(1, min(len(aspect_ratios), settings.GENERATION_BATCH_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generation') as pool:
+        outputs = list(pool.map(
+            lambda index, ratio, variant: _produce(
+                backend, username, prompt, ratio, variant,
+                progress and (lambda done, total: progress(index, done, total)),
+            ),
+            range(len(aspect_ratios)), aspect_ratios, variants,
+        ))
+
+    return _record_batch(username, prompt, aspect_ratios, outputs)
+
+
+async def run_batch_async(username, prompt, aspect_ratios, backend=None, progress=None):
+    """run_batch for the event loop; the database writes run in sync_to_async."""
+    backend = backend or get_backend()
+    variants = [aspect_ratios[:i].count(ratio) for i, ratio in enumerate(aspect_ratios)]
+    slots = asyncio.Semaphore(max(1, settings.GENERATION_BATCH_CONCURRENCY))
+
+    async def produce(index, ratio, variant):
+        async with slots:
+            return await _produce_async(
+                backend, username, prompt, ratio, variant,
+                progress and (lambda done, total: progress(index, done, total)),
+            )
+
+    outputs = await asyncio.gather(*(
+        produce(index, ratio, variant)
+        for index, (ratio, variant) in enumerate(zip(aspect_ratios, variants))
+    ))
+    return await sync_to_async(_record_batch)(username, prompt, aspect_ratios, outputs)
+
+
+def _record_batch(username, prompt, aspect_ratios, outputs):
+    now = timezone.now()
+    generated = [(out, ratio) for out, ratio in zip(outputs, aspect_ratios) if out.source_url]
+    if generated:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO ai_generations
+                (username, prompt, image_url, aspect_ratio, created_at)
+                VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(generated))}
+                """,
+                [value for out, ratio in generated for value in (username, prompt, out.source_url, ratio, now)]
+            )
+
+    # Add the mirrored images to the gallery, with AI keywords appended for search
+    description_keywords = f"{prompt}, ai-generated, AI, AI generated" if prompt else "ai-generated, AI, AI generated"
+    insert_images([
+        (out.image_key, description_keywords, username, out.derivatives)
+        for out in outputs if out.image_key and not out.shared
+    ])
+
+    return [
+        GenerationResult(s3_image_url(out.image_key) if out.image_key else out.source_url,
+                         out.image_key, out.source_url, out.error, out.shared)
+        for out in outputs
+    ]
@@ -0,0 +1,71 @@
+"""Image helpers shared by avatar and gallery uploads."""
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+# (magic prefix, content type, extension)
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (b'GIF87a', 'image/gif', 'gif'),
+    (b'GIF89a', 'image/gif', 'gif'),
+    (b'BM', 'image/bmp', 'bmp'),
+]
+
+
+def sniff_image_type(data, default=('application/octet-stream', 'bin')):
+    """Return (content_type, extension) from the leading bytes of an image."""
+    head = bytes(data[:32]) if data else b''
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return 'image/avif', 'avif'
+    for magic, content_type, ext in SIGNATURES:
+        if head.startswith(magic):
+            return content_type, ext
+    return default
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+if features.check('webp'):
+    OUTPUT_FORMAT, OUTPUT_CONTENT_TYPE = 'WEBP', 'image/webp'
+else:
+    OUTPUT_FORMAT, OUTPUT_CONTENT_TYPE = 'JPEG', 'image/jpeg'
+
+
+def open_image(source, max_side=None):
+    """Decode an upload with Pillow, applying EXIF orientation. Raises InvalidImage."""
+    try:
+        image = Image.open(source)
+        if max_side:
+            # JPEG can decode straight to a reduced scale, far cheaper than a full decode
+            image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImage(str(e))
+    return image
+
+
+def encode_image(image, quality=82):
+    """Re-encode as WebP (JPEG if Pillow lacks WebP). No EXIF/ICC metadata is carried over."""
+    keep_alpha = OUTPUT_FORMAT == 'WEBP' and 'A' in image.getbands()
+    image = image.convert('RGBA' if keep_alpha else 'RGB')
+    out = BytesIO()
+    if OUTPUT_FORMAT == 'WEBP':
+        image.save(out, 'WEBP', quality=quality, method=4)
+    else:
+        image.save(out, 'JPEG', quality=quality, optimize=True)
+    return out.getvalue(), OUTPUT_CONTENT_TYPE
+
+
+def square_derivatives(source, sizes):
+    """Center-crop to a square and render one re-encoded image per {name: pixels} entry."""
+    image = open_image(source, max_side=max(sizes.values()) * 2)
+    return {
+        name: encode_image(ImageOps.fit(image, (side, side), Image.LANCZOS))
+        for name, side in sizes.items()
+    }
@@ -0,0 +1,403 @@
+"""
+Background queue for AI image generation.
+
+`enqueue` stores a row in generation_jobs and returns its id at once; the
+request worker never waits on the model. Jobs are claimed with a single
+UPDATE (FOR UPDATE SKIP LOCKED on PostgreSQL), so any number of runners can
+share the table: GENERATION_WORKERS threads inside each web process, and/or
+`manage.py generation_worker` processes. A job left running longer than
+GENERATION_JOB_TIMEOUT (its runner died) is claimed again until it has used
+GENERATION_MAX_ATTEMPTS, then marked failed. Runners refresh started_at every
+GENERATION_HEARTBEAT_INTERVAL while they work, so only a job whose runner has
+gone quiet looks stalled; and a job is finished (and its quota released) only
+by the runner holding its current attempt, so a late runner changes nothing.
+Pages poll `get_job`, and `get_progress` for how far each image has got into
+S3 (kept in the Django cache, so it is visible across processes when
+REDIS_URL is set).
+
+`work_async` is the event-loop runner behind `manage.py generation_worker
+--async`: one claimer keeps up to N jobs in flight, each awaiting the model
+without holding a thread, and database work goes through sync_to_async.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, connections, transaction
+from django.utils import timezone
+
+from . import quotas
+from .generation import run_batch, run_batch_async
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+PENDING = (QUEUED, RUNNING)
+
+Job = namedtuple('Job', [
+    'id', 'username', 'prompt', 'aspect_ratio', 'status', 'attempts',
+    'image_url', 'image_key', 'error', 'created_at', 'started_at', 'finished_at',
+    'image_count', 'aspect_ratios', 'results',
+])
+JOB_COLUMNS = ', '.join(Job._fields)
+
+CLAIM_SQL = """
+    UPDATE generation_jobs
+    SET status = 'running', started_at = %s, attempts = attempts + 1
+    WHERE id = (
+        SELECT id FROM generation_jobs
+        WHERE status = 'queued' OR (status = 'running' AND started_at < %s AND attempts < %s)
+        ORDER BY created_at
+        LIMIT 1
+        {lock}
+    )
+    AND (status = 'queued' OR (status = 'running' AND started_at < %s AND attempts < %s))
+    RETURNING id, username, prompt, aspect_ratio, aspect_ratios, created_at, attempts
+"""
+
+
+def enqueue(username, prompt, aspect_ratios):
+    """Queue one generation per aspect ratio as a single job and return its id."""
+    job_id = uuid.uuid4().hex
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO generation_jobs
+            (id, username, prompt, aspect_ratio, aspect_ratios, image_count, status, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            [job_id, username, prompt, aspect_ratios[0], ','.join(aspect_ratios), len(aspect_ratios),
+             QUEUED, timezone.now()]
+        )
+    # Runners cannot see the row before the enqueueing transaction commits
+    transaction.on_commit(runner.notify)
+    return job_id
+
+
+def get_job(job_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {JOB_COLUMNS} FROM generation_jobs WHERE id = %s", [job_id])
+        row = cursor.fetchone()
+    return Job(*row) if row else None
+
+
+def claim():
+    """Atomically take the next runnable job, or return None."""
+    now = timezone.now()
+    stalled_before = now - timedelta(seconds=settings.GENERATION_JOB_TIMEOUT)
+    max_attempts = settings.GENERATION_MAX_ATTEMPTS
+    lock = 'FOR UPDATE SKIP LOCKED' if connection.vendor == 'postgresql' else ''
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL.format(lock=lock),
+                       [now, stalled_before, max_attempts, stalled_before, max_attempts])
+        return cursor.fetchone()
+
+
+def fail_stalled():
+    """Give up on jobs that timed out on their last attempt, returning their quota."""
+    stalled_before = timezone.now() - timedelta(seconds=settings.GENERATION_JOB_TIMEOUT)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE generation_jobs SET status = %s, error = %s, finished_at = %s
+                WHERE status = %s AND started_at < %s AND attempts >= %s
+                RETURNING username, image_count, created_at
+                """,
+                [FAILED, 'Generation timed out', timezone.now(), RUNNING, stalled_before,
+                 settings.GENERATION_MAX_ATTEMPTS]
+            )
+            failed = cursor.fetchall()
+        # The job is no longer running, so its runner (if alive after all) can't finish or release it
+        for username, image_count, created_at in failed:
+            quotas.release(username, image_count, timezone.localdate(created_at))
+    return len(failed)
+
+
+def heartbeat(job_id, attempt):
+    """Mark the job alive for this attempt. Returns False once another runner or fail_stalled owns it."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE generation_jobs SET started_at = %s WHERE id = %s AND status = %s AND attempts = %s",
+            [timezone.now(), job_id, RUNNING, attempt]
+        )
+        return cursor.rowcount > 0
+
+
+def _finish(job_id, attempt, status, image_url=None, image_key=None, error=None, results=None):
+    """Record the outcome if `attempt` still owns the job. Returns whether it did."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE generation_jobs
+            SET status = %s, image_url = %s, image_key = %s, error = %s, results = %s, finished_at = %s
+            WHERE id = %s AND status = %s AND attempts = %s
+            """,
+            [status, image_url, image_key, error, json.dumps(results) if results is not None else None,
+             timezone.now(), job_id, RUNNING, attempt]
+        )
+        finished = cursor.rowcount > 0
+    if not finished:
+        logger.warning("Generation job %s attempt %s was taken over; dropping its result", job_id, attempt)
+    return finished
+
+
+def job_images(job):
+    """[{image_url, image_key, error}] per image of a finished job."""
+    if job.results:
+        return json.loads(job.results)
+    if job.image_url:
+        return [{'image_url': job.image_url, 'image_key': job.image_key, 'error': job.error}]
+    return []
+
+
+def _progress_key(job_id):
+    return f'generation:progress:{job_id}'
+
+
+def get_progress(job_id):
+    """[{'bytes': n, 'total': n_or_None}] per image of a running job, or None."""
+    return cache.get(_progress_key(job_id))
+
+
+class ProgressReporter:
+    """Collects per-image mirror progress from pool threads and publishes it at most every `interval` seconds."""
+
+    def __init__(self, job_id, count, interval=0.5):
+        self.key = _progress_key(job_id)
+        self.images = [{'bytes': 0, 'total': None} for _ in range(count)]
+        self.interval = interval
+        self._published = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, index, done, total):
+        with self._lock:
+            self.images[index] = {'bytes': done, 'total': total}
+            now = time.monotonic()
+            if now - self._published < self.interval and done != total:
+                return
+            self._published = now
+            snapshot = [dict(image) for image in self.images]
+        cache.set(self.key, snapshot, settings.GENERATION_JOB_TIMEOUT)
+
+    def clear(self):
+        cache.delete(self.key)
+
+
+class Heartbeat:
+    """Calls `heartbeat` from a background thread while a sync runner works on a job."""
+
+    def __init__(self, job_id, attempt, interval=None):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.interval = interval or settings.GENERATION_HEARTBEAT_INTERVAL
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f'generation-heartbeat-{job_id}', daemon=True)
+
+    def _beat(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    if not heartbeat(self.job_id, self.attempt):
+                        return
+                except Exception:
+                    logger.exception("Heartbeat for generation job %s failed", self.job_id)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def _heartbeat_async(job_id, attempt):
+    while True:
+        await asyncio.sleep(settings.GENERATION_HEARTBEAT_INTERVAL)
+        try:
+            if not await sync_to_async(heartbeat)(job_id, attempt):
+                return
+        except Exception:
+            logger.exception("Heartbeat for generation job %s failed", job_id)
+
+
+def _unpack(claimed):
+    job_id, username, prompt, aspect_ratio, aspect_ratios, created_at, attempt = claimed
+    aspect_ratios = aspect_ratios.split(',') if aspect_ratios else [aspect_ratio]
+    return job_id, attempt, username, prompt, aspect_ratios, timezone.localdate(created_at)
+
+
+def _fail(job_id, attempt, username, aspect_ratios, quota_day, error):
+    with transaction.atomic():
+        if _finish(job_id, attempt, FAILED, error=str(error)):
+            quotas.release(username, len(aspect_ratios), quota_day)
+
+
+def _complete(job_id, attempt, username, aspect_ratios, quota_day, results):
+    images = [
+        {'image_url': r.image_url, 'image_key': r.image_key, 'error': r.error, 'shared': r.shared}
+        for r in results if r.source_url
+    ]
+    with transaction.atomic():
+        if not images:
+            finished = _finish(job_id, attempt, FAILED, error=results[0].error)
+        else:
+            # image_url/image_key keep the first image for single-image callers
+            finished = _finish(job_id, attempt, SUCCEEDED, image_url=images[0]['image_url'],
+                               image_key=images[0]['image_key'], error=images[0]['error'], results=images)
+        if finished:
+            # The quota was reserved at enqueue time; hand back what was not delivered
+            quotas.release(username, len(aspect_ratios) - len(images), quota_day)
+
+
+def run_next():
+    """Claim and run one job. Returns False when the queue is empty."""
+    claimed = claim()
+    if claimed is None:
+        return False
+    job_id, attempt, username, prompt, aspect_ratios, quota_day = _unpack(claimed)
+    progress = ProgressReporter(job_id, len(aspect_ratios))
+    try:
+        with Heartbeat(job_id, attempt):
+            results = run_batch(username, prompt, aspect_ratios, progress=progress)
+    except Exception as e:
+        logger.exception("Generation job %s failed", job_id)
+        _fail(job_id, attempt, username, aspect_ratios, quota_day, e)
+        return True
+    finally:
+        progress.clear()
+    _complete(job_id, attempt, username, aspect_ratios, quota_day, results)
+    return True
+
+
+async def _run_claimed_async(claimed):
+    job_id, attempt, username, prompt, aspect_ratios, quota_day = _unpack(claimed)
+    progress = ProgressReporter(job_id, len(aspect_ratios))
+    beat = asyncio.create_task(_heartbeat_async(job_id, attempt))
+    try:
+        results = await run_batch_async(username, prompt, aspect_ratios, progress=progress)
+    except Exception as e:
+        logger.exception("Generation job %s failed", job_id)
+        await sync_to_async(_fail)(job_id, attempt, username, aspect_ratios, quota_day, e)
+        return
+    finally:
+        beat.cancel()
+        await sync_to_async(progress.clear, thread_sensitive=False)()
+    await sync_to_async(_complete)(job_id, attempt, username, aspect_ratios, quota_day, results)
+
+
+def _claim_fresh():
+    close_old_connections()
+    return claim()
+
+
+def work(stop=None, wake=None, poll_interval=None):
+    """Run jobs until `stop` is set, sleeping on `wake` while the queue is empty."""
+    stop = stop or threading.Event()
+    wake = wake or threading.Event()
+    poll_interval = poll_interval or settings.GENERATION_POLL_INTERVAL
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            if run_next():
+                continue
+            fail_stalled()
+        except Exception:
+            logger.exception("Generation worker loop error")
+        wake.wait(poll_interval)
+        wake.clear()
+    connection.close()
+
+
+async def work_async(concurrency, stop=None, poll_interval=None, drain=False):
+    """
+    Run up to `concurrency` jobs at once on the running event loop until `stop`
+    (an asyncio.Event) is set, or with `drain`, until the queue is empty.
+    Jobs already started are always finished.
+    """
+    stop = stop or asyncio.Event()
+    poll_interval = poll_interval or settings.GENERATION_POLL_INTERVAL
+    slots = asyncio.Semaphore(max(1, concurrency))
+    running = set()
+
+    def done(task):
+        running.discard(task)
+        slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Generation job task failed", exc_info=task.exception())
+
+    while not stop.is_set():
+        await slots.acquire()
+        try:
+            claimed = await sync_to_async(_claim_fresh)()
+        except Exception:
+            logger.exception("Generation worker loop error")
+            claimed = None
+        if claimed is not None:
+            task = asyncio.create_task(_run_claimed_async(claimed))
+            running.add(task)
+            task.add_done_callback(done)
+            continue
+
+        slots.release()
+        if drain:
+            if not running:
+                break
+            # Finishing jobs may leave nothing to claim; wait for one before checking again
+            await asyncio.wait(set(running), return_when=asyncio.FIRST_COMPLETED)
+            continue
+        try:
+            await sync_to_async(fail_stalled)()
+        except Exception:
+            logger.exception("Generation worker loop error")
+        try:
+            await asyncio.wait_for(stop.wait(), poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    if running:
+        await asyncio.wait(set(running))
+    await sync_to_async(connections.close_all)()
+
+
+class Runner:
+    """In-process worker threads, started lazily so each forked web worker gets its own."""
+
+    def __init__(self, threads):
+        self.threads = threads
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def notify(self):
+        if not self.threads:
+            return  # jobs are picked up by `manage.py generation_worker`
+        self._ensure_started()
+        self._wake.set()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for n in range(self.threads):
+                threading.Thread(target=work, args=(self._stop, self._wake),
+                                 name=f'generation-worker-{n}', daemon=True).start()
+
+
+runner = Runner(settings.GENERATION_WORKERS)
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from django.utils import timezone
+
+from app import fakes, generation, jobs
+from app.generation import ASPECT_RATIOS
+
+from .bench_endpoints import RssSampler, percentile
+
+USERNAME = 'bench-async'
+MODES = ('threads', 'async')
+
+
+class ThreadSampler:
+    """Samples the process's thread count while a run is in progress."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = ("Compare generation throughput of the thread-per-job runners used under WSGI/gunicorn "
+            "with the event-loop runner (generation_worker --async). Queues jobs against the stub "
+            "model, which waits --model-delay seconds like a slow API, with S3 faked locally. "
+            "Reports jobs/s, queue-to-finish latency, peak threads and peak RSS per mode.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=200)
+        parser.add_argument('--model-delay', type=float, default=2.0,
+                            help="Seconds the stub model takes per image")
+        parser.add_argument('--threads', type=int, default=4 * max(1, settings.GENERATION_WORKERS),
+                            help="Job threads for the WSGI setup: gunicorn workers x GENERATION_WORKERS "
+                                 "(default assumes 4 workers)")
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help="Jobs in flight for the async runner")
+        parser.add_argument('--modes', default=','.join(MODES), help=f"Comma separated subset of: {', '.join(MODES)}")
+        parser.add_argument('--force', action='store_true', help="Run even when DEBUG is off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("This queues and deletes rows; point it at a scratch database and "
+                               "set DEBUG, or pass --force")
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+        restore = fakes.install()
+        overrides = override_settings(GENERATION_BACKEND='stub', GENERATION_STUB_DELAY=options['model_delay'])
+        overrides.enable()
+        generation._backend = None
+        # Only the runners under test may claim jobs, not this process's in-web runner threads
+        runner_threads, jobs.runner.threads = jobs.runner.threads, 0
+        try:
+            self.clean()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO wallify_users (firstname, lastname, email, username, password) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    ['Bench', 'Async', f'{USERNAME}@example.com', USERNAME, make_password(None)]
+                )
+            self.stdout.write(f"{options['jobs']} jobs, stub model delay {options['model_delay']}s ({connection.vendor})")
+            self.stdout.write(f"{'mode':<8} {'slots':>5} {'jobs':>5} {'failed':>6} {'jobs/s':>7} {'p50':>8} "
+                              f"{'p95':>8} {'threads':>7} {'peak RSS':>9}")
+            for mode in modes:
+                self.enqueue(options['jobs'])
+                slots = options['threads'] if mode == 'threads' else options['concurrency']
+                with ThreadSampler() as sampler, RssSampler() as rss:
+                    started = time.perf_counter()
+                    if mode == 'threads':
+                        self.run_threads(slots)
+                    else:
+                        asyncio.run(jobs.work_async(slots, drain=True))
+                    wall = time.perf_counter() - started
+                self.report(mode, slots, wall, sampler.peak, rss)
+                self.clean()
+        finally:
+            self.clean()
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM wallify_users WHERE username = %s", [USERNAME])
+            jobs.runner.threads = runner_threads
+            overrides.disable()
+            generation._backend = None
+            restore()
+
+    def enqueue(self, count):
+        # Distinct prompts so no two jobs coalesce into one model call
+        for n in range(count):
+            jobs.enqueue(USERNAME, f'benchmark async {n} {timezone.now().timestamp()}',
+                         [ASPECT_RATIOS[n % len(ASPECT_RATIOS)]])
+
+    @staticmethod
+    def run_threads(count):
+        def drain():
+            while jobs.run_next():
+                pass
+            connections.close_all()
+
+        threads = [threading.Thread(target=drain, name=f'bench-generation-{n}') for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def report(self, mode, slots, wall, peak_threads, rss):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT status, created_at, finished_at FROM generation_jobs WHERE username = %s",
+                           [USERNAME])
+            rows = cursor.fetchall()
+        done = [row for row in rows if row[0] == jobs.SUCCEEDED]
+        failed = len(rows) - len(done)
+        latencies = sorted((finished - created).total_seconds() for _, created, finished in done
+                           if created and finished)
+        self.stdout.write(
+            f"{mode:<8} {slots:>5} {len(done):>5} {failed:>6} {len(done) / wall:>7.1f} "
+            f"{percentile(latencies, 0.50):>7.2f}s {percentile(latencies, 0.95):>7.2f}s "
+            f"{peak_threads:>7} {f'{rss.peak:.0f}MB' if rss.start is not None else 'n/a':>9}"
+        )
+
+    def clean(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM images_table WHERE \"user\" = %s", [USERNAME])
+            for table in ('ai_generations', 'generation_jobs', 'generation_quota', 'user_stats'):
+                cursor.execute(f"DELETE FROM {table} WHERE username = %s", [USERNAME])
@@ -0,0 +1,84 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+
+from app.postgres_pool.base import pool_stats
+
+
+class Command(BaseCommand):
+    help = ("Load the database the way request threads do, at rising concurrency, and report "
+            "throughput, latency, server-side connection count and pool gauges. Run it once "
+            "with DB_POOL=0 to compare against Django's own connection handling.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4,16,64',
+                            help="Comma separated numbers of request threads")
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help="Seconds to run each step")
+        parser.add_argument('--query', default="SELECT premium FROM wallify_users LIMIT 1")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("bench_db_pool needs a PostgreSQL DATABASE_URL")
+        steps = [int(n) for n in options['concurrency'].split(',') if n]
+
+        self.stdout.write(f"engine={connection.settings_dict['ENGINE']} "
+                          f"conn_max_age={connection.settings_dict['CONN_MAX_AGE']}")
+        self.stdout.write(f"{'threads':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'errors':>6} "
+                          f"{'server conns':>12} {'pool size':>9} {'wait avg':>9} {'timeouts':>8}")
+        for threads in steps:
+            timings, errors, peak = self.run_step(threads, options['duration'], options['query'])
+            timings.sort()
+            stats = pool_stats().get('default', {})
+            self.stdout.write(
+                f"{threads:>7} {len(timings) / options['duration']:>8.0f} "
+                f"{statistics.median(timings) if timings else 0:>6.2f}ms "
+                f"{timings[max(0, int(len(timings) * 0.95) - 1)] if timings else 0:>6.2f}ms "
+                f"{errors:>6} {peak:>12} {stats.get('size', '-'):>9} "
+                f"{stats.get('wait_avg_ms', 0):>7.2f}ms {stats.get('timeouts', '-'):>8}"
+            )
+
+    def run_step(self, threads, duration, query):
+        stop = threading.Event()
+        timings, errors = [], []
+
+        def client():
+            while not stop.is_set():
+                # The same connection lifecycle as a request under gunicorn
+                request_started.send(sender=self.__class__)
+                start = time.perf_counter()
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(query)
+                        cursor.fetchall()
+                    timings.append((time.perf_counter() - start) * 1000)
+                except Exception:
+                    errors.append(1)
+                finally:
+                    request_finished.send(sender=self.__class__)
+            connections.close_all()
+
+        workers = [threading.Thread(target=client) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        peak = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            peak = max(peak, self.server_connections())
+            time.sleep(0.2)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        return timings, len(errors), peak
+
+    def server_connections(self):
+        # Backends connected to this database from anywhere, including this sampler
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()")
+            count = cursor.fetchone()[0]
+        connection.close()
+        return count
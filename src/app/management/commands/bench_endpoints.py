@@ -0,0 +1,340 @@
+import math
+import random
+import resource
+import statistics
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from app import fakes, generation, jobs, support
+from app.avatars import save_avatar
+from app.generation import ASPECT_RATIOS
+
+from .bench_search import VOCABULARY
+
+# Everything seeded is tagged so it can be found and removed again
+USER_PREFIX = 'bench-'
+MARKER = 'benchmark'
+
+ENDPOINTS = ('gallery', 'profile', 'avatar', 'support', 'support_thread', 'generate_image', 'upload_image')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p * len(sorted_values)) - 1)]
+
+
+def current_rss():
+    """This process's resident set size in MB, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * resource.getpagesize() / (1024 * 1024)
+
+
+class RssSampler:
+    """Samples current RSS while one endpoint runs; ru_maxrss only ever reports the process's high-water mark."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.start = self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss())
+
+
+def jpeg(width, height, seed):
+    # A gradient with some structure, so encoders and resizers do realistic work
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    image = Image.merge('RGB', [band.rotate(seed * 40 + i * 90, expand=False) for i, band in enumerate(image.split())])
+    out = BytesIO()
+    image.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+class Command(BaseCommand):
+    help = ("Seed the app's tables at a chosen scale and load its main endpoints in-process with "
+            "local stand-ins for S3, Replicate and Stripe. Reports latency percentiles, throughput, "
+            "queries per request and peak RSS (and its growth) per endpoint. Run against a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--images', type=int, default=5000)
+        parser.add_argument('--favorites', type=int, default=20, help="Favorites per user")
+        parser.add_argument('--search-terms', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=300, help="Support threads")
+        parser.add_argument('--messages', type=int, default=8, help="Messages per support thread")
+        parser.add_argument('--avatars', type=int, default=20, help="Users given an uploaded avatar")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=4, help="Client threads per endpoint")
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help=f"Comma separated subset of: {', '.join(ENDPOINTS)}")
+        parser.add_argument('--upload-size', default='1920x1080', help="Uploaded image dimensions")
+        parser.add_argument('--model-delay', type=float, default=0.05,
+                            help="Seconds the stub model takes per image")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help="Leave the seeded rows in place")
+        parser.add_argument('--force', action='store_true', help="Run even when DEBUG is off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("This seeds and deletes rows; point it at a scratch database and "
+                               "set DEBUG, or pass --force")
+        endpoints = [name for name in options['endpoints'].split(',') if name]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.session_keys = []
+        width, height = (int(n) for n in options['upload_size'].split('x'))
+        self.upload = jpeg(width, height, options['seed'])
+
+        restore = fakes.install()
+        overrides = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            GENERATION_BACKEND='stub',
+            GENERATION_STUB_DELAY=options['model_delay'],
+        )
+        overrides.enable()
+        generation._backend = None
+        try:
+            started = time.perf_counter()
+            self.seed()
+            self.stdout.write(
+                f"Seeded {options['users']} users, {options['images']} images, "
+                f"{options['users'] * options['favorites']} favorites, {options['search_terms']} search terms, "
+                f"{options['threads']} threads x {options['messages']} messages, {options['avatars']} avatars "
+                f"in {time.perf_counter() - started:.1f}s ({connection.vendor})"
+            )
+            self.stdout.write(f"{'endpoint':<15} {'reqs':>5} {'errors':>6} {'req/s':>7} {'p50':>8} {'p95':>8} "
+                              f"{'p99':>8} {'queries':>7} {'peak RSS':>9} {'growth':>8}")
+            for name in endpoints:
+                with RssSampler() as rss:
+                    results = self.run(name)
+                self.report(name, *results, rss)
+        finally:
+            # Let queued generations finish before their rows are removed
+            while jobs.run_next():
+                pass
+            overrides.disable()
+            generation._backend = None
+            restore()
+            if not options['keep']:
+                self.clean()
+
+    # --- data -------------------------------------------------------------
+
+    def words(self, low, high):
+        return ' '.join(self.rng.sample(VOCABULARY, self.rng.randint(low, high)))
+
+    def seed(self):
+        options, rng = self.options, self.rng
+        self.clean()
+        now = timezone.now()
+        password = make_password('benchmark')
+        self.users = [f'{USER_PREFIX}{i:05d}' for i in range(options['users'])]
+        # Every other user is premium, so generation is not capped by the daily quota
+        self.premium_users = self.users[::2]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO wallify_users (username, email, password, premium) VALUES (%s, %s, %s, %s)",
+                [[user, f'{user}@example.com', password, 1 if i % 2 == 0 else 0] for i, user in enumerate(self.users)]
+            )
+
+            self.image_keys = [f'bench/{i:07d}_{rng.getrandbits(32):08x}.jpg' for i in range(options['images'])]
+            rows = [[key, f'{MARKER} {self.words(3, 8)}', rng.choice(self.users), '320,640,1280', 1920, 1080]
+                    for key in self.image_keys]
+            for start in range(0, len(rows), 1000):
+                cursor.executemany(
+                    "INSERT INTO images_table (image_key, description, \"user\", thumb_widths, width, height) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    rows[start:start + 1000]
+                )
+
+            favorites = [[key, user] for user in self.users
+                         for key in rng.sample(self.image_keys, min(options['favorites'], len(self.image_keys)))]
+            for start in range(0, len(favorites), 1000):
+                cursor.executemany("INSERT INTO favorites (image_key, username) VALUES (%s, %s)",
+                                   favorites[start:start + 1000])
+
+            cursor.executemany(
+                "INSERT INTO search_logs (search_term, search_count) VALUES (%s, %s) "
+                "ON CONFLICT (search_term) DO NOTHING",
+                [[f'{MARKER} {self.words(1, 3)}', rng.randint(1, 1000)] for _ in range(options['search_terms'])]
+            )
+
+            statuses, categories = ('open', 'resolved', 'closed'), ('technical', 'order', 'general', 'feedback')
+            cursor.executemany(
+                "INSERT INTO support_threads (title, author_username, created_at, status, category) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [[f'{self.words(3, 6).capitalize()}?', rng.choice(self.users),
+                  now - timedelta(minutes=rng.randint(0, 90 * 24 * 60)),
+                  rng.choice(statuses), rng.choice(categories)] for _ in range(options['threads'])]
+            )
+            cursor.execute("SELECT id, created_at FROM support_threads WHERE author_username LIKE %s",
+                           [USER_PREFIX + '%'])
+            threads = cursor.fetchall()
+            self.thread_ids = [thread_id for thread_id, _ in threads]
+            messages = [[thread_id, rng.choice(self.users), self.words(10, 40),
+                         created_at + timedelta(minutes=n * rng.randint(1, 600)), n % 3 == 2]
+                        for thread_id, created_at in threads for n in range(options['messages'])]
+            for start in range(0, len(messages), 1000):
+                cursor.executemany(
+                    "INSERT INTO thread_messages (thread_id, author_username, content, created_at, is_admin_reply) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    messages[start:start + 1000]
+                )
+            # Raw inserts bypass the ThreadMessage receivers
+            support.refresh_stats(self.thread_ids)
+
+        self.avatar_users = self.users[:options['avatars']]
+        for i, user in enumerate(self.avatar_users):
+            save_avatar(user, jpeg(640, 640, i))
+
+    def clean(self):
+        pattern = USER_PREFIX + '%'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM thread_messages WHERE thread_id IN "
+                "(SELECT id FROM support_threads WHERE author_username LIKE %s)", [pattern]
+            )
+            cursor.execute("DELETE FROM support_threads WHERE author_username LIKE %s", [pattern])
+            cursor.execute("DELETE FROM favorites WHERE username LIKE %s", [pattern])
+            cursor.execute("DELETE FROM images_table WHERE \"user\" LIKE %s", [pattern])
+            cursor.execute("DELETE FROM search_logs WHERE search_term LIKE %s", [MARKER + ' %'])
+            for table in ('ai_generations', 'generation_jobs', 'generation_quota', 'user_avatars'):
+                cursor.execute(f"DELETE FROM {table} WHERE username LIKE %s", [pattern])
+            cursor.execute("DELETE FROM wallify_users WHERE username LIKE %s", [pattern])
+        for key in self.session_keys:
+            SessionStore(session_key=key).delete()
+        self.session_keys = []
+
+    # --- load -------------------------------------------------------------
+
+    def client(self, username):
+        client = Client(raise_request_exception=False)
+        session = client.session
+        session['username'] = username
+        session.save()
+        self.session_keys.append(session.session_key)
+        return client
+
+    def request(self, name, client, rng):
+        """Issue one request for the endpoint; returns (response, expected status codes)."""
+        if name == 'gallery':
+            return client.get('/gallery/', {'q': f'{MARKER} {" ".join(rng.sample(VOCABULARY, rng.randint(1, 2)))}'},
+                              secure=True), (200,)
+        if name == 'profile':
+            return client.get(f'/profile/{rng.choice(self.users)}/', secure=True), (200,)
+        if name == 'avatar':
+            user = rng.choice(self.avatar_users or self.users)
+            return client.get(f'/profile-picture/{user}/', {'size': rng.choice(list(settings.AVATAR_SIZES))},
+                              secure=True), (200, 304)
+        if name == 'support':
+            pages = max(1, math.ceil(len(self.thread_ids) / 10))
+            return client.get('/support/', {'page': rng.randint(1, pages)}, secure=True), (200,)
+        if name == 'support_thread':
+            return client.get(f'/support/thread/{rng.choice(self.thread_ids)}/', secure=True), (200,)
+        if name == 'generate_image':
+            return client.post('/generate_image/', {
+                'prompt': f'{MARKER} {" ".join(rng.sample(VOCABULARY, 4))}',
+                'aspect_ratio': rng.choice(ASPECT_RATIOS),
+            }, secure=True, HTTP_X_REQUESTED_WITH='XMLHttpRequest'), (202,)
+        if name == 'upload_image':
+            upload = SimpleUploadedFile(f'bench_{uuid.uuid4().hex}.jpg', self.upload, content_type='image/jpeg')
+            return client.post('/upload_image/', {'image': upload, 'description': f'{MARKER} {self.words(3, 6)}'},
+                               secure=True), (302,)
+        raise CommandError(f"Unknown endpoint {name}")
+
+    def run(self, name):
+        options = self.options
+        users = self.premium_users if name == 'generate_image' else self.users
+        clients = [self.client(users[n % len(users)]) for n in range(max(1, options['concurrency']))]
+        # A few untimed requests first, so one-off setup (templates, clients, indexes) is not counted
+        warm_rng = random.Random(options['seed'])
+        for _ in range(3):
+            self.request(name, clients[0], warm_rng)
+
+        lock = threading.Lock()
+        remaining = [options['requests']]
+        timings, queries, errors = [], [], []
+
+        def worker(client, seed):
+            rng = random.Random(seed)
+            counter = [0]
+
+            def count(execute, sql, params, many, context):
+                counter[0] += 1
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            break
+                        remaining[0] -= 1
+                    counter[0] = 0
+                    start = time.perf_counter()
+                    response, expected = self.request(name, client, rng)
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        timings.append(elapsed * 1000)
+                        queries.append(counter[0])
+                        if response.status_code not in expected:
+                            errors.append(response.status_code)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(client, options['seed'] + n))
+                   for n, client in enumerate(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        return sorted(timings), queries, errors, wall
+
+    def report(self, name, timings, queries, errors, wall, rss):
+        # Peak resident memory while this endpoint ran, and how far it rose above the level it started at
+        memory = (f"{rss.peak:>7.0f}MB {rss.peak - rss.start:>+6.0f}MB" if rss.start is not None
+                  else f"{'n/a':>9} {'n/a':>8}")
+        self.stdout.write(
+            f"{name:<15} {len(timings):>5} {len(errors):>6} {len(timings) / wall:>7.1f} "
+            f"{percentile(timings, 0.50):>6.1f}ms {percentile(timings, 0.95):>6.1f}ms "
+            f"{percentile(timings, 0.99):>6.1f}ms {statistics.mean(queries) if queries else 0:>7.1f} "
+            f"{memory}"
+        )
+        if errors:
+            codes = {code: errors.count(code) for code in sorted(set(errors))}
+            self.stdout.write(self.style.WARNING(f"  unexpected responses: {codes}"))
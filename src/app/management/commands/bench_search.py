@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from app.search import BACKENDS
+
+VOCABULARY = (
+    "4k wallpapers landscape portrait sunset sunrise mountain lake forest ocean city night neon "
+    "abstract minimal space galaxy stars anime car cherry blossom snow desert river aurora dark "
+    "light pastel retro cyberpunk ai generated nature flowers sky clouds rain autumn spring"
+).split()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare legacy ILIKE gallery search with the indexed search backend across catalogue sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help="Comma separated catalogue sizes to seed.")
+        parser.add_argument('--queries', nargs='*', default=['4k wallpapers', 'sunset lake', 'neon city night'])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        rng = random.Random(options['seed'])
+        backend_name = 'postgres' if connection.vendor == 'postgresql' else 'memory'
+
+        self.stdout.write(f"backend={backend_name} vendor={connection.vendor} repeat={options['repeat']}")
+        self.stdout.write(f"{'rows':>9} {'legacy p50':>11} {'legacy p95':>11} {'indexed p50':>12} {'indexed p95':>12}")
+
+        # All synthetic rows live inside a transaction that is rolled back at the end
+        try:
+            with transaction.atomic():
+                seeded = 0
+                for size in sizes:
+                    self.seed(rng, size - seeded)
+                    seeded = size
+                    if connection.vendor == 'postgresql':
+                        with connection.cursor() as cursor:
+                            cursor.execute("ANALYZE images_table")
+
+                    backend = BACKENDS[backend_name]()
+                    backend.search('warmup')  # builds the in-memory index outside the timings
+
+                    legacy = self.measure(self.legacy_search, options['queries'], options['repeat'])
+                    indexed = self.measure(backend.search, options['queries'], options['repeat'])
+                    self.stdout.write(
+                        f"{size:>9} {legacy[0]:>9.2f}ms {legacy[1]:>9.2f}ms {indexed[0]:>10.2f}ms {indexed[1]:>10.2f}ms"
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rng, count):
+        rows = []
+        for i in range(count):
+            words = rng.sample(VOCABULARY, rng.randint(3, 8))
+            rows.append([f"bench/{rng.getrandbits(64):016x}_{i}.jpg", ', '.join(words), 'bench_user'])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO images_table (image_key, description, \"user\") VALUES (%s, %s, %s)",
+                rows
+            )
+
+    def legacy_search(self, query):
+        # The per-keyword filter gallery() used before the search backend existed
+        operator = 'ILIKE' if connection.vendor == 'postgresql' else 'LIKE'
+        keywords = query.split()
+        sql = "SELECT image_key, \"user\" FROM images_table WHERE " + " AND ".join(
+            f"description {operator} %s" for _ in keywords
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, ['%' + keyword + '%' for keyword in keywords])
+            return cursor.fetchall()
+
+    def measure(self, search, queries, repeat):
+        timings = []
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                search(query)
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
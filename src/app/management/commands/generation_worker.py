@@ -0,0 +1,78 @@
+import asyncio
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app import generation, jobs
+
+
+class Command(BaseCommand):
+    help = ("Run queued AI image generation jobs. Use with GENERATION_WORKERS=0 to keep "
+            "generation out of the web processes entirely.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2,
+                            help="Jobs to run at once (each waits mostly on the model API)")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the queue and exit instead of polling forever")
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help="Run jobs as coroutines on one event loop instead of threads; "
+                                 "a --concurrency in the hundreds is fine")
+
+    def handle(self, *args, **options):
+        if options['use_async']:
+            self._run_async(max(1, options['concurrency']), options['once'])
+            return
+
+        if options['once']:
+            done = 0
+            while jobs.run_next():
+                done += 1
+            self.stdout.write(f"Ran {done} generation jobs")
+            self._report()
+            return
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=jobs.work, args=(stop,), name=f'generation-worker-{n}')
+            for n in range(max(1, options['concurrency']))
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Generation worker running {len(threads)} threads "
+                          f"(backend: {settings.GENERATION_BACKEND}); Ctrl-C to stop")
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after current jobs finish")
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self._report()
+
+    def _run_async(self, concurrency, once):
+        async def main():
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            await jobs.work_async(concurrency, stop, drain=once)
+
+        if not once:
+            self.stdout.write(f"Generation worker running up to {concurrency} jobs on an event loop "
+                              f"(backend: {settings.GENERATION_BACKEND}); Ctrl-C to stop")
+        asyncio.run(main())
+        self._report()
+
+    def _report(self):
+        stats = generation.cache_stats()
+        flights, results = stats['flights'], stats['results']
+        self.stdout.write(
+            f"Model calls: {flights['calls']}, coalesced: {flights['coalesced']}; "
+            f"result cache hits: {results['hits']}, misses: {results['misses']}, "
+            f"hit rate: {results['hit_rate']:.0%}, evictions: {results['evictions']}"
+        )
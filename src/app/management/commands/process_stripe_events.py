@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app import billing
+
+
+class Command(BaseCommand):
+    help = ("Apply recorded Stripe webhook events. Use with STRIPE_EVENT_WORKER=0 to keep "
+            "event processing out of the web processes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Apply the events that are due and exit instead of polling forever")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"Applied {billing.process_pending()} Stripe events")
+            return
+
+        self.stdout.write("Applying Stripe events; Ctrl-C to stop")
+        try:
+            while True:
+                close_old_connections()
+                done = billing.process_pending()
+                if done:
+                    self.stdout.write(f"Applied {done} Stripe events")
+                time.sleep(settings.STRIPE_EVENT_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app.avatars import save_avatar
+from app.imaging import InvalidImage
+
+
+class Command(BaseCommand):
+    help = "Render the normalized avatar sizes for users whose picture predates them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-render every avatar, not just missing ones.")
+
+    def handle(self, *args, **options):
+        sql = "SELECT username FROM wallify_users u WHERE pfp IS NOT NULL"
+        if not options['all']:
+            sql += " AND NOT EXISTS (SELECT 1 FROM user_avatars a WHERE a.username = u.username)"
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            usernames = [row[0] for row in cursor.fetchall()]
+
+        rebuilt = failed = 0
+        for username in usernames:
+            # One blob at a time keeps memory flat on large user tables
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pfp FROM wallify_users WHERE username = %s", [username])
+                row = cursor.fetchone()
+            if not row or row[0] is None:
+                continue
+            try:
+                save_avatar(username, bytes(row[0]))
+                rebuilt += 1
+            except InvalidImage as e:
+                failed += 1
+                self.stderr.write(f"{username}: {e}")
+
+        self.stdout.write(f"Rebuilt {rebuilt} avatars ({failed} unreadable)")
@@ -0,0 +1,52 @@
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app.services import get_s3
+from app.thumbnails import generate_derivatives
+
+
+class Command(BaseCommand):
+    help = "Render thumbnails and blur placeholders for images uploaded before derivatives existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        sql = "SELECT id, image_key FROM images_table WHERE thumb_widths IS NULL AND placeholder IS NULL ORDER BY id DESC"
+        params = []
+        if options['limit']:
+            sql += " LIMIT %s"
+            params.append(options['limit'])
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        s3 = get_s3()
+        done = 0
+        for image_id, image_key in rows:
+            # Spool the original to disk so large wallpapers don't sit in memory
+            with tempfile.TemporaryFile() as original:
+                try:
+                    s3.download_fileobj(settings.AWS_STORAGE_BUCKET_NAME, f'images/{image_key}', original)
+                except Exception as e:
+                    self.stderr.write(f"{image_key}: {e}")
+                    continue
+                original.seek(0)
+                derivatives = generate_derivatives(s3, image_key, original)
+            if not derivatives.placeholder:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE images_table SET thumb_widths = %s, placeholder = %s, width = %s, height = %s
+                    WHERE id = %s
+                    """,
+                    [','.join(str(w) for w in derivatives.widths) or None, derivatives.placeholder,
+                     derivatives.width, derivatives.height, image_id]
+                )
+            done += 1
+
+        self.stdout.write(f"Rendered derivatives for {done} of {len(rows)} images")
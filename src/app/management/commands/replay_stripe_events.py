@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+from django.test import RequestFactory, override_settings
+
+from app import billing, entitlements
+from app.views import stripe_webhook
+
+FIXTURES = Path(__file__).resolve().parents[2] / 'fixtures' / 'stripe_events'
+REPLAY_SECRET = 'whsec_replay'
+# Replayed events get their own ids so they can never collide with real ones
+REPLAY_PREFIX = 'evt_replay_'
+
+
+def sign(payload, secret, timestamp):
+    # Stripe-Signature: HMAC-SHA256 over "<timestamp>.<payload>"
+    signed = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signed}"
+
+
+class Command(BaseCommand):
+    help = ("Replay recorded Stripe webhook events through the webhook view, including "
+            "duplicate deliveries, then apply them and report ingest latency and counts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='*',
+                            help=f"Event JSON files (default: every file in {FIXTURES})")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Deliveries of each event; all but the first should be ignored")
+        parser.add_argument('--copies', type=int, default=1,
+                            help="Distinct copies of each event (each with its own id)")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--username', help="Rewrite the events to refer to this user")
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the replayed rows in stripe_events and what applying them changed "
+                                 "(such as premium flags); by default both are rolled back")
+
+    def handle(self, *args, **options):
+        paths = [Path(p) for p in options['fixtures']] or sorted(FIXTURES.glob('*.json'))
+        if not paths:
+            raise CommandError("No event fixtures found")
+
+        deliveries, usernames = [], set()
+        for path in paths:
+            recorded = path.read_text()
+            for copy in range(max(1, options['copies'])):
+                event = json.loads(recorded)
+                event['id'] = f"{REPLAY_PREFIX}{copy}_{event['id']}"
+                if options['username']:
+                    obj = event['data']['object']
+                    obj['client_reference_id'] = options['username']
+                    if isinstance(obj.get('metadata'), dict):
+                        obj['metadata']['username'] = options['username']
+                usernames.add(billing._checkout_username(event['data']['object']))
+                payload = json.dumps(event).encode()
+                deliveries.extend([payload] * max(1, options['repeat']))
+
+        self.clear()
+        factory = RequestFactory()
+
+        def deliver(payload):
+            close_old_connections()
+            request = factory.post('/stripe/webhook', data=payload, content_type='application/json',
+                                   HTTP_STRIPE_SIGNATURE=sign(payload, REPLAY_SECRET, int(time.time())))
+            start = time.perf_counter()
+            # The view is async; run it to completion on this pool thread
+            response = async_to_sync(stripe_webhook)(request)
+            elapsed = (time.perf_counter() - start) * 1000
+            close_old_connections()
+            return response.status_code, elapsed
+
+        # Apply events here, after ingest, rather than in the background worker
+        enabled, billing.worker.enabled = billing.worker.enabled, False
+        try:
+            with override_settings(STRIPE_WEBHOOK_SECRET=REPLAY_SECRET):
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max(1, options['concurrency'])) as pool:
+                    results = list(pool.map(deliver, deliveries))
+                ingest_seconds = time.perf_counter() - started
+
+            # The handlers really run (a checkout makes its user premium), so unless
+            # --keep is given everything they write is rolled back afterwards
+            with transaction.atomic():
+                before = self.counts()
+                started = time.perf_counter()
+                applied = billing.process_pending()
+                apply_seconds = time.perf_counter() - started
+                after = self.counts()
+                transaction.set_rollback(not options['keep'])
+        finally:
+            billing.worker.enabled = enabled
+            if not options['keep']:
+                # set_premium cached the flags that were just rolled back
+                for username in usernames - {None}:
+                    entitlements.invalidate(username)
+
+        timings = sorted(elapsed for _, elapsed in results)
+        statuses = {}
+        for status, _ in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        self.stdout.write(
+            f"Delivered {len(results)} webhooks in {ingest_seconds:.2f}s "
+            f"({len(results) / ingest_seconds:.0f}/s); responses: {statuses}"
+        )
+        self.stdout.write(
+            f"Ingest latency p50 {statistics.median(timings):.2f}ms, "
+            f"p95 {timings[max(0, int(len(timings) * 0.95) - 1)]:.2f}ms, max {timings[-1]:.2f}ms"
+        )
+        self.stdout.write(
+            f"Recorded {before.get(billing.PENDING, 0)} events, ignored "
+            f"{len(results) - before.get(billing.PENDING, 0)} duplicate deliveries; applied {applied} "
+            f"in {apply_seconds:.2f}s; now {after}"
+        )
+
+        if not options['keep']:
+            self.clear()
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM stripe_events WHERE id LIKE %s", [REPLAY_PREFIX + '%'])
+
+    def counts(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT status, COUNT(*) FROM stripe_events WHERE id LIKE %s GROUP BY status",
+                [REPLAY_PREFIX + '%']
+            )
+            return dict(cursor.fetchall())
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import services
+
+# Run in a fresh interpreter so nothing is already imported; prints JSON timings
+PROBE = """
+import json, sys, time
+import django
+django.setup()
+timings = {}
+started = time.perf_counter()
+import app.views
+timings['import app.views'] = time.perf_counter() - started
+for module in sys.argv[1:]:
+    started = time.perf_counter()
+    __import__(module)
+    timings['import ' + module] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+SDK_MODULES = ['boto3', 'replicate', 'stripe']
+
+
+class Command(BaseCommand):
+    help = ("Measure process startup cost: importing the views (which no longer pull in "
+            "boto3/replicate/stripe) and building each shared service client.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3,
+                            help="Fresh interpreters to average the import timings over")
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+        totals = {}
+        for _ in range(runs):
+            for label, seconds in self._probe().items():
+                totals[label] = totals.get(label, 0) + seconds
+
+        self.stdout.write(f"Cold imports (mean of {runs} fresh interpreters):")
+        for label, seconds in totals.items():
+            self.stdout.write(f"  {label:<24} {seconds / runs * 1000:8.1f} ms")
+        self.stdout.write("  (SDK imports are paid lazily by the first request that needs the client)")
+
+        started = time.perf_counter()
+        timings = services.warm_up()
+        total = time.perf_counter() - started
+        self.stdout.write("Client construction in this process (import + pool setup):")
+        for name, seconds in timings.items():
+            self.stdout.write(f"  {name:<24} {seconds * 1000:8.1f} ms")
+        self.stdout.write(f"  {'total':<24} {total * 1000:8.1f} ms, once per process")
+
+    def _probe(self):
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, *SDK_MODULES],
+            capture_output=True, text=True, check=True, env=os.environ.copy(),
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
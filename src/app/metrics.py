@@ -0,0 +1,121 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Counters and histograms are created once at import time and updated with a
+lock held for a few dict operations, so they are cheap enough for every
+request. `register_collector` adds callbacks that are read only when /metrics
+is scraped, for numbers other modules already keep (connection pool,
+generation caches).
+
+Values are per process; with several gunicorn workers each scrape sees the
+worker that answered it, so scrape every worker or aggregate in Prometheus.
+"""
+import bisect
+import math
+import threading
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with _lock:
+            values = list(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                                for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with _lock:
+            values = [(key, list(series)) for key, series in self._values.items()]
+        lines = self.header()
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", _format_value(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {series[-1]}')
+        return lines
+
+
+def register_collector(fn):
+    """fn() returns [(name, kind, help, [(labels_dict, value), ...]), ...], read at scrape time."""
+    with _lock:
+        _collectors.append(fn)
+    return fn
+
+
+def render():
+    lines = []
+    for metric in list(_metrics):
+        lines.extend(metric.render())
+    for collector in list(_collectors):
+        for name, kind, help, samples in collector():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,228 @@
+"""
+Per-view SQL profiling, and static files for async serving.
+
+SQLProfilerMiddleware counts each request's statements and their time. The
+request's profile sits in a context variable that a wrapper on every database
+connection reports to, so statements are counted whichever thread runs them,
+including the sync_to_async threads of async views. When the response is
+ready it records, labelled by URL name, the request duration, queries per
+request and DB time per request as histograms, and the slowest statement seen
+for the view. Statements slower than SQL_SLOW_QUERY_THRESHOLD are logged with
+literals and parameters redacted.
+
+StaticFilesMiddleware is WhiteNoise that also runs in async mode, serving file
+bodies from the thread pool, so ASGI requests never fall back to a thread.
+"""
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+request_duration = metrics.Histogram(
+    'wallify_request_duration_seconds', 'Time to produce a response, by view.', ['view', 'method'])
+request_queries = metrics.Histogram(
+    'wallify_db_queries_per_request', 'SQL statements executed per request, by view.', ['view'],
+    buckets=metrics.COUNT_BUCKETS)
+request_db_time = metrics.Histogram(
+    'wallify_db_time_per_request_seconds', 'Time spent in SQL per request, by view.', ['view'])
+slow_queries = metrics.Counter(
+    'wallify_db_slow_queries_total', 'Statements slower than SQL_SLOW_QUERY_THRESHOLD, by view.', ['view'])
+
+_slowest = {}  # view -> (seconds, redacted statement)
+_slowest_lock = threading.Lock()
+
+
+@metrics.register_collector
+def _slowest_queries():
+    with _slowest_lock:
+        samples = [({'view': view, 'statement': statement}, seconds)
+                   for view, (seconds, statement) in _slowest.items()]
+    return [('wallify_db_slowest_query_seconds', 'gauge',
+             'Slowest statement seen for each view since start.', samples)]
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def redact(sql):
+    """The statement with literals replaced by ? and whitespace collapsed."""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _describe_params(params, many):
+    if many:
+        return f'<{len(params) if hasattr(params, "__len__") else "?"} rows>'
+    if params is None:
+        return '[]'
+    values = params.values() if isinstance(params, dict) else params
+    return '[' + ', '.join(type(value).__name__ for value in values) + ']'
+
+
+class QueryProfile:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+        self.slowest_sql = None
+        self.slow = 0
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if elapsed > self.slowest:
+                self.slowest, self.slowest_sql = elapsed, sql
+            if elapsed >= settings.SQL_SLOW_QUERY_THRESHOLD:
+                self.slow += 1
+                logger.warning("Slow query (%.1f ms) in %s: %s params=%s", elapsed * 1000,
+                               self.view or 'unknown view', redact(sql), _describe_params(params, many))
+
+
+# The QueryProfile of the request being served in this context, if any
+current_profile = ContextVar('sql_profile', default=None)
+
+
+def _profiled(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_profiler(sender, connection, **kwargs):
+    # Connections are reopened per request (CONN_MAX_AGE, pooling); add the wrapper once
+    if _profiled not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_profiled)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class SQLProfilerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.SQL_PROFILER:
+            return self.get_response(request)
+        # This thread's connection may predate this module's signal receiver
+        _install_profiler(None, connection)
+        profile, token = self._start(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        self._record(request, profile, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.SQL_PROFILER:
+            return await self.get_response(request)
+        profile, token = self._start(request)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        self._record(request, profile, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _start(request):
+        profile = QueryProfile()
+        request.sql_profile = profile
+        return profile, current_profile.set(profile)
+
+    @staticmethod
+    def _record(request, profile, elapsed):
+        view = _view_name(request)
+        request_duration.observe(elapsed, view, request.method)
+        request_queries.observe(profile.count, view)
+        request_db_time.observe(profile.duration, view)
+        if profile.slow:
+            slow_queries.inc(view, amount=profile.slow)
+        if profile.slowest_sql is not None and profile.slowest > _slowest.get(view, (0.0,))[0]:
+            statement = redact(profile.slowest_sql)[:200]
+            with _slowest_lock:
+                if profile.slowest > _slowest.get(view, (0.0,))[0]:
+                    _slowest[view] = (profile.slowest, statement)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Lets slow-query log lines name the view; the URL is resolved by now
+        profile = getattr(request, 'sql_profile', None)
+        if profile is not None:
+            profile.view = _view_name(request)
+
+
+async def _read_async(file, block_size=64 * 1024):
+    try:
+        while True:
+            chunk = await sync_to_async(file.read, thread_sensitive=False)(block_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+        response = await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        # A file iterator would be drained into memory by the ASGI handler; stream it instead
+        if response.file_to_stream is not None:
+            response.streaming_content = _read_async(response.file_to_stream)
+        return response
@@ -0,0 +1,153 @@
+from django.db import migrations
+
+from app.schema import is_postgres
+
+# The production tables were created by hand before this app had migrations.
+# CREATE TABLE IF NOT EXISTS leaves them untouched there, while fresh SQLite/test
+# databases get an equivalent schema to run against. SQLite cannot add an
+# auto-incrementing column after the fact, so its images_table is created with
+# the `id` that 0002 adds on PostgreSQL.
+
+POSTGRES_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS wallify_users (
+        id SERIAL,
+        username VARCHAR(50) PRIMARY KEY,
+        firstname VARCHAR(50),
+        lastname VARCHAR(50),
+        email VARCHAR(100),
+        password VARCHAR(100) NOT NULL,
+        pfp BYTEA,
+        premium INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS images_table (
+        image_key TEXT NOT NULL,
+        description TEXT,
+        "user" VARCHAR(50)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS favorites (
+        image_key TEXT NOT NULL,
+        username VARCHAR(50) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS search_logs (
+        search_term TEXT NOT NULL,
+        search_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ai_generations (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) NOT NULL,
+        prompt TEXT NOT NULL,
+        image_url VARCHAR(200) NOT NULL,
+        aspect_ratio VARCHAR(10) NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS support_threads (
+        id BIGSERIAL PRIMARY KEY,
+        title VARCHAR(200) NOT NULL,
+        author_username VARCHAR(50) NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        category VARCHAR(50) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS thread_messages (
+        id BIGSERIAL PRIMARY KEY,
+        thread_id BIGINT NOT NULL REFERENCES support_threads (id) ON DELETE CASCADE,
+        author_username VARCHAR(50) NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        is_admin_reply BOOLEAN NOT NULL
+    )
+    """,
+]
+
+SQLITE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS wallify_users (
+        id INTEGER,
+        username VARCHAR(50) PRIMARY KEY,
+        firstname VARCHAR(50),
+        lastname VARCHAR(50),
+        email VARCHAR(100),
+        password VARCHAR(100) NOT NULL,
+        pfp BLOB,
+        premium INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS images_table (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_key TEXT NOT NULL,
+        description TEXT,
+        "user" VARCHAR(50)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS favorites (
+        image_key TEXT NOT NULL,
+        username VARCHAR(50) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS search_logs (
+        search_term TEXT NOT NULL,
+        search_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ai_generations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(50) NOT NULL,
+        prompt TEXT NOT NULL,
+        image_url VARCHAR(200) NOT NULL,
+        aspect_ratio VARCHAR(10) NOT NULL,
+        created_at DATETIME NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS support_threads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title VARCHAR(200) NOT NULL,
+        author_username VARCHAR(50) NOT NULL,
+        created_at DATETIME NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        category VARCHAR(50) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS thread_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        thread_id INTEGER NOT NULL REFERENCES support_threads (id) ON DELETE CASCADE,
+        author_username VARCHAR(50) NOT NULL,
+        content TEXT NOT NULL,
+        created_at DATETIME NOT NULL,
+        is_admin_reply BOOL NOT NULL
+    )
+    """,
+]
+
+
+def create_legacy_tables(apps, schema_editor):
+    statements = POSTGRES_TABLES if is_postgres(schema_editor) else SQLITE_TABLES
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(create_legacy_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+from app.schema import add_column, is_postgres, try_execute
+
+
+def add_search_index(apps, schema_editor):
+    # Stable row id for ranking ties and (later) keyset paging
+    add_column(schema_editor, 'images_table', 'id', {'postgresql': 'BIGSERIAL'})
+    if not is_postgres(schema_editor):
+        # SQLite/test setups are served by the in-process inverted index
+        return
+
+    schema_editor.execute("CREATE UNIQUE INDEX IF NOT EXISTS images_table_id_idx ON images_table (id)")
+    add_column(
+        schema_editor, 'images_table', 'search_vector',
+        "tsvector GENERATED ALWAYS AS (to_tsvector('english', coalesce(description, ''))) STORED",
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS images_table_search_vector_idx ON images_table USING GIN (search_vector)"
+    )
+    # Trigram index backs the fuzzy fallback; pg_trgm may need a superuser, so it's optional
+    if try_execute(schema_editor, "CREATE EXTENSION IF NOT EXISTS pg_trgm"):
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS images_table_description_trgm_idx "
+            "ON images_table USING GIN (description gin_trgm_ops)"
+        )
+
+
+def remove_search_index(apps, schema_editor):
+    if not is_postgres(schema_editor):
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS images_table_description_trgm_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS images_table_search_vector_idx")
+    schema_editor.execute("ALTER TABLE images_table DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_legacy_tables'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
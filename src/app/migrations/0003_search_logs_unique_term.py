@@ -0,0 +1,41 @@
+from django.db import migrations
+
+from app.schema import execute_each
+
+# search_logs was maintained with SELECT-then-UPDATE/INSERT, which could race
+# into duplicate terms. Fold duplicates together before adding the unique
+# index that the batched ON CONFLICT upsert relies on.
+MERGE_DUPLICATES = [
+    """
+    CREATE TABLE search_logs_merged AS
+    SELECT search_term, SUM(search_count) AS search_count
+    FROM search_logs
+    GROUP BY search_term
+    """,
+    "DELETE FROM search_logs",
+    """
+    INSERT INTO search_logs (search_term, search_count)
+    SELECT search_term, search_count FROM search_logs_merged
+    """,
+    "DROP TABLE search_logs_merged",
+    "CREATE UNIQUE INDEX IF NOT EXISTS search_logs_search_term_uniq ON search_logs (search_term)",
+]
+
+
+def add_unique_term(apps, schema_editor):
+    execute_each(schema_editor, MERGE_DUPLICATES)
+
+
+def remove_unique_term(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS search_logs_search_term_uniq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_image_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_unique_term, remove_unique_term),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from app.schema import add_column
+
+
+def add_avatar_metadata(apps, schema_editor):
+    # Enough to answer conditional GETs without reading the pfp blob.
+    # Existing rows are backfilled lazily by app.avatars on first request.
+    add_column(schema_editor, 'wallify_users', 'pfp_etag', 'VARCHAR(64)')
+    add_column(schema_editor, 'wallify_users', 'pfp_content_type', 'VARCHAR(32)')
+    add_column(schema_editor, 'wallify_users', 'pfp_updated_at', {
+        'postgresql': 'TIMESTAMP WITH TIME ZONE',
+        'sqlite': 'DATETIME',
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_search_logs_unique_term'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_avatar_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from app.schema import is_postgres
+
+
+def create_user_avatars(apps, schema_editor):
+    blob = 'BYTEA' if is_postgres(schema_editor) else 'BLOB'
+    timestamp = 'TIMESTAMP WITH TIME ZONE' if is_postgres(schema_editor) else 'DATETIME'
+    # One normalized rendition per (user, size); wallify_users.pfp keeps the largest
+    schema_editor.execute(f"""
+        CREATE TABLE IF NOT EXISTS user_avatars (
+            username VARCHAR(50) NOT NULL REFERENCES wallify_users (username) ON DELETE CASCADE,
+            size VARCHAR(10) NOT NULL,
+            data {blob} NOT NULL,
+            content_type VARCHAR(32) NOT NULL,
+            etag VARCHAR(64) NOT NULL,
+            updated_at {timestamp} NOT NULL,
+            PRIMARY KEY (username, size)
+        )
+    """)
+
+
+def drop_user_avatars(apps, schema_editor):
+    schema_editor.execute("DROP TABLE IF EXISTS user_avatars")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_avatar_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_avatars, drop_user_avatars),
+    ]
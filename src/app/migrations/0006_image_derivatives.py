@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from app.schema import add_column
+
+
+def add_derivative_columns(apps, schema_editor):
+    # Comma separated widths rendered under thumbs/<width>/, and an inline blur placeholder
+    add_column(schema_editor, 'images_table', 'thumb_widths', 'VARCHAR(64)')
+    add_column(schema_editor, 'images_table', 'placeholder', 'TEXT')
+    # Aspect ratio for width/height attributes so lazy tiles don't shift the layout
+    add_column(schema_editor, 'images_table', 'width', 'INTEGER')
+    add_column(schema_editor, 'images_table', 'height', 'INTEGER')
+    # Profile grids look rows up by key when joining favorites to their thumbnails
+    schema_editor.execute("CREATE INDEX IF NOT EXISTS images_table_image_key_idx ON images_table (image_key)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_user_avatars'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_derivative_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+from app.schema import is_postgres
+
+
+def create_generation_jobs(apps, schema_editor):
+    timestamp = 'TIMESTAMP WITH TIME ZONE' if is_postgres(schema_editor) else 'DATETIME'
+    schema_editor.execute(f"""
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            username VARCHAR(50) NOT NULL REFERENCES wallify_users (username) ON DELETE CASCADE,
+            prompt TEXT NOT NULL,
+            aspect_ratio VARCHAR(10) NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            image_url TEXT,
+            image_key VARCHAR(255),
+            error TEXT,
+            created_at {timestamp} NOT NULL,
+            started_at {timestamp},
+            finished_at {timestamp}
+        )
+    """)
+    # Workers claim the oldest queued (or stalled running) job
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS generation_jobs_status_idx ON generation_jobs (status, created_at)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS generation_jobs_username_idx ON generation_jobs (username, created_at)"
+    )
+
+
+def drop_generation_jobs(apps, schema_editor):
+    schema_editor.execute("DROP TABLE IF EXISTS generation_jobs")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_generation_jobs, drop_generation_jobs),
+    ]
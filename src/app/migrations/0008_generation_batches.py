@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from app.schema import add_column
+
+
+def add_batch_columns(apps, schema_editor):
+    # A job can produce several variations; image_count is what it holds against the daily limit
+    add_column(schema_editor, 'generation_jobs', 'image_count', 'INTEGER NOT NULL DEFAULT 1')
+    # Comma separated aspect ratio per requested image
+    add_column(schema_editor, 'generation_jobs', 'aspect_ratios', 'TEXT')
+    # JSON list with one {image_url, image_key, error} entry per image
+    add_column(schema_editor, 'generation_jobs', 'results', 'TEXT')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_generation_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_batch_columns, migrations.RunPython.noop),
+    ]
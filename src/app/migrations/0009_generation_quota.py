@@ -0,0 +1,51 @@
+from datetime import datetime, time, timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def create_generation_quota(apps, schema_editor):
+    # One counter row per user per day, bumped atomically by app.quotas
+    schema_editor.execute("""
+        CREATE TABLE IF NOT EXISTS generation_quota (
+            username VARCHAR(50) NOT NULL,
+            day DATE NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, day)
+        )
+    """)
+    # Range scans for the counting fallback and per-user history
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS ai_generations_username_created_idx ON ai_generations (username, created_at)"
+    )
+
+    # Carry today's usage over so nobody gets a fresh allowance on deploy day
+    today = timezone.localdate()
+    start = timezone.make_aware(datetime.combine(today, time.min))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO generation_quota (username, day, used)
+            SELECT username, %s, COUNT(*) FROM ai_generations
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY username
+            ON CONFLICT (username, day) DO NOTHING
+            """,
+            [today, start, start + timedelta(days=1)]
+        )
+
+
+def drop_generation_quota(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS ai_generations_username_created_idx")
+    schema_editor.execute("DROP TABLE IF EXISTS generation_quota")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_generation_batches'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_generation_quota, drop_generation_quota),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+from app.schema import is_postgres
+
+
+def create_stripe_events(apps, schema_editor):
+    timestamp = 'TIMESTAMP WITH TIME ZONE' if is_postgres(schema_editor) else 'DATETIME'
+    # Every verified webhook delivery, keyed by Stripe's event id so replays are no-ops
+    schema_editor.execute(f"""
+        CREATE TABLE IF NOT EXISTS stripe_events (
+            id VARCHAR(255) PRIMARY KEY,
+            type VARCHAR(100) NOT NULL,
+            payload TEXT NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            received_at {timestamp} NOT NULL,
+            available_at {timestamp} NOT NULL,
+            processed_at {timestamp}
+        )
+    """)
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS stripe_events_pending_idx ON stripe_events (status, available_at)"
+    )
+
+
+def drop_stripe_events(apps, schema_editor):
+    schema_editor.execute("DROP TABLE IF EXISTS stripe_events")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_generation_quota'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_stripe_events, drop_stripe_events),
+    ]
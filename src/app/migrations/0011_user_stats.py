@@ -0,0 +1,64 @@
+from django.db import migrations
+
+from app.schema import add_column, column_exists, is_postgres
+
+
+def create_user_stats(apps, schema_editor):
+    # Stable row id, newest first, for keyset paging a user's favorites
+    if is_postgres(schema_editor):
+        add_column(schema_editor, 'favorites', 'id', 'BIGSERIAL')
+        schema_editor.execute("CREATE UNIQUE INDEX IF NOT EXISTS favorites_id_idx ON favorites (id)")
+    elif not column_exists(schema_editor, 'favorites', 'id'):
+        # SQLite cannot add an auto-incrementing column, so rebuild the table keeping row order
+        schema_editor.execute("""
+            CREATE TABLE favorites_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_key TEXT NOT NULL,
+                username VARCHAR(50) NOT NULL
+            )
+        """)
+        schema_editor.execute(
+            "INSERT INTO favorites_new (image_key, username) SELECT image_key, username FROM favorites ORDER BY rowid"
+        )
+        schema_editor.execute("DROP TABLE favorites")
+        schema_editor.execute("ALTER TABLE favorites_new RENAME TO favorites")
+    schema_editor.execute("CREATE INDEX IF NOT EXISTS favorites_username_id_idx ON favorites (username, id)")
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS images_table_user_id_idx ON images_table ("user", id)')
+
+    # Per-user totals shown on the profile, kept current by app.profiles
+    schema_editor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            username VARCHAR(50) PRIMARY KEY,
+            favorites_count INTEGER NOT NULL DEFAULT 0,
+            uploads_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    schema_editor.execute("""
+        INSERT INTO user_stats (username, favorites_count, uploads_count)
+        SELECT username, SUM(favorites), SUM(uploads) FROM (
+            SELECT username, COUNT(*) AS favorites, 0 AS uploads FROM favorites GROUP BY username
+            UNION ALL
+            SELECT "user", 0, COUNT(*) FROM images_table WHERE "user" IS NOT NULL GROUP BY "user"
+        ) AS totals
+        WHERE username IS NOT NULL
+        GROUP BY username
+        ON CONFLICT (username) DO UPDATE
+        SET favorites_count = EXCLUDED.favorites_count, uploads_count = EXCLUDED.uploads_count
+    """)
+
+
+def drop_user_stats(apps, schema_editor):
+    schema_editor.execute("DROP TABLE IF EXISTS user_stats")
+    schema_editor.execute("DROP INDEX IF EXISTS images_table_user_id_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS favorites_username_id_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_stripe_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_stats, drop_user_stats),
+    ]
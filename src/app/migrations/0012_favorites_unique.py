@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def dedupe_favorites(apps, schema_editor):
+    # Keep the first save of each (username, image_key); later clicks only added duplicates
+    schema_editor.execute("""
+        DELETE FROM favorites
+        WHERE id NOT IN (SELECT MIN(id) FROM favorites GROUP BY username, image_key)
+    """)
+    schema_editor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS favorites_username_image_key_uniq ON favorites (username, image_key)"
+    )
+    # The totals counted the duplicates too
+    schema_editor.execute("""
+        UPDATE user_stats
+        SET favorites_count = (SELECT COUNT(*) FROM favorites WHERE favorites.username = user_stats.username)
+    """)
+
+
+def drop_unique(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS favorites_username_image_key_uniq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_user_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_favorites, drop_unique),
+    ]
@@ -0,0 +1,111 @@
+from django.db import migrations
+
+from app.schema import add_column, execute_each, is_postgres
+
+RECOUNT = """
+    UPDATE support_threads
+    SET message_count = (SELECT COUNT(*) FROM thread_messages m WHERE m.thread_id = support_threads.id),
+        last_activity_at = COALESCE(
+            (SELECT MAX(m.created_at) FROM thread_messages m WHERE m.thread_id = support_threads.id),
+            support_threads.created_at),
+        last_author = COALESCE(
+            (SELECT m.author_username FROM thread_messages m WHERE m.thread_id = support_threads.id
+             ORDER BY m.created_at DESC, m.id DESC LIMIT 1),
+            support_threads.author_username)
+"""
+
+# SQLite has no tsvector; FTS5 tables keyed on the row ids stand in, kept in step by triggers
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS support_threads_fts USING fts5(title)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS thread_messages_fts USING fts5(content, thread_id UNINDEXED)",
+    """
+    CREATE TRIGGER IF NOT EXISTS support_threads_fts_insert AFTER INSERT ON support_threads BEGIN
+        INSERT INTO support_threads_fts (rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS support_threads_fts_update AFTER UPDATE OF title ON support_threads BEGIN
+        UPDATE support_threads_fts SET title = new.title WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS support_threads_fts_delete AFTER DELETE ON support_threads BEGIN
+        DELETE FROM support_threads_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS thread_messages_fts_insert AFTER INSERT ON thread_messages BEGIN
+        INSERT INTO thread_messages_fts (rowid, content, thread_id) VALUES (new.id, new.content, new.thread_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS thread_messages_fts_update AFTER UPDATE OF content ON thread_messages BEGIN
+        UPDATE thread_messages_fts SET content = new.content WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS thread_messages_fts_delete AFTER DELETE ON thread_messages BEGIN
+        DELETE FROM thread_messages_fts WHERE rowid = old.id;
+    END
+    """,
+    "INSERT INTO support_threads_fts (rowid, title) SELECT id, title FROM support_threads",
+    "INSERT INTO thread_messages_fts (rowid, content, thread_id) SELECT id, content, thread_id FROM thread_messages",
+]
+
+
+def add_support_search(apps, schema_editor):
+    postgres = is_postgres(schema_editor)
+
+    # Per-thread totals for the listing, so it sorts by activity without aggregating messages
+    add_column(schema_editor, 'support_threads', 'message_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(schema_editor, 'support_threads', 'last_activity_at',
+               {'postgresql': 'TIMESTAMP WITH TIME ZONE', 'sqlite': 'DATETIME'})
+    add_column(schema_editor, 'support_threads', 'last_author', 'VARCHAR(50)')
+    schema_editor.execute(RECOUNT)
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS support_threads_activity_idx ON support_threads (last_activity_at, id)"
+    )
+
+    if not postgres:
+        execute_each(schema_editor, SQLITE_FTS)
+        return
+
+    add_column(
+        schema_editor, 'support_threads', 'search_vector',
+        "tsvector GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, ''))) STORED",
+    )
+    add_column(
+        schema_editor, 'thread_messages', 'search_vector',
+        "tsvector GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED",
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS support_threads_search_vector_idx ON support_threads USING GIN (search_vector)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS thread_messages_search_vector_idx ON thread_messages USING GIN (search_vector)"
+    )
+
+
+def remove_support_search(apps, schema_editor):
+    if is_postgres(schema_editor):
+        schema_editor.execute("DROP INDEX IF EXISTS thread_messages_search_vector_idx")
+        schema_editor.execute("DROP INDEX IF EXISTS support_threads_search_vector_idx")
+        schema_editor.execute("ALTER TABLE thread_messages DROP COLUMN IF EXISTS search_vector")
+        schema_editor.execute("ALTER TABLE support_threads DROP COLUMN IF EXISTS search_vector")
+    else:
+        for name in ('support_threads_fts', 'thread_messages_fts'):
+            for event in ('insert', 'update', 'delete'):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}_{event}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {name}")
+    schema_editor.execute("DROP INDEX IF EXISTS support_threads_activity_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_favorites_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_support_search, remove_support_search),
+    ]
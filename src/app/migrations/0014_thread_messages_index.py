@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def add_index(apps, schema_editor):
+    # Backs the thread page's (created_at, id) keyset paging and the "new since" polls
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS thread_messages_thread_created_idx "
+        "ON thread_messages (thread_id, created_at, id)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS thread_messages_thread_created_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_support_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, drop_index),
+    ]
@@ -0,0 +1,85 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+# The legacy models are unmanaged and their tables come from the raw SQL
+# migrations before this one. This records them in the migration state only, so
+# makemigrations matches models.py, including the SupportThread totals added by
+# 0013; it touches no tables.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_thread_messages_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='AIGeneration',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('username', models.CharField(max_length=50)),
+                        ('prompt', models.TextField()),
+                        ('image_url', models.URLField()),
+                        ('aspect_ratio', models.CharField(max_length=10)),
+                        ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                    ],
+                    options={
+                        'db_table': 'ai_generations',
+                        'managed': False,
+                    },
+                ),
+                migrations.CreateModel(
+                    name='SupportThread',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('title', models.CharField(max_length=200)),
+                        ('author_username', models.CharField(max_length=50)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('status', models.CharField(choices=[('open', 'Open'), ('resolved', 'Resolved'), ('closed', 'Closed')], default='open', max_length=20)),
+                        ('category', models.CharField(choices=[('technical', 'Technical Support'), ('order', 'Order Issues'), ('general', 'General Questions'), ('feedback', 'Feedback')], max_length=50)),
+                        ('message_count', models.IntegerField(default=0)),
+                        ('last_activity_at', models.DateTimeField(default=django.utils.timezone.now)),
+                        ('last_author', models.CharField(blank=True, max_length=50, null=True)),
+                    ],
+                    options={
+                        'db_table': 'support_threads',
+                        'managed': False,
+                    },
+                ),
+                migrations.CreateModel(
+                    name='ThreadMessage',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('author_username', models.CharField(max_length=50)),
+                        ('content', models.TextField()),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('is_admin_reply', models.BooleanField(default=False)),
+                    ],
+                    options={
+                        'db_table': 'thread_messages',
+                        'managed': False,
+                    },
+                ),
+                migrations.CreateModel(
+                    name='WallifyUser',
+                    fields=[
+                        ('id', models.IntegerField(help_text='Auto-incrementing ID managed by PostgreSQL sequence')),
+                        ('username', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                        ('firstname', models.CharField(max_length=50, null=True)),
+                        ('lastname', models.CharField(max_length=50, null=True)),
+                        ('email', models.CharField(max_length=100, null=True)),
+                        ('password', models.CharField(max_length=100)),
+                        ('pfp', models.BinaryField(null=True)),
+                    ],
+                    options={
+                        'db_table': 'wallify_users',
+                        'managed': False,
+                    },
+                ),
+            ],
+            database_operations=[],
+        ),
+    ]
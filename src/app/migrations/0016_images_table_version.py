@@ -0,0 +1,64 @@
+from django.db import migrations
+
+from app.schema import execute_each, is_postgres
+
+# One row whose version every write to images_table bumps, so the in-memory
+# search index can tell the table changed (including UPDATEs and a delete
+# followed by an insert, which leave COUNT(*) and MAX(id) as they were)
+CREATE_VERSION = [
+    "CREATE TABLE IF NOT EXISTS images_table_version (id INTEGER PRIMARY KEY, version BIGINT NOT NULL)",
+    "INSERT INTO images_table_version (id, version) SELECT 1, 0 "
+    "WHERE NOT EXISTS (SELECT 1 FROM images_table_version)",
+]
+
+POSTGRES_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION images_table_bump_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images_table_version SET version = version + 1 WHERE id = 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS images_table_version_bump ON images_table",
+    """
+    CREATE TRIGGER images_table_version_bump AFTER INSERT OR UPDATE OR DELETE ON images_table
+    FOR EACH STATEMENT EXECUTE FUNCTION images_table_bump_version()
+    """,
+]
+
+# SQLite triggers are per row and per event
+SQLITE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS images_table_version_{event.lower()} AFTER {event} ON images_table BEGIN
+        UPDATE images_table_version SET version = version + 1 WHERE id = 1;
+    END
+    """
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+
+def add_version(apps, schema_editor):
+    execute_each(schema_editor, CREATE_VERSION)
+    execute_each(schema_editor, POSTGRES_TRIGGERS if is_postgres(schema_editor) else SQLITE_TRIGGERS)
+
+
+def remove_version(apps, schema_editor):
+    if is_postgres(schema_editor):
+        schema_editor.execute("DROP TRIGGER IF EXISTS images_table_version_bump ON images_table")
+        schema_editor.execute("DROP FUNCTION IF EXISTS images_table_bump_version()")
+    else:
+        for event in ('insert', 'update', 'delete'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS images_table_version_{event}")
+    schema_editor.execute("DROP TABLE IF EXISTS images_table_version")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_model_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_version, remove_version),
+    ]
@@ -49,6 +49,10 @@ class SupportThread(models.Model):
         ('general', 'General Questions'),
         ('feedback', 'Feedback')
     ])
+    # Denormalized from thread_messages by app.support
+    message_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    last_author = models.CharField(max_length=50, null=True, blank=True)
 
     class Meta:
         db_table = 'support_threads'
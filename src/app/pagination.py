@@ -0,0 +1,41 @@
+"""
+Opaque cursors for keyset ("seek") pagination.
+
+A cursor is the sort key of the last row a client has seen, packed into a
+URL-safe token. The next page is fetched with `WHERE (key) < (cursor)` so
+every page costs the same however deep the client has scrolled.
+"""
+import base64
+import binascii
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(token, length):
+    """Decode a cursor produced by encode_cursor; `None`/empty means first page."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Malformed cursor')
+    return tuple(values)
+
+
+def parse_limit(value, default, maximum):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
@@ -0,0 +1,9 @@
+"""
+PostgreSQL backend that borrows connections from an in-process pool.
+
+Select it with ENGINE 'app.postgres_pool' (settings.py does when DB_POOL is
+on) and keep CONN_MAX_AGE at 0: Django then "closes" its connection at the end
+of every request and background-loop iteration, which hands it back to the
+pool instead of tearing it down. Pool sizes and timeouts come from the
+database's POOL settings, see ConnectionPool.
+"""
@@ -0,0 +1,89 @@
+import os
+import threading
+from functools import partial
+
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from app import metrics
+
+from .pool import ConnectionPool
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options=None, connect=None):
+    """The alias's pool in this process, created on first use (pass options and connect)."""
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections opened before a fork belong to the parent
+            _pools, _pools_pid = {}, os.getpid()
+        pool = _pools.get(alias)
+        if pool is None and connect is not None:
+            pool = _pools[alias] = ConnectionPool(connect, **(options or {}))
+    return pool
+
+
+def pool_stats():
+    """Gauges for every pool open in this process, keyed by database alias."""
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+POOL_GAUGES = {
+    'size': 'Open connections.',
+    'in_use': 'Connections checked out.',
+    'idle': 'Connections waiting in the pool.',
+    'waiting': 'Threads waiting for a connection.',
+    'wait_avg_ms': 'Average time to acquire a connection, in milliseconds.',
+    'wait_max_ms': 'Longest time to acquire a connection, in milliseconds.',
+}
+POOL_COUNTERS = {
+    'acquired': 'Connections handed out.',
+    'opened': 'Connections opened.',
+    'closed': 'Connections closed as broken, too old or idle too long.',
+    'timeouts': 'Acquires that gave up waiting for a connection.',
+    'failed_checks': 'Idle connections that failed their health check.',
+}
+
+
+@metrics.register_collector
+def _pool_metrics():
+    stats = pool_stats()
+    families = [
+        (f'wallify_db_pool_{name}', 'gauge', help, [({'alias': alias}, s[name]) for alias, s in stats.items()])
+        for name, help in POOL_GAUGES.items()
+    ]
+    families += [
+        (f'wallify_db_pool_{name}_total', 'counter', help,
+         [({'alias': alias}, s[name]) for alias, s in stats.items()])
+        for name, help in POOL_COUNTERS.items()
+    ]
+    return families
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict.get('POOL'),
+                        partial(super().get_new_connection, conn_params))
+        if pool.min_size:
+            pool.fill()
+        connection = pool.acquire()
+        # The parent sets this while connecting, which pooled connections skip
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = (IsolationLevel(isolation_level) if isolation_level is not None
+                                else IsolationLevel.READ_COMMITTED)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            pool = get_pool(self.alias)
+            with self.wrap_database_errors:
+                if pool is None:
+                    return self.connection.close()
+                pool.release(self.connection)
@@ -0,0 +1,231 @@
+"""
+A thread-safe pool of open database connections, one per process and alias.
+
+Connections are handed out LIFO so a few hot connections serve most requests
+and the rest age out. `acquire` waits up to `timeout` seconds for a free
+connection once `max_size` are open and then raises PoolTimeout. A connection
+that has been idle longer than `check_after` is pinged before it is handed
+out; connections older than `max_lifetime`, idle longer than `max_idle` (above
+`min_size`) or returned broken are closed and replaced on demand.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from psycopg2 import OperationalError, extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+# Handed to a waiter instead of a connection: open a new one in the freed slot
+OPEN = object()
+
+
+class _Waiter:
+    __slots__ = ('item',)
+
+    def __init__(self):
+        self.item = None
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10.0,
+                 max_lifetime=1800.0, max_idle=300.0, check_after=30.0):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, opened_at, returned_at); right end is the most recent
+        self._opened = {}     # id(connection) -> opened_at, for connections checked out
+        self._size = 0
+        self._waiters = deque()
+        self._counters = dict(acquired=0, opened=0, closed=0, timeouts=0, failed_checks=0)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def fill(self):
+        """Open connections up to min_size."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                self._discard(None)
+                raise
+            now = time.monotonic()
+            with self._cond:
+                if self._waiters:
+                    self._handoff((conn, now, now))
+                else:
+                    self._idle.append((conn, now, now))
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            with self._cond:
+                if self._idle and not self._waiters:
+                    item = self._idle.pop()
+                elif self._size < self.max_size and not self._waiters:
+                    self._size += 1
+                    item = OPEN
+                else:
+                    item = self._wait(deadline)
+
+            if item is OPEN:
+                try:
+                    conn = self._open()
+                except Exception:
+                    self._discard(None)
+                    raise
+                opened_at = time.monotonic()
+            else:
+                conn, opened_at, returned_at = item
+                if not self._healthy(conn, opened_at, returned_at):
+                    self._discard(conn)
+                    continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._opened[id(conn)] = opened_at
+                self._counters['acquired'] += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return conn
+
+    def _wait(self, deadline):
+        # Called holding the lock. Waiters are served in arrival order:
+        # release() and _discard() hand their slot straight to the oldest one.
+        waiter = _Waiter()
+        self._waiters.append(waiter)
+        while waiter.item is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._waiters.remove(waiter)
+                self._counters['timeouts'] += 1
+                raise PoolTimeout(
+                    f"No database connection available within {self.timeout}s "
+                    f"({self._size} open, all in use)"
+                )
+            self._cond.wait(remaining)
+        return waiter.item
+
+    def release(self, conn):
+        with self._cond:
+            opened_at = self._opened.pop(id(conn), None)
+        if opened_at is None:
+            # Not ours (e.g. handed out before a fork); just close it
+            _close_quietly(conn)
+            return
+        now = time.monotonic()
+        if conn.closed or now - opened_at > self.max_lifetime or not _reset(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._waiters:
+                self._handoff((conn, opened_at, now))
+                return
+            self._idle.append((conn, opened_at, now))
+            expired = self._expire_idle(now)
+        for old in expired:
+            self._discard(old)
+
+    def _handoff(self, item):
+        self._waiters.popleft().item = item
+        self._cond.notify_all()
+
+    def _expire_idle(self, now):
+        # Longest-idle connections sit at the left end; keep min_size of them open
+        expired = []
+        while (self._idle and self._size - len(expired) > self.min_size
+               and now - self._idle[0][2] > self.max_idle):
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def _healthy(self, conn, opened_at, returned_at):
+        now = time.monotonic()
+        if conn.closed or now - opened_at > self.max_lifetime:
+            return False
+        if now - returned_at <= self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._counters['failed_checks'] += 1
+            logger.info("Discarding database connection that failed its health check")
+            return False
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._counters['opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        if conn is not None:
+            _close_quietly(conn)
+        with self._cond:
+            if conn is not None:
+                self._counters['closed'] += 1
+            if self._waiters:
+                # The slot is free again: let the oldest waiter open a replacement
+                self._handoff(OPEN)
+            else:
+                self._size -= 1
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            acquired = self._counters['acquired']
+            return dict(
+                self._counters,
+                size=self._size,
+                in_use=self._size - len(self._idle),
+                idle=len(self._idle),
+                waiting=len(self._waiters),
+                min_size=self.min_size,
+                max_size=self.max_size,
+                wait_avg_ms=self._wait_total / acquired * 1000 if acquired else 0.0,
+                wait_max_ms=self._wait_max * 1000,
+            )
+
+
+def _reset(conn):
+    # Roll back anything left open so the next user starts clean
+    try:
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
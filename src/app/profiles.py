@@ -0,0 +1,100 @@
+"""
+Profile page data.
+
+`profile_header` is the one query the page itself needs: the user's row
+without the pfp blob, plus their totals from user_stats. The favorites and
+uploads grids are fetched a page at a time by the profile JSON endpoints,
+newest first, keyset-paged on the row id.
+
+user_stats holds per-user totals so nothing counts rows on a page view.
+Every write that adds or removes a favorite or an upload calls
+`adjust_counts` in the same transaction.
+"""
+from collections import namedtuple
+
+from django.db import connection
+
+from . import catalog
+
+ProfileHeader = namedtuple('ProfileHeader', 'user_id firstname lastname email username has_pfp '
+                                            'favorites_count uploads_count')
+Page = namedtuple('Page', 'images next_after')
+
+
+def profile_header(username):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT u.id, u.firstname, u.lastname, u.email, u.username, u.pfp IS NOT NULL,
+                   COALESCE(s.favorites_count, 0), COALESCE(s.uploads_count, 0)
+            FROM wallify_users u
+            LEFT JOIN user_stats s ON s.username = u.username
+            WHERE u.username = %s
+            """,
+            [username]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return ProfileHeader(*row[:5], bool(row[5]), *row[6:])
+
+
+def adjust_counts(username, favorites=0, uploads=0):
+    """Add the given deltas to a user's totals (negative to subtract)."""
+    if not username or not (favorites or uploads):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO user_stats (username, favorites_count, uploads_count) VALUES (%s, %s, %s)
+            ON CONFLICT (username) DO UPDATE
+            SET favorites_count = CASE WHEN user_stats.favorites_count + EXCLUDED.favorites_count > 0
+                                       THEN user_stats.favorites_count + EXCLUDED.favorites_count ELSE 0 END,
+                uploads_count = CASE WHEN user_stats.uploads_count + EXCLUDED.uploads_count > 0
+                                     THEN user_stats.uploads_count + EXCLUDED.uploads_count ELSE 0 END
+            """,
+            [username, favorites, uploads]
+        )
+
+
+def _page(sql, params, limit):
+    # One extra row tells us whether there is a next page
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit + 1])
+        rows = cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    images = [catalog.image_entry(row[1], None, *row[2:]) for row in rows]
+    return Page(images, (rows[-1][0],) if more else None)
+
+
+def favorites_page(username, limit, after=None):
+    seek = "AND f.id < %s" if after else ""
+    return _page(
+        f"""
+        SELECT f.id, f.image_key, i.thumb_widths, i.placeholder, i.width, i.height
+        FROM favorites f
+        LEFT JOIN images_table i
+            ON i.id = (SELECT MAX(id) FROM images_table WHERE image_key = f.image_key)
+        WHERE f.username = %s {seek}
+        ORDER BY f.id DESC
+        LIMIT %s
+        """,
+        [username, *(after or ())],
+        limit
+    )
+
+
+def uploads_page(username, limit, after=None):
+    seek = "AND id < %s" if after else ""
+    return _page(
+        f"""
+        SELECT id, image_key, thumb_widths, placeholder, width, height
+        FROM images_table
+        WHERE "user" = %s {seek}
+        ORDER BY id DESC
+        LIMIT %s
+        """,
+        [username, *(after or ())],
+        limit
+    )
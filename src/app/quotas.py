@@ -0,0 +1,146 @@
+"""
+Per-user daily generation quotas.
+
+The default 'counter' backend keeps one generation_quota row per user per
+day. `reserve` is a single upsert that only increments when the result stays
+within the plan's limit, so two concurrent requests cannot both slip under
+it, and a refused request changes nothing. Images that end up not being
+delivered are handed back with `release`.
+
+The 'count' backend is the plain-table fallback. It counts today's
+ai_generations rows with a sargable created_at range on
+(username, created_at), plus images still queued or running. It serializes
+a user's reservations by locking their wallify_users row, so call it inside
+the transaction that enqueues the job.
+
+Limits per plan come from GENERATION_DAILY_LIMITS; None means unlimited.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+FREE, PREMIUM = 'free', 'premium'
+
+
+def plan_for(is_premium):
+    return PREMIUM if is_premium else FREE
+
+
+def daily_limit(plan):
+    return settings.GENERATION_DAILY_LIMITS.get(plan)
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+class CounterQuota:
+
+    def reserve(self, username, limit, n, day):
+        with connection.cursor() as cursor:
+            if limit is None:
+                # Unlimited plans are still counted, for usage reporting
+                cursor.execute(
+                    """
+                    INSERT INTO generation_quota (username, day, used) VALUES (%s, %s, %s)
+                    ON CONFLICT (username, day) DO UPDATE SET used = generation_quota.used + EXCLUDED.used
+                    """,
+                    [username, day, n]
+                )
+                return True
+            cursor.execute(
+                """
+                INSERT INTO generation_quota (username, day, used) VALUES (%s, %s, %s)
+                ON CONFLICT (username, day) DO UPDATE SET used = generation_quota.used + EXCLUDED.used
+                WHERE generation_quota.used + EXCLUDED.used <= %s
+                RETURNING used
+                """,
+                [username, day, n, limit]
+            )
+            return cursor.fetchone() is not None
+
+    def release(self, username, n, day):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE generation_quota SET used = CASE WHEN used > %s THEN used - %s ELSE 0 END
+                WHERE username = %s AND day = %s
+                """,
+                [n, n, username, day]
+            )
+
+    def used(self, username, day):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT used FROM generation_quota WHERE username = %s AND day = %s",
+                           [username, day])
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+
+class CountQuota:
+
+    def reserve(self, username, limit, n, day):
+        if limit is None:
+            return True
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM wallify_users WHERE username = %s FOR UPDATE", [username])
+        return self.used(username, day) + n <= limit
+
+    def release(self, username, n, day):
+        # Failed jobs simply stop being counted
+        pass
+
+    def used(self, username, day):
+        start, end = _day_bounds(day)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM ai_generations WHERE username = %s AND created_at >= %s AND created_at < %s",
+                [username, start, end]
+            )
+            generated = cursor.fetchone()[0]
+            cursor.execute(
+                """
+                SELECT COALESCE(SUM(image_count), 0) FROM generation_jobs
+                WHERE username = %s AND status IN ('queued', 'running')
+                """,
+                [username]
+            )
+            pending = cursor.fetchone()[0]
+        return generated + pending
+
+
+BACKENDS = {
+    'counter': CounterQuota,
+    'count': CountQuota,
+}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[settings.GENERATION_QUOTA_BACKEND]()
+    return _backend
+
+
+def reserve(username, plan, n=1, day=None):
+    """Take n generations from today's allowance. Returns False, changing nothing, if that exceeds it."""
+    limit = daily_limit(plan)
+    if limit is not None and n > limit:
+        return False
+    return get_backend().reserve(username, limit, n, day or timezone.localdate())
+
+
+def release(username, n, day=None):
+    """Give back n reserved generations that were not delivered."""
+    if n > 0:
+        get_backend().release(username, n, day or timezone.localdate())
+
+
+def used_today(username):
+    return get_backend().used(username, timezone.localdate())
@@ -0,0 +1,55 @@
+"""
+Helpers for the hand-written schema migrations.
+
+The core tables (wallify_users, images_table, ...) predate Django migrations and
+are declared ``managed = False``, so every change to them goes through raw SQL.
+Production runs on PostgreSQL; local/test setups run on SQLite, which lacks
+``ADD COLUMN IF NOT EXISTS`` and friends, so these helpers paper over that.
+"""
+
+
+def is_postgres(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def table_exists(schema_editor, table):
+    with schema_editor.connection.cursor() as cursor:
+        return table in schema_editor.connection.introspection.table_names(cursor)
+
+
+def column_exists(schema_editor, table, column):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        description = connection.introspection.get_table_description(cursor, table)
+    return any(col.name == column for col in description)
+
+
+def add_column(schema_editor, table, column, definition):
+    # `definition` is either a string or a {'postgresql': ..., 'sqlite': ...} dict
+    if isinstance(definition, dict):
+        definition = definition.get(schema_editor.connection.vendor, definition.get('default'))
+    if definition is None or column_exists(schema_editor, table, column):
+        return
+    quoted_table = schema_editor.quote_name(table)
+    quoted_column = schema_editor.quote_name(column)
+    schema_editor.execute(f"ALTER TABLE {quoted_table} ADD COLUMN {quoted_column} {definition}")
+
+
+def execute_each(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def try_execute(schema_editor, statement):
+    """Run an optional statement (e.g. CREATE EXTENSION) without aborting the migration."""
+    if not is_postgres(schema_editor):
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SAVEPOINT optional_ddl")
+        try:
+            cursor.execute(statement)
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT optional_ddl")
+            return False
+        cursor.execute("RELEASE SAVEPOINT optional_ddl")
+    return True
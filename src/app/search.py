@@ -0,0 +1,343 @@
+"""
+Gallery search over images_table.description.
+
+Two interchangeable backends sit behind `get_backend()`:
+
+* PostgresSearchBackend uses the generated `search_vector` tsvector column and
+  its GIN index (see migration 0002), ranked with ts_rank_cd. When full-text
+  finds nothing it falls back to pg_trgm similarity so typos still return hits.
+* MemorySearchBackend keeps an in-process inverted index with BM25 scoring. It
+  serves SQLite/test setups and is rebuilt when the table changes underneath it,
+  which the images_table_version row (bumped by triggers, migration 0016) shows.
+
+Both treat every query word as a required prefix match ("wall" matches
+"wallpapers"), which mirrors the old per-keyword ILIKE filter, but return
+results ordered by relevance instead of heap order. Results come back in
+pages keyed on (score, id) so the gallery can seek rather than offset.
+"""
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+SearchHit = namedtuple('SearchHit', [
+    'id', 'image_key', 'username', 'thumb_widths', 'placeholder', 'width', 'height', 'score',
+])
+SearchPage = namedtuple('SearchPage', ['hits', 'next_after'])
+
+SEARCH_MODES = ('recent', 'fts', 'trgm', 'bm25')
+
+HIT_COLUMNS = 'id, image_key, "user", thumb_widths, placeholder, width, height'
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def make_page(rows, limit, mode):
+    """Trim the look-ahead row and derive the (score, id, mode) key for the next page."""
+    hits = [SearchHit(*row) for row in rows]
+    if not limit or len(hits) <= limit:
+        return SearchPage(hits, None)
+    hits = hits[:limit]
+    return SearchPage(hits, (hits[-1].score, hits[-1].id, mode))
+
+
+class InvertedIndex:
+    """Thread-safe in-memory inverted index with BM25 ranking and prefix matching."""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self._doc_terms = {}  # doc_id -> terms, so documents can be removed
+        self._lengths = {}  # doc_id -> token count
+        self._total_length = 0
+        self._sorted_terms = []
+        self._terms_dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._lengths
+
+    def add(self, doc_id, text):
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        with self._lock:
+            if doc_id in self._lengths:
+                self.remove(doc_id)
+            for term, tf in counts.items():
+                if term not in self._postings:
+                    self._terms_dirty = True
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = tuple(counts)
+            self._lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+
+    def remove(self, doc_id):
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+                    self._terms_dirty = True
+            self._total_length -= self._lengths.pop(doc_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._lengths.clear()
+            self._total_length = 0
+            self._sorted_terms = []
+            self._terms_dirty = False
+
+    def _expand(self, token):
+        # All indexed terms that start with `token`
+        if self._terms_dirty:
+            self._sorted_terms = sorted(self._postings)
+            self._terms_dirty = False
+        terms = self._sorted_terms
+        i = bisect_left(terms, token)
+        while i < len(terms) and terms[i].startswith(token):
+            yield terms[i]
+            i += 1
+
+    def search(self, query):
+        """Return [(doc_id, score)] for documents matching every query token, best first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            n = len(self._lengths)
+            if not n:
+                return []
+            avg_length = self._total_length / n or 1.0
+            scores = None
+            for token in dict.fromkeys(tokens):
+                token_scores = {}
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    df = len(postings)
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                    for doc_id, tf in postings.items():
+                        norm = 1 - self.b + self.b * self._lengths[doc_id] / avg_length
+                        score = idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+                        # A prefix can hit several terms in one document; count the best one
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + s for doc_id, s in token_scores.items() if doc_id in scores}
+                if not scores:
+                    return []
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+
+class PostgresSearchBackend:
+    name = 'postgres'
+
+    def __init__(self):
+        self._has_trigram = None
+
+    @staticmethod
+    def build_tsquery(query):
+        return ' & '.join(f"'{token}':*" for token in dict.fromkeys(tokenize(query)))
+
+    def _trigram_available(self):
+        if self._has_trigram is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                self._has_trigram = cursor.fetchone() is not None
+        return self._has_trigram
+
+    def search(self, query, limit=None, after=None):
+        tsquery = self.build_tsquery(query)
+        # The cursor remembers which strategy produced page one so later pages stay consistent
+        mode = after[2] if after else ('fts' if tsquery else 'recent')
+        seek = after[:2] if after else None
+
+        with connection.cursor() as cursor:
+            if mode == 'recent':
+                sql = f"SELECT {HIT_COLUMNS}, 0.0::float8 AS score FROM images_table"
+                params = []
+                if seek:
+                    sql += " WHERE id < %s"
+                    params.append(seek[1])
+                cursor.execute(sql + " ORDER BY id DESC" + self._limit_sql(limit), params + self._limit_params(limit))
+                return make_page(cursor.fetchall(), limit, mode)
+
+            cursor.execute(*self._ranked_sql(mode, query, tsquery, seek, limit))
+            page = make_page(cursor.fetchall(), limit, mode)
+            if page.hits or after or mode != 'fts' or not self._trigram_available():
+                return page
+
+            # Nothing matched the full-text query; retry page one with trigram similarity
+            cursor.execute(*self._ranked_sql('trgm', query, tsquery, None, limit))
+            return make_page(cursor.fetchall(), limit, 'trgm')
+
+    def _ranked_sql(self, mode, query, tsquery, seek, limit):
+        if mode == 'fts':
+            # Normalization flag 1 divides by 1 + log(document length), BM25's length term
+            ranked = f"""
+                SELECT {HIT_COLUMNS}, ts_rank_cd(search_vector, q, 1)::float8 AS score
+                FROM images_table, to_tsquery('english', %s) q
+                WHERE search_vector @@ q
+            """
+            params = [tsquery]
+        else:
+            ranked = f"""
+                SELECT {HIT_COLUMNS}, similarity(description, %s)::float8 AS score
+                FROM images_table
+                WHERE description %% %s
+            """
+            params = [query, query]
+
+        sql = f"SELECT {HIT_COLUMNS}, score FROM (" + ranked + ") ranked"
+        if seek:
+            sql += " WHERE score < %s OR (score = %s AND id < %s)"
+            params = params + [seek[0], seek[0], seek[1]]
+        sql += " ORDER BY score DESC, id DESC" + self._limit_sql(limit)
+        return sql, params + self._limit_params(limit)
+
+    @staticmethod
+    def _limit_sql(limit):
+        return " LIMIT %s" if limit else ""
+
+    @staticmethod
+    def _limit_params(limit):
+        # One extra row tells make_page whether another page exists
+        return [limit + 1] if limit else []
+
+    def index_image(self, image_id, image_key, description, username, *extra):
+        # search_vector is a generated column; PostgreSQL keeps it current
+        pass
+
+
+class MemorySearchBackend:
+    name = 'memory'
+
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self._index = InvertedIndex()
+        self._docs = {}  # id -> (image_key, username, thumb_widths, placeholder, width, height)
+        self._signature = None
+        self._checked_at = 0.0
+        # _lock guards swapping and updating _index/_docs; _refresh_lock keeps
+        # rebuilds (a full table read) to one at a time without blocking searches
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _table_signature(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version FROM images_table_version WHERE id = 1")
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def _stale(self):
+        return self._signature is None or time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def _ensure_fresh(self):
+        # Other workers write rows too; re-read the table when its version moves
+        if not self._stale():
+            return
+        with self._refresh_lock:
+            if not self._stale():
+                return
+            signature = self._table_signature()
+            self._checked_at = time.monotonic()
+            if signature != self._signature:
+                self.rebuild(signature)
+
+    def rebuild(self, signature=None):
+        # Searches keep using the old index and docs until the new ones are swapped in
+        index, docs = InvertedIndex(), {}
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {HIT_COLUMNS}, description FROM images_table")
+            for image_id, *doc, description in cursor.fetchall():
+                docs[image_id] = tuple(doc)
+                index.add(image_id, description)
+        with self._lock:
+            self._index, self._docs = index, docs
+            if signature is not None:
+                self._signature = signature
+
+    def search(self, query, limit=None, after=None):
+        self._ensure_fresh()
+        recent = not tokenize(query)
+        with self._lock:
+            # A matching pair, even if a rebuild swaps in new ones meanwhile
+            index, docs = self._index, self._docs
+            # index_image adds to docs in place, so list the ids while it can't
+            recent_ids = sorted(docs, reverse=True) if recent else None
+        if recent:
+            mode = 'recent'
+            ranked = [(image_id, 0.0) for image_id in recent_ids]
+        else:
+            mode = 'bm25'
+            ranked = index.search(query)
+        if after:
+            score, last_id = after[:2]
+            ranked = [(i, s) for i, s in ranked if s < score or (s == score and i < last_id)]
+        if limit:
+            ranked = ranked[:limit + 1]
+        # index_image records the doc before indexing it, so every ranked id has one
+        hits = [(image_id, *docs[image_id], score) for image_id, score in ranked]
+        return make_page(hits, limit, mode)
+
+    def index_image(self, image_id, image_key, description, username, *extra):
+        with self._lock:
+            self._docs[image_id] = (image_key, username, *extra)
+            self._index.add(image_id, description)
+
+
+BACKENDS = {
+    'postgres': PostgresSearchBackend,
+    'memory': MemorySearchBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'SEARCH_BACKEND', None)
+                if not name:
+                    name = 'postgres' if connection.vendor == 'postgresql' else 'memory'
+                _backend = BACKENDS[name]()
+    return _backend
+
+
+def search_images(query, limit=None, after=None):
+    """Return a SearchPage; pass its `next_after` back as `after` for the following page."""
+    if after is not None and (after[2] not in SEARCH_MODES
+                              or not all(isinstance(v, (int, float)) for v in after[:2])):
+        raise ValueError('Invalid search cursor')
+    return get_backend().search(query, limit=limit, after=after)
+
+
+def index_image(image_id, image_key, description, username,
+                thumb_widths=None, placeholder=None, width=None, height=None):
+    # Only once the row is committed; a rolled-back insert must not show up in search
+    backend = get_backend()
+    transaction.on_commit(lambda: backend.index_image(image_id, image_key, description, username,
+                                                      thumb_widths, placeholder, width, height))
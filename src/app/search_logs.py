@@ -0,0 +1,118 @@
+"""
+Write-behind counting for search_logs.
+
+Gallery requests only bump an in-memory Counter. A per-process daemon thread
+drains it every SEARCH_LOG_FLUSH_INTERVAL seconds (or sooner once
+SEARCH_LOG_FLUSH_THRESHOLD searches are pending) with one batched upsert, so
+concurrent workers add their counts atomically instead of overwriting each
+other. Whatever is still pending when the process exits is flushed by atexit.
+Persisted batches are also fed to the trending sketches.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from . import trending
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = """
+    INSERT INTO search_logs (search_term, search_count)
+    VALUES (%s, %s)
+    ON CONFLICT (search_term)
+    DO UPDATE SET search_count = search_logs.search_count + EXCLUDED.search_count
+"""
+
+
+class SearchLogBuffer:
+
+    def __init__(self, flush_interval=5.0, flush_threshold=500):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._counts = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback(batch)` with each {term: count} batch after it is persisted."""
+        self._listeners.append(callback)
+
+    def record(self, term, n=1):
+        if not term:
+            return
+        with self._lock:
+            self._counts[term] += n
+            self._pending += n
+            pending = self._pending
+        self._ensure_started()
+        if pending >= self.flush_threshold:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def flush(self):
+        """Write pending counts to search_logs. Returns the number of terms written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._counts = self._counts, Counter()
+                self._pending = 0
+            if not batch:
+                return 0
+            try:
+                with connection.cursor() as cursor:
+                    cursor.executemany(UPSERT_SQL, list(batch.items()))
+            except Exception:
+                # Keep the counts for the next attempt rather than dropping them
+                with self._lock:
+                    self._counts.update(batch)
+                    self._pending += sum(batch.values())
+                logger.exception("Failed to flush %d search log terms", len(batch))
+                return 0
+            for callback in self._listeners:
+                try:
+                    callback(batch)
+                except Exception:
+                    logger.exception("Search log listener %r failed", callback)
+            return len(batch)
+
+    def _ensure_started(self):
+        # Started lazily so each forked gunicorn worker gets its own flusher
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='search-log-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            close_old_connections()
+            self.flush()
+
+
+buffer = SearchLogBuffer(
+    flush_interval=settings.SEARCH_LOG_FLUSH_INTERVAL,
+    flush_threshold=settings.SEARCH_LOG_FLUSH_THRESHOLD,
+)
+buffer.add_listener(trending.merge_batch)
+atexit.register(buffer.flush)
+
+
+def record_search(term):
+    buffer.record(term)
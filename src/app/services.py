@@ -0,0 +1,155 @@
+"""
+Process-wide clients for external services.
+
+boto3, replicate and stripe are slow to import and their clients hold
+connection pools, so each is imported and built once per process, on first
+use, and shared by every request thread. Credentials come from settings,
+which has already loaded .env. `timings` records what each client cost to
+set up; `manage.py service_startup` reports it.
+
+The async views and the async generation worker use their own clients for
+Stripe and Replicate (`get_stripe_async`, `get_replicate_async`). Their
+connections belong to the event loop that opened them, so one is kept per
+loop: a single loop per ASGI worker, but a short-lived one per request when
+Django runs an async view under WSGI.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+
+# name -> seconds spent importing and constructing the client
+timings = {}
+
+# event loop -> {name: client}
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = factory()
+                timings[name] = time.perf_counter() - started
+                logger.info("Initialized %s client in %.1f ms", name, timings[name] * 1000)
+                _clients[name] = client
+    return client
+
+
+def _get_async(name, factory):
+    # A client installed in _clients under this name (see app.fakes) is shared by every loop
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    loop = asyncio.get_running_loop()
+    clients = _loop_clients.get(loop)
+    if clients is None:
+        clients = _loop_clients[loop] = {}
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = factory()
+    return client
+
+
+def _make_s3():
+    import boto3
+    from botocore.config import Config
+
+    # Low-level clients are thread-safe; sessions are not, so build from a private one
+    session = boto3.session.Session(
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_S3_REGION_NAME,
+    )
+    return session.client('s3', endpoint_url=settings.AWS_S3_ENDPOINT_URL, config=Config(
+        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+    ))
+
+
+def _make_replicate():
+    import replicate
+
+    # The client keeps one pooled httpx connection to the Replicate API
+    return replicate.Client(api_token=settings.REPLICATE_API_TOKEN)
+
+
+def _make_stripe():
+    import stripe
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.default_http_client = stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT)
+    return stripe
+
+
+def _make_stripe_async():
+    import stripe
+
+    return stripe.StripeClient(settings.STRIPE_SECRET_KEY,
+                               http_client=stripe.HTTPXClient(timeout=settings.STRIPE_TIMEOUT))
+
+
+def _make_http():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # Downloads of generated images; reuses TLS connections to the same CDN host
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.HTTP_POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+FACTORIES = {
+    's3': _make_s3,
+    'replicate': _make_replicate,
+    'stripe': _make_stripe,
+    'http': _make_http,
+}
+
+
+def get_s3():
+    return _get('s3', _make_s3)
+
+
+def get_replicate():
+    return _get('replicate', _make_replicate)
+
+
+def get_stripe():
+    """The configured `stripe` module (its API is module-level)."""
+    return _get('stripe', _make_stripe)
+
+
+def get_http():
+    return _get('http', _make_http)
+
+
+def get_stripe_async():
+    """A StripeClient for the running event loop; use its *_async methods."""
+    return _get_async('stripe_async', _make_stripe_async)
+
+
+def get_replicate_async():
+    """A Replicate client for the running event loop; use its async_* methods."""
+    return _get_async('replicate_async', _make_replicate)
+
+
+def warm_up(names=None):
+    """Build the given clients (default: all) now rather than on first request."""
+    for name in names or FACTORIES:
+        _get(name, FACTORIES[name])
+    return dict(timings)
+
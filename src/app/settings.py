@@ -32,9 +32,25 @@ DATABASES = {
     }
 }
 
-CONN_MAX_AGE = os.getenv('CONN_MAX_AGE', default=30)
+CONN_MAX_AGE = int(os.getenv('CONN_MAX_AGE', default=30))
 DATABASE_URL = os.getenv('DATABASE_URL', default=None)
 
+# PostgreSQL connections come from an in-process pool (app/postgres_pool) unless
+# DB_POOL=0. Django hands its connection back after every request, so
+# CONN_MAX_AGE does not apply; each process opens at most DB_POOL_MAX_SIZE.
+DB_POOL = os.getenv('DB_POOL', '1').lower() in ('1', 'true', 'yes')
+DB_POOL_OPTIONS = {
+    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+    # Seconds a request waits for a free connection before failing
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    # Recycle connections after this long, and idle ones above min_size
+    'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+    'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+    # Ping connections that have sat idle longer than this before reuse
+    'check_after': 30.0,
+}
+
 if DATABASE_URL is not None:
     import dj_database_url
     DATABASES = {
@@ -44,12 +60,188 @@ if DATABASE_URL is not None:
             conn_health_checks=True,
         )
     }
+    if DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+        DATABASES['default'].update(
+            ENGINE='app.postgres_pool',
+            CONN_MAX_AGE=0,
+            CONN_HEALTH_CHECKS=False,
+            POOL=DB_POOL_OPTIONS,
+        )
 
 # AWS config
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
+# Point at a local S3 stand-in (MinIO, moto server) for development
+AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL')
+# Connections the shared S3 client keeps open (see app/services.py)
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 20))
+
+# Uploads larger than one part go to S3 as multipart uploads (app/uploads.py);
+# peak memory per upload is roughly (concurrency + 1) parts
+S3_MULTIPART_PART_SIZE = int(os.getenv('S3_MULTIPART_PART_SIZE', 8 * 1024 * 1024))
+S3_MULTIPART_CONCURRENCY = int(os.getenv('S3_MULTIPART_CONCURRENCY', 4))
+# Request bodies above this are spooled to a temp file rather than held in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024
+
+# Replicate image generation
+REPLICATE_API_TOKEN = os.getenv('REPLICATE_API_TOKEN')
+
+# Daily AI generations per plan (None: unlimited), enforced by app/quotas.py.
+# 'counter' keeps an atomic per-user, per-day counter; 'count' counts
+# ai_generations rows instead (fallback, no extra table writes).
+GENERATION_DAILY_LIMITS = {
+    'free': 3,
+    'premium': None,
+}
+GENERATION_QUOTA_BACKEND = os.getenv('GENERATION_QUOTA_BACKEND', 'counter')
+
+# AI generation job queue (app/jobs.py). GENERATION_BACKEND is 'replicate' or
+# 'stub' (local placeholder images, no API calls). Each web process runs
+# GENERATION_WORKERS job threads; set it to 0 and run `manage.py generation_worker`
+# to keep generation out of the web workers.
+GENERATION_BACKEND = os.getenv('GENERATION_BACKEND', 'replicate')
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 2))
+GENERATION_POLL_INTERVAL = 1.0
+# A running job whose runner hasn't checked in for this long is assumed lost and
+# retried, up to GENERATION_MAX_ATTEMPTS; live runners check in every HEARTBEAT_INTERVAL
+GENERATION_JOB_TIMEOUT = 300
+GENERATION_HEARTBEAT_INTERVAL = 30
+GENERATION_MAX_ATTEMPTS = 2
+GENERATION_STUB_DELAY = float(os.getenv('GENERATION_STUB_DELAY', 0))
+# Premium users may request up to GENERATION_MAX_BATCH variations per submission;
+# a job runs at most GENERATION_BATCH_CONCURRENCY of them at once
+GENERATION_MAX_BATCH = 4
+GENERATION_BATCH_CONCURRENCY = 4
+# Reuse a recent, already mirrored output for an identical (model, prompt,
+# aspect ratio) request instead of paying for another model call. Off by default:
+# users asking twice may expect a fresh image. Per process, LRU with a TTL.
+GENERATION_RESULT_CACHE = os.getenv('GENERATION_RESULT_CACHE', '').lower() in ('1', 'true', 'yes')
+GENERATION_RESULT_CACHE_TTL = int(os.getenv('GENERATION_RESULT_CACHE_TTL', 3600))
+GENERATION_RESULT_CACHE_SIZE = 256
+# Generated images go to S3 in 5 MiB parts as they download (smaller ones in one
+# put_object once complete); the copy kept for thumbnails stays in memory up to
+# this size, then spills to a temp file
+GENERATION_SPOOL_MAX_MEMORY = 1024 * 1024
+
+# Shared cache for cross-worker state (redis and hiredis are in requirements.txt).
+# Falls back to per-process memory when REDIS_URL is unset.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Only a shared cache (Redis) carries a write in one worker to the others. With the
+# per-process fallback, entries that other workers must see change (premium flags,
+# saved favorites, avatar metadata, gallery version stamps) are kept this briefly.
+CACHE_SHARED = bool(REDIS_URL)
+LOCAL_CACHE_TIMEOUT = 5
+
+# Stripe billing
+STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_PRICE_ID = os.getenv('STRIPE_PRICE_ID')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_TIMEOUT = 30
+APP_BASE_URL = os.getenv('APP_BASE_URL', 'http://localhost:8000')
+# Webhooks are recorded in stripe_events and applied by a background thread in
+# each web process; set STRIPE_EVENT_WORKER=0 and run `manage.py process_stripe_events`
+# to apply them elsewhere. Failed events back off and give up after MAX_ATTEMPTS.
+STRIPE_EVENT_WORKER = os.getenv('STRIPE_EVENT_WORKER', '1').lower() in ('1', 'true', 'yes')
+STRIPE_EVENT_POLL_INTERVAL = 30.0
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+# Cached premium flags (app/entitlements.py) are rewritten whenever premium
+# changes, so with a shared cache this only bounds how long an out-of-band DB
+# edit goes unnoticed; per-process caches only hear of changes made in-process
+ENTITLEMENT_CACHE_TIMEOUT = 24 * 3600 if CACHE_SHARED else LOCAL_CACHE_TIMEOUT
+
+# Pooled connections per host for outbound downloads (generated images)
+HTTP_POOL_MAXSIZE = 10
+
+# Gallery search backend: 'postgres' or 'memory'. Picked from the database vendor when unset.
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND')
+
+# Gallery results per page (first render and each /gallery/api request)
+GALLERY_PAGE_SIZE = int(os.getenv('GALLERY_PAGE_SIZE', 40))
+GALLERY_MAX_PAGE_SIZE = 100
+
+# Gallery search result pages (see app/gallery_cache.py). 'local' is an LRU per
+# process; 'shared' stores pages in the Django cache. With a shared cache new
+# images invalidate matching pages in every worker and the TTL bounds anything
+# invalidation misses; without one other workers only catch up on expiry, so
+# the TTL is kept short.
+GALLERY_CACHE = os.getenv('GALLERY_CACHE', '1').lower() in ('1', 'true', 'yes')
+GALLERY_CACHE_BACKEND = os.getenv('GALLERY_CACHE_BACKEND', 'local')
+GALLERY_CACHE_TTL = int(os.getenv('GALLERY_CACHE_TTL', 300 if CACHE_SHARED else 15))
+GALLERY_CACHE_SIZE = 512
+
+# search_logs write-behind: flush every N seconds, or early once this many searches are pending
+SEARCH_LOG_FLUSH_INTERVAL = float(os.getenv('SEARCH_LOG_FLUSH_INTERVAL', 5))
+SEARCH_LOG_FLUSH_THRESHOLD = int(os.getenv('SEARCH_LOG_FLUSH_THRESHOLD', 500))
+
+# "Top search terms" sketches (see app/trending.py). The half-life, in seconds,
+# decays the all-time counts so stale favourites fade; unset keeps them forever.
+TRENDING_CAPACITY = int(os.getenv('TRENDING_CAPACITY', 200))
+TRENDING_TOP_K = 10
+TRENDING_ALL_TIME_HALF_LIFE = float(os.getenv('TRENDING_ALL_TIME_HALF_LIFE', 0)) or None
+# The sketches are shared only through Redis. The cached all-time top list is
+# rebuilt at least this often; without Redis the all-time sketch expires too,
+# so each worker re-seeds from search_logs rather than drifting on its own batches.
+TRENDING_ALL_TIME_TTL = 3600 if CACHE_SHARED else 60
+
+# Avatar responses: browsers/proxies reuse them for max-age seconds, then revalidate
+# with If-None-Match (a 304 answered from cached metadata, no blob read)
+AVATAR_CACHE_MAX_AGE = int(os.getenv('AVATAR_CACHE_MAX_AGE', 300))
+AVATAR_CACHE_STALE_WHILE_REVALIDATE = 86400
+# A new upload drops the cached metadata only in the worker that took it unless
+# the cache is shared; elsewhere the old ETag is answered until this runs out
+AVATAR_META_CACHE_TIMEOUT = 3600 if CACHE_SHARED else LOCAL_CACHE_TIMEOUT
+
+# Square renditions stored for every uploaded avatar (pixels per side).
+# small covers the 40px navbar avatar at 2x, large the 200px profile header.
+AVATAR_SIZES = {
+    'small': 96,
+    'medium': 256,
+    'large': 512,
+}
+
+# Each user's set of saved image keys (app/favorites.py) is cached and dropped on
+# change; without a shared cache only in the worker making it, so keep it briefly
+FAVORITES_CACHE_TIMEOUT = 3600 if CACHE_SHARED else LOCAL_CACHE_TIMEOUT
+# Most keys accepted by one bulk favorites add/remove
+FAVORITES_BULK_LIMIT = 500
+
+# Support thread pages (app/support.py): messages per page, and how long the page's
+# "new since" long-poll may wait (seconds) and how often it re-checks meanwhile.
+# A waiting poll holds a whole worker under WSGI (gunicorn), so long-polling is off
+# by default and only ever used for requests served over ASGI; set this (e.g. 25)
+# when the site runs under uvicorn/daphne. Otherwise the page polls every few seconds.
+SUPPORT_MESSAGES_PAGE_SIZE = 50
+SUPPORT_MESSAGES_MAX_PAGE_SIZE = 200
+SUPPORT_LONG_POLL_TIMEOUT = float(os.getenv('SUPPORT_LONG_POLL_TIMEOUT', 0))
+SUPPORT_POLL_INTERVAL = 1.0
+
+# Widths (px) of the WebP thumbnails rendered for every gallery image
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+
+# Per-view query counts and DB time (app/middleware.py), exported on /metrics.
+# Statements slower than the threshold (seconds) are logged, literals redacted.
+SQL_PROFILER = os.getenv('SQL_PROFILER', '1').lower() in ('1', 'true', 'yes')
+SQL_SLOW_QUERY_THRESHOLD = float(os.getenv('SQL_SLOW_QUERY_THRESHOLD', 0.2))
+# /metrics answers requests carrying "Authorization: Bearer <METRICS_TOKEN>".
+# Without a token it is off (404) unless DEBUG is on, and then loopback and
+# private addresses may scrape it.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
 
 # Application definition
 
@@ -65,7 +257,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'app.middleware.StaticFilesMiddleware',
+    'app.middleware.SQLProfilerMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -153,5 +346,6 @@ CSRF_TRUSTED_ORIGINS = [
 # Security settings
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 SECURE_SSL_REDIRECT = not DEBUG  # Redirect all HTTP to HTTPS in production
+SECURE_REDIRECT_EXEMPT = [r'^metrics$']  # scraped over the internal network
 SESSION_COOKIE_SECURE = not DEBUG
 CSRF_COOKIE_SECURE = not DEBUG
\ No newline at end of file
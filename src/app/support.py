@@ -0,0 +1,188 @@
+"""
+Support thread search and per-thread activity totals.
+
+`search_filter` matches thread titles and message bodies through an index:
+the generated tsvector columns on PostgreSQL, the FTS5 tables (kept in step by
+triggers) on SQLite, both added by migration 0013. Every word must match, by
+prefix, within the title or within a single message.
+
+A thread's messages are keyset-paged on (created_at, id), backed by the
+(thread_id, created_at, id) index from migration 0014: `messages_page` reads
+the latest page or the one before a cursor, `messages_since` only what was
+posted after one, which is all a polling thread page asks for.
+
+SupportThread carries message_count, last_activity_at and last_author so the
+listing sorts and renders without touching thread_messages. The receivers
+below keep them current as ThreadMessage rows are created or deleted through
+the ORM; code inserting messages with raw SQL calls `refresh_stats`.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SupportThread, ThreadMessage
+from .pagination import InvalidCursor
+from .search import PostgresSearchBackend, tokenize
+
+# Messages oldest first; `before` seeks the page above (None at the start of the
+# thread), `after` is the newest message's key, `more` says polls are lagging behind
+MessagePage = namedtuple('MessagePage', 'messages before after more')
+
+LAST_MESSAGE = """
+    SELECT m.{column} FROM thread_messages m WHERE m.thread_id = support_threads.id
+    ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+"""
+
+SET_LAST_ACTIVITY = f"""
+    last_activity_at = COALESCE(({LAST_MESSAGE.format(column='created_at')}), support_threads.created_at),
+    last_author = COALESCE(({LAST_MESSAGE.format(column='author_username')}), support_threads.author_username)
+"""
+
+RECOUNT = f"""
+    UPDATE support_threads
+    SET message_count = (SELECT COUNT(*) FROM thread_messages m WHERE m.thread_id = support_threads.id),
+    {SET_LAST_ACTIVITY}
+"""
+
+
+def search_filter(query):
+    """RawSQL of matching thread ids for `filter(id__in=...)`, or None when the query has no words."""
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return None
+    if connection.vendor == 'postgresql':
+        tsquery = PostgresSearchBackend.build_tsquery(query)
+        return RawSQL(
+            "SELECT id FROM support_threads WHERE search_vector @@ to_tsquery('english', %s) "
+            "UNION SELECT thread_id FROM thread_messages WHERE search_vector @@ to_tsquery('english', %s)",
+            [tsquery, tsquery]
+        )
+    match = ' AND '.join(f'"{token}"*' for token in tokens)
+    return RawSQL(
+        "SELECT rowid FROM support_threads_fts WHERE support_threads_fts MATCH %s "
+        "UNION SELECT thread_id FROM thread_messages_fts WHERE thread_messages_fts MATCH %s",
+        [match, match]
+    )
+
+
+def message_key(message):
+    return (message.created_at.isoformat(), message.id)
+
+
+def parse_message_key(values):
+    """(created_at, id) from a decoded message cursor."""
+    created_at, message_id = values
+    try:
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(message_id, int) or created_at.tzinfo is None:
+        raise InvalidCursor('Malformed cursor')
+    return created_at, message_id
+
+
+def _thread_messages(thread_id):
+    return ThreadMessage.objects.filter(thread_id=thread_id).only(
+        'id', 'author_username', 'content', 'created_at', 'is_admin_reply'
+    )
+
+
+def messages_page(thread_id, limit, before=None):
+    """The `limit` messages just before the `before` key (the latest when None)."""
+    messages = _thread_messages(thread_id)
+    if before:
+        created_at, message_id = before
+        messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+    # One extra row tells us whether there are older messages
+    rows = list(messages.order_by('-created_at', '-id')[:limit + 1])
+    older = len(rows) > limit
+    rows = rows[:limit][::-1]
+    return MessagePage(
+        rows,
+        message_key(rows[0]) if older else None,
+        message_key(rows[-1]) if rows else None,
+        False,
+    )
+
+
+def messages_since(thread_id, limit, after=None):
+    """Up to `limit` messages after the `after` key, oldest first (from the start when None)."""
+    messages = _thread_messages(thread_id)
+    if after:
+        created_at, message_id = after
+        messages = messages.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+    rows = list(messages.order_by('created_at', 'id')[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    newest = message_key(rows[-1]) if rows else (
+        (after[0].isoformat(), after[1]) if after else None
+    )
+    return MessagePage(rows, None, newest, more)
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'author_username': message.author_username,
+        'content': message.content,
+        'is_admin_reply': message.is_admin_reply,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def refresh_stats(thread_ids=None):
+    """Recompute the totals from thread_messages, for the given threads or all of them."""
+    sql, params = RECOUNT, []
+    if thread_ids is not None:
+        thread_ids = list(thread_ids)
+        if not thread_ids:
+            return
+        sql += f" WHERE id IN ({', '.join(['%s'] * len(thread_ids))})"
+        params = thread_ids
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+@receiver(post_save, sender=ThreadMessage)
+def message_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+    created_at = connection.ops.adapt_datetimefield_value(instance.created_at)
+    # SET expressions all see the row as it was, so both CASEs compare against the old activity time
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE support_threads
+            SET message_count = message_count + 1,
+                last_author = CASE WHEN last_activity_at IS NULL OR last_activity_at <= %s
+                                   THEN %s ELSE last_author END,
+                last_activity_at = CASE WHEN last_activity_at IS NULL OR last_activity_at <= %s
+                                        THEN %s ELSE last_activity_at END
+            WHERE id = %s
+            """,
+            [created_at, instance.author_username, created_at, created_at, instance.thread_id]
+        )
+
+
+@receiver(post_delete, sender=ThreadMessage)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    # Messages cascading from their thread's deletion have no totals left to keep
+    if isinstance(origin, SupportThread) or getattr(origin, 'model', None) is SupportThread:
+        return
+    created_at = connection.ops.adapt_datetimefield_value(instance.created_at)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE support_threads SET message_count = CASE WHEN message_count > 0 "
+            "THEN message_count - 1 ELSE 0 END WHERE id = %s",
+            [instance.thread_id]
+        )
+        # Only removing the latest message moves last_activity_at back
+        cursor.execute(
+            f"UPDATE support_threads SET {SET_LAST_ACTIVITY} WHERE id = %s AND last_activity_at <= %s",
+            [instance.thread_id, created_at]
+        )
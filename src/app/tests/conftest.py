@@ -0,0 +1,52 @@
+"""
+Runs the suite against a throwaway in-memory SQLite database, migrated the same
+way as a local setup. Each `db` test runs inside a transaction that is rolled
+back afterwards, so on_commit hooks (runner and worker wake-ups) never fire.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('DATABASE_URL', 'sqlite://:memory:')
+# No background threads during tests
+os.environ.setdefault('GENERATION_WORKERS', '0')
+os.environ.setdefault('STRIPE_EVENT_WORKER', '0')
+
+import django  # noqa: E402
+
+django.setup()
+
+import pytest  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from app import quotas  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def django_db():
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    yield
+    teardown_databases(old_config, verbosity=0)
+    teardown_test_environment()
+
+
+@pytest.fixture
+def db(django_db):
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@pytest.fixture
+def limits():
+    """The counter quota backend with a free allowance of 3 a day."""
+    with override_settings(GENERATION_QUOTA_BACKEND='counter',
+                           GENERATION_DAILY_LIMITS={'free': 3, 'premium': None}):
+        quotas._backend = None
+        yield
+    quotas._backend = None
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from app import jobs, quotas
+
+
+def queue(username='alice', aspect_ratios=('9:16',)):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO wallify_users (username, email, password) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+            [username, f'{username}@example.com', 'x']
+        )
+    assert quotas.reserve(username, quotas.FREE, len(aspect_ratios))
+    return jobs.enqueue(username, 'a lighthouse', list(aspect_ratios))
+
+
+def set_started(job_id, seconds_ago):
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE generation_jobs SET started_at = %s WHERE id = %s",
+                       [timezone.now() - timedelta(seconds=seconds_ago), job_id])
+
+
+def test_claim_takes_the_oldest_queued_job_once(db, limits):
+    first = queue(aspect_ratios=('9:16', '16:9'))
+    second = queue('bob')
+
+    claimed = jobs.claim()
+    job_id, attempt, username, prompt, aspect_ratios, _ = jobs._unpack(claimed)
+    assert (job_id, attempt, username, prompt, aspect_ratios) == (first, 1, 'alice', 'a lighthouse', ['9:16', '16:9'])
+    assert jobs.get_job(first).status == jobs.RUNNING
+
+    assert jobs._unpack(jobs.claim())[0] == second
+    # A job a runner is still working on is not handed out again
+    assert jobs.claim() is None
+
+
+def test_stalled_job_is_claimed_again(db, limits):
+    job_id = queue()
+    jobs.claim()
+    set_started(job_id, settings.GENERATION_JOB_TIMEOUT + 1)
+
+    claimed_id, attempt, *_ = jobs._unpack(jobs.claim())
+    assert (claimed_id, attempt) == (job_id, 2)
+    # The first runner's attempt can no longer heartbeat or finish the job
+    assert not jobs.heartbeat(job_id, 1)
+    assert jobs.heartbeat(job_id, 2)
+
+
+def test_fail_stalled_gives_up_after_the_last_attempt(db, limits):
+    job_id = queue(aspect_ratios=('9:16', '1:1'))
+    for _ in range(settings.GENERATION_MAX_ATTEMPTS):
+        jobs.claim()
+        set_started(job_id, settings.GENERATION_JOB_TIMEOUT + 1)
+    assert quotas.used_today('alice') == 2
+
+    assert jobs.claim() is None
+    assert jobs.fail_stalled() == 1
+    job = jobs.get_job(job_id)
+    assert job.status == jobs.FAILED and job.error == 'Generation timed out'
+    # Its images were never delivered, so they go back to the allowance
+    assert quotas.used_today('alice') == 0
+    assert jobs.fail_stalled() == 0
+
+
+def test_fail_stalled_leaves_live_jobs_alone(db, limits):
+    job_id = queue()
+    for _ in range(settings.GENERATION_MAX_ATTEMPTS):
+        jobs.claim()
+        set_started(job_id, settings.GENERATION_JOB_TIMEOUT + 1)
+    # The runner of the last attempt is still checking in
+    assert jobs.heartbeat(job_id, settings.GENERATION_MAX_ATTEMPTS)
+
+    assert jobs.fail_stalled() == 0
+    assert jobs.get_job(job_id).status == jobs.RUNNING
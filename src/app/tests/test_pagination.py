@@ -0,0 +1,38 @@
+import pytest
+
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, parse_limit
+
+
+@pytest.mark.parametrize('values', [
+    (1.5, 42, 'bm25'),
+    ('2024-05-01T12:00:00+00:00', 7),
+    ('ünïcode', None),
+    (0, -1),
+])
+def test_cursor_round_trips(values):
+    token = encode_cursor(values)
+    assert '=' not in token
+    assert decode_cursor(token, len(values)) == values
+
+
+def test_empty_cursor_is_first_page():
+    assert decode_cursor(None, 2) is None
+    assert decode_cursor('', 2) is None
+
+
+@pytest.mark.parametrize('token', ['not base64!', encode_cursor([1, 2])[:-3], 'e30'])
+def test_malformed_cursor(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token, 2)
+
+
+def test_cursor_length_must_match():
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor([1, 2, 3]), 2)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 20), ('abc', 20), ('5', 5), (0, 1), (-3, 1), (500, 100),
+])
+def test_parse_limit(value, expected):
+    assert parse_limit(value, 20, 100) == expected
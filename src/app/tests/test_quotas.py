@@ -0,0 +1,41 @@
+from datetime import date
+
+from app import quotas
+
+DAY = date(2024, 5, 1)
+
+
+def test_reserve_up_to_the_limit(db, limits):
+    assert quotas.reserve('alice', quotas.FREE, 2, day=DAY)
+    assert quotas.reserve('alice', quotas.FREE, 1, day=DAY)
+    assert quotas.get_backend().used('alice', DAY) == 3
+
+    # At the limit a request is refused and changes nothing
+    assert not quotas.reserve('alice', quotas.FREE, 1, day=DAY)
+    assert quotas.get_backend().used('alice', DAY) == 3
+
+
+def test_reserve_refuses_a_batch_that_overshoots(db, limits):
+    assert quotas.reserve('alice', quotas.FREE, 2, day=DAY)
+    assert not quotas.reserve('alice', quotas.FREE, 2, day=DAY)
+    assert not quotas.reserve('bob', quotas.FREE, 4, day=DAY)
+    assert quotas.get_backend().used('alice', DAY) == 2
+    assert quotas.get_backend().used('bob', DAY) == 0
+
+
+def test_release_frees_room(db, limits):
+    assert quotas.reserve('alice', quotas.FREE, 3, day=DAY)
+    quotas.release('alice', 2, day=DAY)
+    assert quotas.get_backend().used('alice', DAY) == 1
+    assert quotas.reserve('alice', quotas.FREE, 2, day=DAY)
+    assert not quotas.reserve('alice', quotas.FREE, 1, day=DAY)
+
+    # Releasing more than was reserved bottoms out at zero
+    quotas.release('alice', 10, day=DAY)
+    assert quotas.get_backend().used('alice', DAY) == 0
+
+
+def test_unlimited_plan_is_still_counted(db, limits):
+    for _ in range(5):
+        assert quotas.reserve('carol', quotas.PREMIUM, 2, day=DAY)
+    assert quotas.get_backend().used('carol', DAY) == 10
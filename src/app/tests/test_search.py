@@ -0,0 +1,59 @@
+from app.search import InvertedIndex, tokenize
+
+
+def make_index(docs):
+    index = InvertedIndex()
+    for doc_id, text in docs.items():
+        index.add(doc_id, text)
+    return index
+
+
+def test_tokenize_lowercases_and_splits():
+    assert tokenize('Red-Sunset, 4K!') == ['red', 'sunset', '4k']
+    assert tokenize(None) == []
+
+
+def test_every_word_must_match():
+    index = make_index({1: 'red sunset', 2: 'red car', 3: 'blue sunset'})
+    assert [doc_id for doc_id, _ in index.search('red sunset')] == [1]
+    assert index.search('green') == []
+    assert index.search('') == []
+
+
+def test_prefix_matching():
+    index = make_index({1: 'wallpapers of mountains', 2: 'wall street', 3: 'mountain lake'})
+    assert {doc_id for doc_id, _ in index.search('wall')} == {1, 2}
+    assert {doc_id for doc_id, _ in index.search('mount')} == {1, 3}
+    assert [doc_id for doc_id, _ in index.search('wall mount')] == [1]
+
+
+def test_ranking_prefers_frequent_and_rare_terms():
+    index = make_index({
+        1: 'forest',
+        2: 'forest forest forest',
+        3: 'forest river',
+        4: 'river',
+    })
+    ranked = [doc_id for doc_id, _ in index.search('forest')]
+    assert ranked[0] == 2
+    assert set(ranked) == {1, 2, 3}
+    # Shorter documents score higher for the same term frequency
+    assert ranked.index(1) < ranked.index(3)
+
+
+def test_ties_break_on_newest_id():
+    index = make_index({1: 'ocean', 2: 'ocean', 3: 'ocean'})
+    assert [doc_id for doc_id, _ in index.search('ocean')] == [3, 2, 1]
+
+
+def test_readding_and_removing_documents():
+    index = make_index({1: 'red car', 2: 'red boat'})
+    index.add(1, 'blue car')
+    assert [doc_id for doc_id, _ in index.search('red')] == [2]
+    assert [doc_id for doc_id, _ in index.search('blue')] == [1]
+
+    index.remove(2)
+    assert index.search('boat') == []
+    assert 2 not in index and len(index) == 1
+    # Removed terms no longer match as prefixes either
+    assert index.search('bo') == []
@@ -0,0 +1,83 @@
+"""
+Responsive derivatives for gallery images.
+
+After an original lands in S3 under images/<key>, `generate_derivatives`
+renders WebP copies at each THUMBNAIL_WIDTHS width under thumbs/<width>/<key>.webp
+plus a tiny blurred placeholder that is stored inline on the images_table row.
+Grids load the thumbnails through srcset; only downloads fetch the original.
+"""
+import base64
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+from PIL import Image, ImageFilter
+
+from .imaging import InvalidImage, encode_image, open_image
+
+logger = logging.getLogger(__name__)
+
+Derivatives = namedtuple('Derivatives', ['widths', 'placeholder', 'width', 'height'])
+NO_DERIVATIVES = Derivatives([], None, None, None)
+
+PLACEHOLDER_WIDTH = 16
+
+
+def thumb_key(image_key, width):
+    return f'thumbs/{width}/{image_key}.webp'
+
+
+def thumb_url(image_key, width):
+    return f'https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{thumb_key(image_key, width)}'
+
+
+def _resize(image, width):
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def render_placeholder(image):
+    small = _resize(image, PLACEHOLDER_WIDTH).filter(ImageFilter.GaussianBlur(1))
+    data, content_type = encode_image(small, quality=40)
+    return f'data:{content_type};base64,{base64.b64encode(data).decode()}'
+
+
+def generate_derivatives(s3, image_key, source):
+    """
+    Upload resized copies of `source` (a file-like object) and return Derivatives.
+    Failures are logged and reported as NO_DERIVATIVES; the grid then falls back
+    to the original.
+    """
+    try:
+        image = open_image(source, max_side=max(settings.THUMBNAIL_WIDTHS) * 2)
+    except InvalidImage as e:
+        logger.warning("Cannot render derivatives for %s: %s", image_key, e)
+        return NO_DERIVATIVES
+
+    # Never upscale; an image narrower than every width is served as-is
+    widths = [width for width in settings.THUMBNAIL_WIDTHS if width < image.width]
+    try:
+        for width in widths:
+            data, content_type = encode_image(_resize(image, width))
+            s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                          Key=thumb_key(image_key, width),
+                          Body=data,
+                          ContentType=content_type,
+                          CacheControl='public, max-age=604800')
+        placeholder = render_placeholder(image)
+    except Exception:
+        logger.exception("Failed to store derivatives for %s", image_key)
+        return NO_DERIVATIVES
+    # Dimensions may come from a reduced-scale decode; templates only use their ratio
+    return Derivatives(widths, placeholder, image.width, image.height)
+
+
+def image_sources(image_key, thumb_widths):
+    """Template-ready src/srcset for a grid tile, given the stored thumb_widths column."""
+    widths = [int(w) for w in thumb_widths.split(',')] if thumb_widths else []
+    if not widths:
+        return {'thumb_url': None, 'srcset': ''}
+    return {
+        'thumb_url': thumb_url(image_key, widths[len(widths) // 2]),
+        'srcset': ', '.join(f'{thumb_url(image_key, w)} {w}w' for w in widths),
+    }
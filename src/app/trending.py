@@ -0,0 +1,199 @@
+"""
+Top search terms, maintained incrementally instead of sorting search_logs.
+
+Each worker hands its flushed search-log batch (see search_logs.SearchLogBuffer)
+to `merge_batch`, which folds it into Space-Saving sketches kept in the Django
+cache, shared by every worker when that cache is Redis (CACHE_SHARED):
+
+* ``all``  - a single sketch, seeded once from search_logs on a cold cache and
+             optionally decayed with TRENDING_ALL_TIME_HALF_LIFE.
+* ``hour`` - twelve 5-minute bucket sketches.
+* ``day``  - twenty-four 1-hour bucket sketches.
+
+After merging, the top terms of each window are precomputed and cached, so
+rendering the panel is a single cache read.
+
+With the per-process fallback cache each worker only merges its own batches.
+The all-time top list expires after TRENDING_ALL_TIME_TTL either way, and
+without a shared cache so does the all-time sketch, so every worker
+re-seeds from search_logs (which all of them write) at that interval.
+"""
+import logging
+import math
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# window -> (bucket length in seconds, number of buckets); None means unbounded
+WINDOWS = {
+    'all': None,
+    'hour': (300, 12),
+    'day': (3600, 24),
+}
+
+LOCK_TIMEOUT = 10
+
+# Batches not yet merged because another worker held the lock
+_carry = Counter()
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters summary (Metwally et al.).
+
+    Tracks at most `capacity` terms. Each count over-estimates the true count by
+    at most its recorded error, and any term whose true frequency exceeds
+    total / capacity is guaranteed to be present.
+    """
+
+    def __init__(self, capacity, items=None, updated_at=None):
+        self.capacity = capacity
+        self.items = items or {}  # term -> [count, error]
+        self.updated_at = updated_at or time.time()
+
+    def offer(self, term, n=1):
+        entry = self.items.get(term)
+        if entry is not None:
+            entry[0] += n
+        elif len(self.items) < self.capacity:
+            self.items[term] = [n, 0]
+        else:
+            # Replace the smallest counter; its count becomes the newcomer's error bound
+            victim = min(self.items, key=lambda t: self.items[t][0])
+            floor = self.items.pop(victim)[0]
+            self.items[term] = [floor + n, floor]
+
+    def merge(self, other):
+        for term, (count, error) in other.items.items():
+            self.offer(term, count)
+            self.items[term][1] += error
+
+    def decay(self, half_life, now=None):
+        now = now or time.time()
+        if half_life and now > self.updated_at:
+            factor = math.pow(0.5, (now - self.updated_at) / half_life)
+            for entry in self.items.values():
+                entry[0] *= factor
+                entry[1] *= factor
+        self.updated_at = now
+
+    def top(self, k):
+        ranked = sorted(self.items.items(), key=lambda item: (-item[1][0], item[0]))
+        return [term for term, _ in ranked[:k]]
+
+    def to_dict(self):
+        return {'items': self.items, 'updated_at': self.updated_at}
+
+    @classmethod
+    def from_dict(cls, capacity, data):
+        if not data:
+            return cls(capacity)
+        return cls(capacity, {term: list(entry) for term, entry in data['items'].items()}, data['updated_at'])
+
+
+def _sketch_key(window, bucket=None):
+    return f'trending:sketch:{window}' if bucket is None else f'trending:sketch:{window}:{bucket}'
+
+
+def _top_key(window):
+    return f'trending:top:{window}'
+
+
+def _bucket_keys(window, now):
+    length, count = WINDOWS[window]
+    current = int(now // length)
+    return [_sketch_key(window, bucket) for bucket in range(current - count + 1, current + 1)]
+
+
+def _seed_all_time():
+    # Cold cache: start the all-time sketch from the persisted totals
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT search_term, search_count FROM search_logs ORDER BY search_count DESC LIMIT %s",
+            [settings.TRENDING_CAPACITY]
+        )
+        rows = cursor.fetchall()
+    return SpaceSaving(settings.TRENDING_CAPACITY, {term: [count, 0] for term, count in rows})
+
+
+def _acquire_lock(attempts=20, delay=0.05):
+    for _ in range(attempts):
+        if cache.add('trending:lock', 1, LOCK_TIMEOUT):
+            return True
+        time.sleep(delay)
+    return False
+
+
+def merge_batch(batch, now=None):
+    """Fold a {term: count} batch into the shared sketches and refresh each window's top list."""
+    _carry.update(batch)
+    if not _carry:
+        return
+    # Serialize read-modify-write of the shared sketches across workers; on
+    # contention the batch is carried over to the next flush
+    if not _acquire_lock():
+        logger.warning("Trending sketches busy; deferring %d terms", len(_carry))
+        return
+    batch = dict(_carry)
+    _carry.clear()
+    now = now or time.time()
+    capacity = settings.TRENDING_CAPACITY
+    try:
+        for window, spec in WINDOWS.items():
+            if spec is None:
+                data = cache.get(_sketch_key(window))
+                if data:
+                    sketch = SpaceSaving.from_dict(capacity, data)
+                    sketch.decay(settings.TRENDING_ALL_TIME_HALF_LIFE, now)
+                    for term, n in batch.items():
+                        sketch.offer(term, n)
+                else:
+                    # Batches reach us after they are persisted, so the seed already includes this one
+                    sketch = _seed_all_time()
+                cache.set(_sketch_key(window), sketch.to_dict(),
+                          None if settings.CACHE_SHARED else settings.TRENDING_ALL_TIME_TTL)
+                top = sketch.top(settings.TRENDING_TOP_K)
+            else:
+                length, count = spec
+                key = _sketch_key(window, int(now // length))
+                sketch = SpaceSaving.from_dict(capacity, cache.get(key))
+                for term, n in batch.items():
+                    sketch.offer(term, n)
+                cache.set(key, sketch.to_dict(), length * count)
+                top = _window_top(window, now)
+            cache.set(_top_key(window), top, _top_timeout(window))
+    finally:
+        cache.delete('trending:lock')
+
+
+def _window_top(window, now):
+    combined = SpaceSaving(settings.TRENDING_CAPACITY)
+    for data in cache.get_many(_bucket_keys(window, now)).values():
+        combined.merge(SpaceSaving.from_dict(settings.TRENDING_CAPACITY, data))
+    return combined.top(settings.TRENDING_TOP_K)
+
+
+def _top_timeout(window):
+    # Windowed lists go stale as buckets age out even without new searches
+    spec = WINDOWS[window]
+    return settings.TRENDING_ALL_TIME_TTL if spec is None else spec[0]
+
+
+def top_terms(window='all'):
+    """Cached top search terms for `window`; one cache read on the hot path."""
+    if window not in WINDOWS:
+        window = 'all'
+    top = cache.get(_top_key(window))
+    if top is not None:
+        return top
+    if WINDOWS[window] is None:
+        top = _seed_all_time().top(settings.TRENDING_TOP_K)
+    else:
+        top = _window_top(window, time.time())
+    cache.add(_top_key(window), top, _top_timeout(window))
+    return top
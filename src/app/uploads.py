@@ -0,0 +1,142 @@
+"""
+Streaming uploads to S3.
+
+`stream_to_s3` copies a file-like object into S3 without holding it in
+memory: small files go up in one put_object, larger ones as a multipart upload
+of S3_MULTIPART_PART_SIZE parts sent S3_MULTIPART_CONCURRENCY at a time.
+At most that many parts are read ahead, so peak memory stays at a few parts
+whatever the file size. Django already spools large request bodies to a
+temporary file (FILE_UPLOAD_MAX_MEMORY_SIZE), which is what gets streamed.
+A failed part aborts the whole upload so no orphaned parts are left billed.
+
+`StreamReader` adapts an iterator of byte chunks, such as a streamed HTTP
+response, to the file interface stream_to_s3 reads from. S3 needs each part's
+full length up front, so nothing is sent until a whole part (at least
+MIN_PART_SIZE) has arrived: a download smaller than one part is buffered and
+sent with put_object once complete; larger ones upload part by part as they
+arrive.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# S3 rejects multipart parts smaller than this, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class StreamReader:
+    """
+    File-like reader over an iterator of byte chunks. Every byte read is also
+    written to `copy` (if given); each chunk is reported on arrival as
+    progress(bytes_received, total). read(n) only returns fewer than n bytes
+    at the end of the stream.
+    """
+
+    def __init__(self, chunks, copy=None, progress=None, total=None):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self.copy = copy
+        self.progress = progress
+        self.total = total
+        self.bytes_received = 0
+
+    def _fill(self, n):
+        while not self._eof and (n < 0 or len(self._buffer) < n):
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._eof = True
+            else:
+                self._buffer += chunk
+                self.bytes_received += len(chunk)
+                if self.progress is not None and chunk:
+                    self.progress(self.bytes_received, self.total)
+
+    def peek(self, n):
+        """The next n bytes without consuming them (for sniffing the file type)."""
+        self._fill(n)
+        return bytes(self._buffer[:n])
+
+    def read(self, n=-1):
+        self._fill(n)
+        if n < 0 or n >= len(self._buffer):
+            data, self._buffer = bytes(self._buffer), bytearray()
+        else:
+            data = bytes(self._buffer[:n])
+            del self._buffer[:n]
+        if data and self.copy is not None:
+            self.copy.write(data)
+        return data
+
+
+def stream_to_s3(s3, fileobj, key, content_type=None, *, part_size=None, concurrency=None, extra=None):
+    """
+    Upload `fileobj` from its current position to settings.AWS_STORAGE_BUCKET_NAME/key.
+    `extra` is passed through as put_object/create_multipart_upload arguments.
+    Returns the number of bytes uploaded.
+    """
+    part_size = max(part_size or settings.S3_MULTIPART_PART_SIZE, MIN_PART_SIZE)
+    concurrency = max(1, concurrency or settings.S3_MULTIPART_CONCURRENCY)
+    params = {'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key, **(extra or {})}
+    if content_type:
+        params['ContentType'] = content_type
+
+    first = fileobj.read(part_size)
+    if len(first) < part_size:
+        s3.put_object(Body=first, **params)
+        return len(first)
+
+    upload_id = s3.create_multipart_upload(**params)['UploadId']
+    try:
+        parts, size = _upload_parts(s3, fileobj, params['Bucket'], key, upload_id, first, part_size, concurrency)
+        s3.complete_multipart_upload(
+            Bucket=params['Bucket'], Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts},
+        )
+    except BaseException:
+        logger.warning("Aborting multipart upload of %s", key)
+        try:
+            s3.abort_multipart_upload(Bucket=params['Bucket'], Key=key, UploadId=upload_id)
+        except Exception:
+            logger.exception("Could not abort multipart upload %s of %s", upload_id, key)
+        raise
+    return size
+
+
+def _upload_parts(s3, fileobj, bucket, key, upload_id, first, part_size, concurrency):
+    # Each in-flight part holds one slot; reading the next chunk waits for a free one
+    slots = threading.BoundedSemaphore(concurrency)
+    failed = threading.Event()
+
+    def send(number, chunk):
+        try:
+            if failed.is_set():
+                return None
+            response = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                      PartNumber=number, Body=chunk)
+            return {'PartNumber': number, 'ETag': response['ETag']}
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            slots.release()
+
+    futures = []
+    size = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='s3-part') as pool:
+        chunk, number = first, 1
+        while chunk and not failed.is_set():
+            slots.acquire()
+            futures.append(pool.submit(send, number, chunk))
+            size += len(chunk)
+            number += 1
+            chunk = fileobj.read(part_size)
+        if failed.is_set():
+            pool.shutdown(cancel_futures=True)
+    # result() re-raises the first part failure
+    return [future.result() for future in futures], size
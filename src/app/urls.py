@@ -1,12 +1,13 @@
 from django.contrib import admin
 from django.urls import path
-from .views import homepage, about, gallery, signin, signup, logout_view, serve_profile_picture, get_profile_picture, profile, delete_favorite_image, upload_image, generate_image, support, thread_detail, create_thread, change_thread_status, delete_thread, create_checkout_session, stripe_webhook
+from .views import homepage, about, gallery, gallery_api, signin, signup, logout_view, serve_profile_picture, get_profile_picture, profile, profile_favorites_api, profile_uploads_api, delete_favorite_image, favorites_add, favorites_remove, upload_image, generate_image, generation_job_status, support, thread_detail, thread_messages, create_thread, change_thread_status, delete_thread, create_checkout_session, billing_status, stripe_webhook, prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', homepage, name='homepage'),
     path('about/', about, name='about'),
     path('gallery/', gallery, name='gallery'),
+    path('gallery/api', gallery_api, name='gallery_api'),
     path('signin/', signin, name='signin'),
     path('signup/', signup, name='signup'),
     path('logout/', logout_view, name='logout'),
@@ -14,15 +15,24 @@ urlpatterns = [
     path('profile-picture/<str:username>/', get_profile_picture, name='get_profile_picture'),
     path('profile/', profile, name='profile'),
     path('profile/<str:username>/', profile, name='profile_other'),
+    path('profile/<str:username>/favorites', profile_favorites_api, name='profile_favorites_api'),
+    path('profile/<str:username>/uploads', profile_uploads_api, name='profile_uploads_api'),
     path('upload_image/', upload_image, name='upload_image'),
     path('delete_favorite_image/', delete_favorite_image, name='delete_favorite_image'),
+    path('favorites/add', favorites_add, name='favorites_add'),
+    path('favorites/remove', favorites_remove, name='favorites_remove'),
     path('generate_image/', generate_image, name='generate_image'),
+    path('generate_image/jobs/<str:job_id>/', generation_job_status, name='generation_job_status'),
     path('support/', support, name='support'),
     path('support/thread/<int:thread_id>/', thread_detail, name='thread_detail'),
+    path('support/thread/<int:thread_id>/messages/', thread_messages, name='thread_messages'),
     path('support/create/', create_thread, name='create_thread'),
     path('support/thread/<int:thread_id>/status/<str:new_status>/', change_thread_status, name='change_thread_status'),
     path('support/thread/<int:thread_id>/delete/', delete_thread, name='delete_thread'),
     # Stripe billing
     path('billing/checkout', create_checkout_session, name='create_checkout_session'),
+    path('billing/status', billing_status, name='billing_status'),
     path('stripe/webhook', stripe_webhook, name='stripe_webhook'),
+    # Prometheus scrape target
+    path('metrics', prometheus_metrics, name='metrics'),
 ]
@@ -1,26 +1,39 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db import connection
+from django.urls import reverse
+from django.db import connection, transaction
 from django.http import HttpResponse
 from django.core.files.storage import FileSystemStorage
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth import logout
-import boto3
 from django.conf import settings
-import os
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import time
+from urllib.parse import quote
+from django.core.handlers.asgi import ASGIRequest
 from django.http import JsonResponse
-import requests
-import uuid
-import replicate
-from dotenv import load_dotenv
-import stripe
-from django.utils import timezone
 from datetime import datetime
 from django.contrib import messages
 from .models import SupportThread, ThreadMessage
+from .avatars import avatar_response, default_renditions, save_avatar, store_renditions
+from . import aio, billing, entitlements, favorites, gallery_cache, jobs, metrics, profiles, quotas
+from .generation import ASPECT_RATIOS
+from .imaging import InvalidImage
+from .catalog import insert_image, serialize_hits
+from .pagination import decode_cursor, encode_cursor, parse_limit
+from .search_logs import record_search
+from .services import get_s3, get_stripe, get_stripe_async
+from .support import messages_page, messages_since, parse_message_key, search_filter, serialize_message
+from .thumbnails import generate_derivatives
+from .trending import WINDOWS as TRENDING_WINDOWS, top_terms
+from .uploads import stream_to_s3
 from django.core.paginator import Paginator
-from django.db.models import Q
-from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
 
 def homepage(request):
     username = request.session.get('username')
@@ -28,53 +41,27 @@ def homepage(request):
     is_premium = False
     if username:
         # Use the URL name instead of hardcoding the path
-        profile_picture_url = f'/profile-picture/{username}'  # Note the trailing slash
-        # Prefer session cache, fall back to DB
-        is_premium = bool(request.session.get('is_premium', False))
-        if not is_premium:
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute("SELECT premium FROM wallify_users WHERE username = %s", [username])
-                    row = cursor.fetchone()
-                    if row is not None:
-                        is_premium = bool(row[0])
-                        request.session['is_premium'] = is_premium
-            except Exception:
-                # If the column doesn't exist or query fails, fall back to non-premium
-                is_premium = False
-
-    # If returned from Stripe checkout with a session_id, verify and upgrade without waiting for webhook
-    session_id = request.GET.get('session_id')
-    if request.GET.get('checkout') == 'success' and session_id:
+        profile_picture_url = f'/profile-picture/{username}/?size=small'
+        # Cached entitlement, shared by all workers and updated on upgrade
         try:
-            load_dotenv()
-            stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-            sess = stripe.checkout.Session.retrieve(session_id)
-            # Accept paid/complete subscription sessions
-            mode_ok = (sess.get('mode') == 'subscription')
-            paid_ok = (sess.get('payment_status') == 'paid') or (sess.get('status') in ('complete', 'completed'))
-            # Identify username via metadata or client_reference_id
-            uname = None
-            md = sess.get('metadata') or {}
-            if isinstance(md, dict):
-                uname = md.get('username')
-            if not uname:
-                uname = sess.get('client_reference_id')
-            if mode_ok and paid_ok and uname:
-                with connection.cursor() as cursor:
-                    cursor.execute("UPDATE wallify_users SET premium = 1 WHERE username = %s", [uname])
-                if request.session.get('username') == uname:
-                    request.session['is_premium'] = True
-                # Redirect to clean URL
-                return redirect('homepage')
-        except Exception as e:
-            # Best-effort; ignore errors here and just render normally
-            print('Checkout verification failed:', str(e))
+            is_premium = entitlements.is_premium(username)
+        except Exception:
+            # If the column doesn't exist or query fails, fall back to non-premium
+            is_premium = False
+
+    # Back from Stripe checkout: the upgrade arrives through the webhook, usually
+    # before the redirect does. Until then the page shows a notice and polls billing_status.
+    checkout_pending = False
+    if request.GET.get('checkout') == 'success' and username:
+        if is_premium:
+            return redirect('homepage')
+        checkout_pending = True
 
     return render(request, 'homepage.html', {
         'username': username,
         'profile_picture_url': profile_picture_url,
         'is_premium': is_premium,
+        'checkout_pending': checkout_pending,
     })
 
 def about(request):
@@ -82,7 +69,7 @@ def about(request):
     profile_picture_url = '/static/images/dpfp.png'
     if username:
         # Use the URL name instead of hardcoding the path
-        profile_picture_url = f'/profile-picture/{username}'
+        profile_picture_url = f'/profile-picture/{username}/?size=small'
 
     return render(request, 'about.html', {'username': username, 'profile_picture_url': profile_picture_url})
 
@@ -91,53 +78,20 @@ def image_generation(request):
 
 def gallery(request):
     query = request.GET.get('q', '4k wallpapers')  # Default to 'free wallpapers' if no query is provided
-    s3_image_urls = []
-    top_search_terms = []
 
-    # Split the search query into individual words
-    keywords = query.split()
+    # First page only; the template fetches the rest from gallery_api as the user scrolls
+    page = gallery_cache.search(query, limit=settings.GALLERY_PAGE_SIZE)
+    s3_image_urls = serialize_hits(page.hits)
+    next_cursor = encode_cursor(page.next_after) if page.next_after else None
 
-    # Construct a SQL query dynamically to search for all keywords in the description
-    conditions = []
-    query_params = []
-    for keyword in keywords:
-        conditions.append("description ILIKE %s")
-        query_params.append('%' + keyword + '%')
+    # Count the search; the buffer upserts into search_logs in the background
+    record_search(query)
 
-    # Update SQL query to include username
-    sql_query = "SELECT image_key, \"user\" FROM images_table WHERE " + " AND ".join(conditions)
-
-    # Execute the SQL query
-    with connection.cursor() as cursor:
-        cursor.execute(sql_query, query_params)
-        results = cursor.fetchall()
-
-    # S3 bucket URL with '/images/' path
-    s3_bucket_url = 'https://{}.s3.amazonaws.com/images/'.format(settings.AWS_STORAGE_BUCKET_NAME)
-
-    # Generate image URLs and include usernames
-    for result in results:
-        image_key, username = result
-        image_url = s3_bucket_url + image_key
-        s3_image_urls.append({'url': image_url, 'key': image_key, 'username': username})
-
-    # Log the search term into the search_logs table
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT search_count FROM search_logs WHERE search_term = %s", [query])
-        row = cursor.fetchone()
-
-        if row:
-            # If it exists, update the count
-            new_count = row[0] + 1
-            cursor.execute("UPDATE search_logs SET search_count = %s WHERE search_term = %s", [new_count, query])
-        else:
-            # If it doesn't exist, insert a new record
-            cursor.execute("INSERT INTO search_logs (search_term, search_count) VALUES (%s, %s)", [query, 1])
-
-    # Fetch top 10 search terms
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT search_term FROM search_logs ORDER BY search_count DESC LIMIT 10")
-        top_search_terms = [row[0] for row in cursor.fetchall()]
+    # Top search terms come precomputed from the shared trending sketches
+    trending_window = request.GET.get('trending', 'all')
+    if trending_window not in TRENDING_WINDOWS:
+        trending_window = 'all'
+    top_search_terms = top_terms(trending_window)
 
     # Get the username from session
     username = request.session.get('username')
@@ -146,22 +100,47 @@ def gallery(request):
     profile_picture_url = '/static/images/dpfp.png'
 
     if username:
-        profile_picture_url = f'/profile-picture/{username}'
+        profile_picture_url = f'/profile-picture/{username}/?size=small'
 
     if request.method == 'POST':
         image_key = request.POST.get('image_key')
         if username:
-            with connection.cursor() as cursor:
-                cursor.execute("INSERT INTO favorites (image_key, username) VALUES (%s, %s)", [image_key, username])
+            favorites.add(username, [image_key])
+
+    # Tiles the user already saved, from their cached set
+    if username:
+        favorites.mark_saved(s3_image_urls, username)
 
     # Render the gallery template with the search results and top search terms
     return render(request, 'gallery.html', {
         'results': s3_image_urls,
+        'next_cursor': next_cursor,
+        'query': query,
         'top_search_terms': top_search_terms,
+        'trending_window': trending_window,
         'username': username,
         'profile_picture_url': profile_picture_url
     })
 
+def gallery_api(request):
+    # Keyset-paged gallery results for infinite scroll
+    query = request.GET.get('q', '4k wallpapers')
+    limit = parse_limit(request.GET.get('limit'), settings.GALLERY_PAGE_SIZE, settings.GALLERY_MAX_PAGE_SIZE)
+    try:
+        after = decode_cursor(request.GET.get('cursor'), 3)
+        page = gallery_cache.search(query, limit=limit, after=after)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    results = serialize_hits(page.hits)
+    username = request.session.get('username')
+    if username:
+        favorites.mark_saved(results, username)
+    return JsonResponse({
+        'results': results,
+        'next_cursor': encode_cursor(page.next_after) if page.next_after else None,
+    })
+
 # Authentication Views
 def signin(request):
     if request.method == 'POST':
@@ -169,18 +148,16 @@ def signin(request):
         password = request.POST.get('password')
 
         with connection.cursor() as cursor:
-            cursor.execute("SELECT username, password, premium FROM wallify_users WHERE username = %s", [username])
+            cursor.execute("SELECT username, password FROM wallify_users WHERE username = %s", [username])
             user_data = cursor.fetchone()
 
         if user_data:
             # Extract hashed password from database
             hashed_password = user_data[1]
-            premium_flag = user_data[2] if len(user_data) > 2 else 0
 
             # Check if the provided password matches the hashed password
             if check_password(password, hashed_password):
                 request.session['username'] = username
-                request.session['is_premium'] = bool(premium_flag)
                 return JsonResponse({'success': True})
             else:
                 return JsonResponse({'success': False, 'message': 'Invalid username or password'})
@@ -205,25 +182,21 @@ def signup(request):
             # Hash the password
             hashed_password = make_password(password1)
 
-            # Get the path to the static file
-            pfp_path = os.path.join(settings.BASE_DIR, 'app', 'static', 'images', 'dpfp.png')
-
-            # Read the default profile picture as binary data
-            with open(pfp_path, 'rb') as pfp_file:
-                pfp_blob = pfp_file.read()
-
-            # Insert data into the database
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO wallify_users (firstname, lastname, email, username, password, pfp)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    """,
-                    [firstname, lastname, email, username, hashed_password, pfp_blob]
-                )
+            # The user and their avatar rows land together or not at all
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        INSERT INTO wallify_users (firstname, lastname, email, username, password)
+                        VALUES (%s, %s, %s, %s, %s)
+                        """,
+                        [firstname, lastname, email, username, hashed_password]
+                    )
+
+                # Start with the default profile picture, pre-rendered in every size
+                store_renditions(username, default_renditions())
             
             request.session['username'] = username
-            request.session['is_premium'] = False
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'success': False, 'message': str(e)})
@@ -235,27 +208,11 @@ def logout_view(request):
     return redirect('homepage')  # Redirect to the homepage or any other page
 
 #User PFP
-def serve_profile_picture(request, user_id):
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT pfp FROM wallify_users WHERE id = %s", [user_id])
-        result = cursor.fetchone()
-
-    if result:
-        pfp_blob = result[0]
-        if pfp_blob:
-            return HttpResponse(pfp_blob, content_type='image/png')
-
-    return HttpResponse(status=404)
+async def serve_profile_picture(request, user_id):
+    return await aio.db(avatar_response, request, 'id', user_id)
 
-def get_profile_picture(request, username):
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT pfp FROM wallify_users WHERE username = %s", [username])
-        row = cursor.fetchone()
-        if row:
-            pfp_data = row[0]
-            response = HttpResponse(pfp_data, content_type='image/jpeg')  # Adjust content_type as needed
-            return response
-    return HttpResponse(status=404)
+async def get_profile_picture(request, username):
+    return await aio.db(avatar_response, request, 'username', username)
 
 def profile(request, username=None):
     # Get the username of the logged-in user from the session
@@ -272,22 +229,16 @@ def profile(request, username=None):
     # Set a default profile picture URL for the logged-in user
     profile_picture_url = '/static/images/default-profile-image2.png'
     if logged_in_username:
-        profile_picture_url = f'/profile-picture/{logged_in_username}'
+        profile_picture_url = f'/profile-picture/{logged_in_username}/?size=small'
 
     # Handle profile picture update (only for the logged-in user)
     if request.method == 'POST' and logged_in_username == username:
         if 'newProfilePicture' in request.FILES:
             try:
                 profile_picture = request.FILES['newProfilePicture']
-                file_content = profile_picture.read()
 
-                # Update the user's profile picture in the database
-                with connection.cursor() as cursor:
-                    cursor.execute("""
-                        UPDATE wallify_users
-                        SET pfp = %s
-                        WHERE username = %s
-                    """, [file_content, logged_in_username])
+                # Normalize into the avatar sizes and store them with their cache validators
+                save_avatar(logged_in_username, profile_picture)
 
                 # Redirect to the home page after update
                 # If AJAX, return JSON so client can close modal without full redirect
@@ -295,54 +246,35 @@ def profile(request, username=None):
                     return JsonResponse({'success': True})
                 return redirect('profile')
 
+            except InvalidImage:
+                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                    return JsonResponse({'success': False, 'message': 'Please upload a valid image file'}, status=400)
+                return render(request, 'profile.html', {'error': 'Please upload a valid image file'})
+
             except Exception as e:
                 # Handle the error (e.g., display an error message)
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse({'success': False, 'message': 'Failed to update profile picture'}, status=500)
                 return render(request, 'profile.html', {'error': 'Failed to update profile picture'})
 
-    # Fetch user details and profile picture for the profile being viewed
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT id, firstname, lastname, email, username, pfp FROM wallify_users WHERE username = %s", [username])
-        user = cursor.fetchone()
-
-    if user:
-        user_id, firstname, lastname, email, viewed_username, pfp_blob = user
+    # Header fields and totals in one query; the grids page in from the profile APIs
+    header = profiles.profile_header(username)
 
+    if header:
         # Construct the URL for the profile picture of the viewed user
         pfp_url = None
-        if pfp_blob:
-            pfp_url = request.build_absolute_uri(f'/profile_picture/{user_id}/')
-
-        # Fetch favorite images for the user whose profile is being viewed
-        favorite_images = []
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT image_key FROM favorites WHERE username = %s", [username])
-            results = cursor.fetchall()
-            for result in results:
-                image_key = result[0]
-                image_url = f'https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/images/{image_key}'
-                favorite_images.append({'url': image_url, 'key': image_key})
-
-        # Fetch uploaded images for the logged-in user
-        uploaded_images = []
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT image_key FROM images_table WHERE \"user\" = %s", [username])
-            results = cursor.fetchall()
-            for result in results:
-                image_key = result[0]
-                image_url = f'https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/images/{image_key}'
-                uploaded_images.append({'url': image_url, 'key': image_key})
+        if header.has_pfp:
+            pfp_url = request.build_absolute_uri(f'/profile_picture/{header.user_id}/?size=large')
 
         context = {
-            'firstname': firstname,
-            'lastname': lastname,
-            'email': email,
-            'username': viewed_username,  # User whose profile is being viewed
+            'firstname': header.firstname,
+            'lastname': header.lastname,
+            'email': header.email,
+            'username': header.username,  # User whose profile is being viewed
             'pfp_url': pfp_url,
             'profile_picture_url': profile_picture_url,  # Profile picture URL for the logged-in user
-            'favorite_images': favorite_images,
-            'uploaded_images': uploaded_images,  # Images uploaded by the logged-in user
+            'favorites_count': header.favorites_count,
+            'uploads_count': header.uploads_count,
             'logged_in_username': logged_in_username,  # Added to display logged-in user's info in navbar
         }
     else:
@@ -350,45 +282,64 @@ def profile(request, username=None):
 
     return render(request, 'profile.html', context)
 
-def upload_image(request):
+def _profile_images_api(request, username, fetch_page):
+    # Keyset-paged grid images for the profile page's infinite scroll
+    if not request.session.get('username'):
+        return JsonResponse({'error': 'login_required'}, status=401)
+    limit = parse_limit(request.GET.get('limit'), settings.GALLERY_PAGE_SIZE, settings.GALLERY_MAX_PAGE_SIZE)
+    try:
+        after = decode_cursor(request.GET.get('cursor'), 1)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    page = fetch_page(username, limit, after)
+    return JsonResponse({
+        'results': page.images,
+        'next_cursor': encode_cursor(page.next_after) if page.next_after else None,
+    })
+
+def profile_favorites_api(request, username):
+    return _profile_images_api(request, username, profiles.favorites_page)
+
+def profile_uploads_api(request, username):
+    return _profile_images_api(request, username, profiles.uploads_page)
+
+async def upload_image(request):
     if request.method == 'POST':
-        description = request.POST.get('description')
+        post, files = await aio.form(request)
+        description = post.get('description')
         
         # Get the uploaded image file
-        uploaded_file = request.FILES.get('image')
+        uploaded_file = files.get('image')
         
         # Fetch the username from the session
-        username = request.session.get('username')
+        username = await aio.session_get(request, 'username')
         if not username:
             return HttpResponse("User not logged in", status=403)
         
-        # Initialize a session using Amazon S3
-        s3 = boto3.client('s3',
-                          aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                          region_name=settings.AWS_S3_REGION_NAME)
-        
-        # Define the S3 bucket and file name
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        if uploaded_file is None:
+            return HttpResponse("No image provided", status=400)
         file_name = uploaded_file.name
-        file_content = uploaded_file.read()
-        
-        # Upload the file to S3
-        s3.put_object(Bucket=bucket_name,
-                      Key=f'images/{file_name}',
-                      Body=file_content,
-                      ContentType=uploaded_file.content_type)
+
+        # Shared, pooled S3 client
+        s3 = get_s3()
+
+        # Stream the file to S3 in parts instead of reading it into memory
+        try:
+            await aio.blocking(stream_to_s3, s3, uploaded_file, f'images/{file_name}', uploaded_file.content_type)
+        except Exception:
+            logger.exception("S3 upload of %s failed", file_name)
+            return HttpResponse("Upload failed", status=502)
         
         # Remove the 'images/' prefix for the database
         db_file_name = file_name
 
+        # Render grid thumbnails and the blur placeholder from the same upload
+        uploaded_file.seek(0)
+        derivatives = await aio.blocking(generate_derivatives, s3, db_file_name, uploaded_file)
+
         # Save the image filename, description, and username to the database
-        sql_query = """
-            INSERT INTO images_table (image_key, description, "user")
-            VALUES (%s, %s, %s)
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(sql_query, [db_file_name, description, username])
+        await aio.db(insert_image, db_file_name, description, username, derivatives)
         
         return redirect('profile')
     else:
@@ -405,272 +356,205 @@ def delete_favorite_image(request):
         return JsonResponse({'error': 'No image key provided'}, status=400)
 
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                DELETE FROM favorites 
-                WHERE ctid = (
-                    SELECT ctid 
-                    FROM favorites 
-                    WHERE username = %s AND image_key = %s 
-                    LIMIT 1
-                )
-            """, [username, image_key])
-            
+        favorites.remove(username, [image_key])
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
-    
-def generate_image(request):
+
+def _favorite_keys(request):
+    # Keys from a JSON body {"image_keys": [...]} or repeated image_key form fields
+    if request.content_type == 'application/json':
+        try:
+            keys = json.loads(request.body).get('image_keys')
+        except (ValueError, AttributeError):
+            return None
+        if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+            return None
+        return keys
+    return request.POST.getlist('image_key') or request.POST.getlist('image_keys')
+
+def _bulk_favorites(request, change, result_name):
+    # Idempotent: keys already in (or already out of) the set are ignored
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
     username = request.session.get('username')
+    if not username:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+    keys = _favorite_keys(request)
+    if not keys:
+        return JsonResponse({'error': 'No image keys provided'}, status=400)
+    if len(keys) > settings.FAVORITES_BULK_LIMIT:
+        return JsonResponse({'error': f'At most {settings.FAVORITES_BULK_LIMIT} image keys per request'}, status=400)
+    return JsonResponse({'success': True, result_name: change(username, keys)})
+
+def favorites_add(request):
+    return _bulk_favorites(request, favorites.add, 'added')
+
+def favorites_remove(request):
+    return _bulk_favorites(request, favorites.remove, 'removed')
+
+
+def _queue_generation(username, plan, prompt, aspect_ratios):
+    # Reserve against the daily limit and queue the job together; None when the limit is reached.
+    # A failed enqueue rolls the reservation back.
+    with transaction.atomic():
+        if not quotas.reserve(username, plan, len(aspect_ratios)):
+            return None
+        return jobs.enqueue(username, prompt, aspect_ratios)
+
+async def generate_image(request):
+    username = await aio.session_get(request, 'username')
     profile_picture_url = '/static/images/dpfp.png'
 
     if username:
-        profile_picture_url = f'/profile-picture/{username}'
-    
-    # Load environment variables from .env file
-    load_dotenv()
-    api_token = os.getenv('REPLICATE_API_TOKEN')
-    
+        profile_picture_url = f'/profile-picture/{username}/?size=small'
+
     if request.method == 'POST' and username:
         if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'error': 'Invalid request'}, status=400)
 
-        prompt = request.POST.get('prompt')
-        aspect_ratio = request.POST.get('aspect_ratio', '9:16')
+        post, _ = await aio.form(request)
+        prompt = post.get('prompt')
+        # One aspect ratio per image; `count` repeats a single ratio for variations
+        aspect_ratios = post.getlist('aspect_ratios') or [post.get('aspect_ratio', '9:16')]
+        try:
+            count = max(len(aspect_ratios), int(post.get('count', 1)))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid count'}, status=400)
+        if count > settings.GENERATION_MAX_BATCH:
+            return JsonResponse({'error': f'At most {settings.GENERATION_MAX_BATCH} images per request'}, status=400)
+        if any(ratio not in ASPECT_RATIOS for ratio in aspect_ratios):
+            return JsonResponse({'error': 'Unsupported aspect ratio'}, status=400)
+        aspect_ratios = [aspect_ratios[i % len(aspect_ratios)] for i in range(count)]
 
         # Determine premium flag (0/1)
-        is_premium = bool(request.session.get('is_premium', False))
-        if username and not is_premium:
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute("SELECT premium FROM wallify_users WHERE username = %s", [username])
-                    row = cursor.fetchone()
-                    if row is not None:
-                        is_premium = bool(row[0])
-                        request.session['is_premium'] = is_premium
-            except Exception:
-                is_premium = False
-
-        # Check daily limit (skip if premium)
-        today = timezone.now().date()
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM ai_generations 
-                WHERE username = %s 
-                AND DATE(created_at) = %s
-            """, [username, today])
-            daily_count = cursor.fetchone()[0]
-
-            if not is_premium and daily_count >= 3:
-                return JsonResponse({
-                    'error': 'Daily limit reached! You can generate up to 3 images per day.',
-                    'upgrade': True
-                }, status=403)
-
         try:
-            output = replicate.run(
-                # "stability-ai/sdxl:7762fd07cf82c948538e41f63f77d685e02b063e37e496e96eefd46c929f9bdc",
-                "bytedance/seedream-3",
-                # "bytedance/hyper-flux-16step:382cf8959fb0f0d665b26e7e80b8d6dc3faaef1510f14ce017e8c732bb3d1eb7",
-                input={
-                    "size": "regular",
-                    "width": 2048,
-                    "height": 2048,
-                    "prompt": prompt,
-                    "aspect_ratio": aspect_ratio,
-                    "guidance_scale": 2.5
-                    # "width": 1440,
-                    # "height": 1440,
-                    # "prompt": prompt,
-                    # "num_outputs": 1,
-                    # "aspect_ratio": aspect_ratio, 
-                    # "output_format": "jpg",
-                    # "guidance_scale": 3.5,
-                    # "output_quality": 100,
-                    # "num_inference_steps": 16,
-                }
-            )
-            
-            # Normalize various output shapes from Replicate into a single image URL
-            def _extract_image_url(o: Any) -> Optional[str]:
-                try:
-                    # Case 1: direct string URL
-                    if isinstance(o, str):
-                        return o
-                    # Case 2: list/tuple of URLs or dicts
-                    if isinstance(o, (list, tuple)) and len(o) > 0:
-                        first = o[0]
-                        if isinstance(first, str):
-                            return first
-                        if isinstance(first, dict):
-                            # common keys
-                            for key in ("url", "image", "src"): 
-                                if key in first and isinstance(first[key], str):
-                                    return first[key]
-                            # nested
-                            if "images" in first and isinstance(first["images"], list) and first["images"]:
-                                img0 = first["images"][0]
-                                if isinstance(img0, str):
-                                    return img0
-                                if isinstance(img0, dict):
-                                    for key in ("url", "image", "src"):
-                                        if key in img0 and isinstance(img0[key], str):
-                                            return img0[key]
-                    # Case 3: dict output
-                    if isinstance(o, dict):
-                        # direct keys
-                        for key in ("url", "image", "output"):
-                            val = o.get(key)
-                            if isinstance(val, str):
-                                return val
-                            if isinstance(val, (list, tuple)) and val:
-                                if isinstance(val[0], str):
-                                    return val[0]
-                                if isinstance(val[0], dict):
-                                    for k in ("url", "image", "src"):
-                                        if k in val[0] and isinstance(val[0][k], str):
-                                            return val[0][k]
-                        # nested images
-                        images = o.get("images")
-                        if isinstance(images, (list, tuple)) and images:
-                            if isinstance(images[0], str):
-                                return images[0]
-                            if isinstance(images[0], dict):
-                                for k in ("url", "image", "src"):
-                                    if k in images[0] and isinstance(images[0][k], str):
-                                        return images[0][k]
-                except Exception:
-                    return None
-                return None
-
-            image_url = _extract_image_url(output)
-            if not image_url:
-                # Log unexpected shape for debugging
-                print("Unexpected Replicate output shape:", type(output), output)
-                return JsonResponse({'error': 'Failed to parse image URL from model output'}, status=500)
-
-            # Record the generation in database
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO ai_generations 
-                    (username, prompt, image_url, aspect_ratio, created_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, [username, prompt, image_url, aspect_ratio, timezone.now()])
-
-            # Download the image and mirror it into our S3 + DB like manual uploads
-            try:
-                r = requests.get(image_url, timeout=30)
-                if not r.ok or not r.content:
-                    raise RuntimeError(f"Failed to download generated image: status {r.status_code}")
-
-                content = r.content
-                # Infer content type and extension
-                content_type = r.headers.get('Content-Type', 'image/jpeg')
-                ext = 'jpg'
-                if 'png' in content_type:
-                    ext = 'png'
-                elif 'jpeg' in content_type or 'jpg' in content_type:
-                    ext = 'jpg'
-                elif 'webp' in content_type:
-                    ext = 'webp'
-
-                # Build unique key under images/ai/<username>/...
-                ts = timezone.now().strftime('%Y%m%d_%H%M%S')
-                key_relative = f"ai/{username}/{ts}_{uuid.uuid4().hex[:8]}.{ext}"
-                s3_key = f"images/{key_relative}"
-
-                # Upload to S3
-                s3 = boto3.client('s3',
-                                  aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                  aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                                  region_name=settings.AWS_S3_REGION_NAME)
-                s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                              Key=s3_key,
-                              Body=content,
-                              ContentType=content_type)
-
-                # Insert into images_table mirroring manual uploads and append AI keywords
-                description_keywords = f"{prompt}, ai-generated, AI, AI generated" if prompt else "ai-generated, AI, AI generated"
-                with connection.cursor() as cursor:
-                    cursor.execute(
-                        """
-                        INSERT INTO images_table (image_key, description, "user")
-                        VALUES (%s, %s, %s)
-                        """,
-                        [key_relative, description_keywords, username]
-                    )
-
-                s3_url = f"https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/images/{key_relative}"
-                return JsonResponse({'success': True, 'image_url': image_url, 's3_url': s3_url, 'image_key': key_relative})
-
-            except Exception as e:
-                # If mirroring fails, still return the generated image URL so the user sees it
-                print(f"S3 mirror failed: {e}")
-                return JsonResponse({'success': True, 'image_url': image_url, 'mirror_error': str(e)})
+            is_premium = await aio.db(entitlements.is_premium, username)
+        except Exception:
+            is_premium = False
 
-        except Exception as e:
-            print(f"Error generating image: {str(e)}")  # Add logging
-            return JsonResponse({'error': str(e)}, status=500)
+        # Several variations per submission is a premium feature
+        if not is_premium and count > 1:
+            return JsonResponse({
+                'error': 'Generating several variations at once is a Premium feature.',
+                'upgrade': True
+            }, status=403)
 
-    return render(request, 'generate_image.html', {
+        # The slow model call, download and mirroring run in the job queue
+        plan = quotas.plan_for(is_premium)
+        try:
+            job_id = await aio.db(_queue_generation, username, plan, prompt, aspect_ratios)
+        except Exception:
+            logger.exception("Could not queue image generation for %s", username)
+            return JsonResponse({'error': 'Could not start image generation, please try again.'}, status=500)
+        if job_id is None:
+            limit = quotas.daily_limit(plan)
+            return JsonResponse({
+                'error': f'Daily limit reached! You can generate up to {limit} images per day.',
+                'upgrade': True
+            }, status=403)
+        return JsonResponse({
+            'job_id': job_id,
+            'status': jobs.QUEUED,
+            'status_url': reverse('generation_job_status', args=[job_id]),
+        }, status=202)
+
+    is_premium = await aio.db(entitlements.is_premium, username)
+    # Rendered in the database thread: the page's context processors read the session
+    return await aio.db(render, request, 'generate_image.html', {
         'image_url': None,
         'username': username,
-        'profile_picture_url': profile_picture_url
+        'profile_picture_url': profile_picture_url,
+        'is_premium': is_premium,
+        'max_batch': range(1, settings.GENERATION_MAX_BATCH + 1),
     })
 
+def generation_job_status(request, job_id):
+    username = request.session.get('username')
+    if not username:
+        return JsonResponse({'error': 'login_required'}, status=401)
+
+    job = jobs.get_job(job_id)
+    if job is None or job.username != username:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    if job.status in jobs.PENDING:
+        # Wake this process's runner too, so jobs queued before a restart resume
+        jobs.runner.notify()
+    data = {'job_id': job.id, 'status': job.status}
+    if job.status == jobs.RUNNING:
+        data['progress'] = jobs.get_progress(job.id)
+    if job.status == jobs.SUCCEEDED:
+        data.update(success=True, image_url=job.image_url, image_key=job.image_key,
+                    images=jobs.job_images(job))
+        if job.error:
+            data['mirror_error'] = job.error
+    elif job.status == jobs.FAILED:
+        data['error'] = job.error or 'Failed to generate image'
+    return JsonResponse(data)
+
 # --- Stripe Billing ---
-def create_checkout_session(request):
+def _customer_email(username):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT email FROM wallify_users WHERE username = %s", [username])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] else None
+
+async def create_checkout_session(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
-    load_dotenv()
-    stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-    price_id = os.getenv('STRIPE_PRICE_ID')
-    app_base_url = os.getenv('APP_BASE_URL', 'http://localhost:8000')
+    price_id = settings.STRIPE_PRICE_ID
+    app_base_url = settings.APP_BASE_URL
 
-    username = request.session.get('username')
+    username = await aio.session_get(request, 'username')
     if not username:
         return JsonResponse({'error': 'login_required'}, status=401)
 
     try:
         # Try to supply customer email for better linkage (optional)
-        customer_email = None
         try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT email FROM wallify_users WHERE username = %s", [username])
-                row = cursor.fetchone()
-                if row and row[0]:
-                    customer_email = row[0]
+            customer_email = await aio.db(_customer_email, username)
         except Exception:
             customer_email = None
 
-        session = stripe.checkout.Session.create(
-            mode='subscription',
-            line_items=[{
+        session = await get_stripe_async().checkout.sessions.create_async(params={
+            'mode': 'subscription',
+            'line_items': [{
                 'price': price_id,
                 'quantity': 1,
             }],
-            success_url=f"{app_base_url}/?checkout=success&session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{app_base_url}/#pricing",
-            client_reference_id=username,
-            customer_email=customer_email,
-            metadata={
+            'success_url': f"{app_base_url}/?checkout=success&session_id={{CHECKOUT_SESSION_ID}}",
+            'cancel_url': f"{app_base_url}/#pricing",
+            'client_reference_id': username,
+            'customer_email': customer_email,
+            'metadata': {
                 'username': username
-            }
-        )
+            },
+        })
         return JsonResponse({'url': session.get('url')})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
+async def billing_status(request):
+    # Polled by the homepage after checkout until the webhook has been applied
+    username = await aio.session_get(request, 'username')
+    if not username:
+        return JsonResponse({'error': 'login_required'}, status=401)
+    return JsonResponse({'is_premium': await aio.db(entitlements.is_premium, username)})
+
+
 from django.views.decorators.csrf import csrf_exempt
 
+def _record_stripe_event(payload, event):
+    with transaction.atomic():
+        billing.record_event(payload.decode('utf-8'), event['id'], event['type'])
+
 @csrf_exempt
-def stripe_webhook(request):
-    # Verify webhook signature and mark user premium on checkout success
-    load_dotenv()
-    webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
+async def stripe_webhook(request):
+    # Verify webhook signature, then queue the event for billing
+    webhook_secret = settings.STRIPE_WEBHOOK_SECRET
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
 
@@ -678,7 +562,7 @@ def stripe_webhook(request):
         return HttpResponse(status=400)
 
     try:
-        event = stripe.Webhook.construct_event(
+        event = get_stripe().Webhook.construct_event(
             payload=payload,
             sig_header=sig_header,
             secret=webhook_secret
@@ -686,45 +570,42 @@ def stripe_webhook(request):
     except Exception:
         return HttpResponse(status=400)
 
-    print('Stripe webhook event:', event.get('type'))
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        md = session.get('metadata') or {}
-        username = None
-        if isinstance(md, dict):
-            username = md.get('username')
-        if not username:
-            username = session.get('client_reference_id')
-        if username:
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute("UPDATE wallify_users SET premium = 1 WHERE username = %s", [username])
-                # best-effort: if the user is the current session, update session flag
-                if request.session.get('username') == username:
-                    request.session['is_premium'] = True
-            except Exception:
-                pass
+    # Record and acknowledge; billing applies the event in the background.
+    # A database error returns 500 so Stripe redelivers later.
+    try:
+        await aio.db(_record_stripe_event, payload, event)
+    except Exception:
+        logger.exception("Stripe webhook %s could not be recorded", event['id'])
+        return HttpResponse(status=500)
 
     return HttpResponse(status=200)
 
+# Listing orders; 'activity' reads the denormalized last_activity_at (indexed with id)
+SUPPORT_SORTS = {
+    'activity': ('-last_activity_at', '-id'),
+    'newest': ('-created_at', '-id'),
+}
+
+
 def support(request):
     username = request.session.get('username')
     profile_picture_url = '/static/images/dpfp.png'
     if username:
-        profile_picture_url = f'/profile-picture/{username}'
+        profile_picture_url = f'/profile-picture/{username}/?size=small'
 
     query = request.GET.get('q', '')
     category = request.GET.get('category', '')
     status = request.GET.get('status', '')
-    
-    threads = SupportThread.objects.all().order_by('-created_at')
-    
+    sort = request.GET.get('sort', 'activity')
+    if sort not in SUPPORT_SORTS:
+        sort = 'activity'
+
+    threads = SupportThread.objects.all().order_by(*SUPPORT_SORTS[sort])
+
     # Apply filters
-    if query:
-        threads = threads.filter(
-            Q(title__icontains=query) |
-            Q(messages__content__icontains=query)
-        ).distinct()
+    matching = search_filter(query)
+    if matching is not None:
+        threads = threads.filter(id__in=matching)
     if category:
         threads = threads.filter(category=category)
     if status:
@@ -734,12 +615,17 @@ def support(request):
     paginator = Paginator(threads, 10)
     page = request.GET.get('page')
     threads = paginator.get_page(page)
+    # Page links keep the search and filters
+    filters = {'q': query, 'category': category, 'status': status, 'sort': sort}
+    filter_params = ''.join(f'&{name}={quote(value)}' for name, value in filters.items() if value)
     
     return render(request, 'support.html', {
         'threads': threads,
         'query': query,
         'category': category,
         'status': status,
+        'sort': sort,
+        'filter_params': filter_params,
         'username': username,
         'profile_picture_url': profile_picture_url
     })
@@ -748,35 +634,94 @@ def thread_detail(request, thread_id):
     username = request.session.get('username')
     profile_picture_url = '/static/images/dpfp.png'
     if username:
-        profile_picture_url = f'/profile-picture/{username}'
+        profile_picture_url = f'/profile-picture/{username}/?size=small'
 
     thread = get_object_or_404(SupportThread, id=thread_id)
-    messages = thread.messages.all().order_by('created_at')
     
     if request.method == 'POST' and not username:
         return JsonResponse({'error': 'login_required'}, status=401)
     
+    # The page posts replies with fetch and appends them without reloading
+    wants_json = 'application/json' in request.headers.get('Accept', '')
     if request.method == 'POST':
         content = request.POST.get('content')
         if content:
             # Check if user is admin (you'll need to implement this logic)
             is_admin = False  # Add your admin check logic here
             
-            ThreadMessage.objects.create(
+            message = ThreadMessage.objects.create(
                 thread=thread,
                 author_username=username,
                 content=content,
                 is_admin_reply=is_admin
             )
+            if wants_json:
+                return JsonResponse({'message': serialize_message(message)}, status=201)
             return redirect('thread_detail', thread_id=thread_id)
+        if wants_json:
+            return JsonResponse({'error': 'Reply is empty'}, status=400)
     
+    # Only the latest page; older ones and new replies come from thread_messages
+    page = messages_page(thread.id, settings.SUPPORT_MESSAGES_PAGE_SIZE)
     return render(request, 'thread_detail.html', {
         'thread': thread,
-        'messages': messages,
+        'messages': page.messages,
+        'before_cursor': encode_cursor(page.before) if page.before else '',
+        'after_cursor': encode_cursor(page.after) if page.after else '',
+        'long_poll_timeout': int(_long_poll_timeout(request)),
         'username': username,
         'profile_picture_url': profile_picture_url
     })
 
+def _long_poll_timeout(request):
+    # Under WSGI a held request ties up a worker thread, so only ASGI requests may wait
+    return settings.SUPPORT_LONG_POLL_TIMEOUT if isinstance(request, ASGIRequest) else 0
+
+def _message_cursor(request, name):
+    values = decode_cursor(request.GET.get(name), 2)
+    return parse_message_key(values) if values else None
+
+async def thread_messages(request, thread_id):
+    """
+    A thread's messages as JSON, keyset-paged on (created_at, id).
+
+    ?before=<cursor> returns the page preceding it; otherwise the messages
+    after ?after=<cursor>. With ?wait=<seconds> an empty answer is held
+    back until a reply is posted or the wait runs out (long-polling).
+    """
+    limit = parse_limit(request.GET.get('limit'), settings.SUPPORT_MESSAGES_PAGE_SIZE,
+                        settings.SUPPORT_MESSAGES_MAX_PAGE_SIZE)
+    try:
+        before = _message_cursor(request, 'before')
+        after = _message_cursor(request, 'after')
+        wait = float(request.GET.get('wait') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or wait'}, status=400)
+    # NaN compares false, so it ends up as no wait at all
+    wait = min(wait, _long_poll_timeout(request)) if wait > 0 else 0
+
+    if not await aio.db(SupportThread.objects.filter(id=thread_id).exists):
+        return JsonResponse({'error': 'Thread not found'}, status=404)
+
+    if before:
+        page = await aio.db(messages_page, thread_id, limit, before)
+    else:
+        deadline = time.monotonic() + wait
+        # One index probe per interval; the wait holds no thread when served over ASGI
+        while True:
+            page = await aio.db(messages_since, thread_id, limit, after)
+            remaining = deadline - time.monotonic()
+            if page.messages or remaining <= 0:
+                break
+            await asyncio.sleep(min(settings.SUPPORT_POLL_INTERVAL, remaining))
+
+    return JsonResponse({
+        'messages': [serialize_message(message) for message in page.messages],
+        'before': encode_cursor(page.before) if page.before else None,
+        'after': encode_cursor(page.after) if page.after else None,
+        'more': page.more,
+    })
+
 def create_thread(request):
     username = request.session.get('username')
     if not username:
@@ -813,7 +758,8 @@ def change_thread_status(request, thread_id, new_status):
     if username == thread.author_username or is_admin:
         if new_status in ['open', 'resolved', 'closed']:
             thread.status = new_status
-            thread.save()
+            # The message totals are maintained in SQL; don't write back stale copies
+            thread.save(update_fields=['status'])
             messages.success(request, f'Thread status updated to {new_status}')
     else:
         messages.error(request, "You don't have permission to change thread status.")
@@ -839,4 +785,24 @@ def delete_thread(request, thread_id):
     # Delete the thread (cascade will remove messages)
     thread.delete()
     messages.success(request, 'Thread deleted successfully.')
-    return redirect('support')
\ No newline at end of file
+    return redirect('support')
+
+
+def prometheus_metrics(request):
+    # Internal scrape target: bearer token when METRICS_TOKEN is set; without one,
+    # local development only. Behind a proxy every client looks private, so
+    # addresses alone never open it in production.
+    token = settings.METRICS_TOKEN
+    if token:
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), f'Bearer {token}'.encode()):
+            return HttpResponse(status=403)
+    elif not settings.DEBUG:
+        return HttpResponse(status=404)
+    else:
+        try:
+            address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+        except ValueError:
+            return HttpResponse(status=403)
+        if not (address.is_loopback or address.is_private):
+            return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')